@@ -0,0 +1,57 @@
+"""
+Characters per event of the EventFormatter densities.
+
+Formats the same upcoming events at every density and prints the length of
+the answer, per event and relative to verbose. The events spread over the
+next days and come from one or several calendars, with and without
+locations, like a {CALENDAR} answer.
+
+    python benchmarks/formatter_benchmark.py --events 8 --calendars 2
+"""
+
+import os
+import sys
+import argparse
+from datetime import datetime, date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_core import Event, EventFormatter
+
+TITLES = ["Standup", "Design review", "Lunch with Anna", "Dentist", "1:1 with manager", "Sprint planning",
+          "Gym", "Call with the bank", "Team retrospective", "Flight to Berlin"]
+LOCATIONS = ["Room 1", "", "Cafe Roma", "Via Roma 3", "", "Room 2", "City gym", "", "Room 1", "FRA Terminal 1"]
+
+def make_events(count: int, calendars: int, today: date):
+    """Get count events, about three a day from today, spread over calendars."""
+    names = ["Work", "Home", "Family", "Sport"][:max(calendars, 1)]
+    events = []
+    for i in range(count):
+        start = datetime.combine(today + timedelta(days=i // 3), datetime.min.time()) + timedelta(hours=9 + 3 * (i % 3))
+        events.append(Event(TITLES[i % len(TITLES)], start, start + timedelta(minutes=45),
+                            location=LOCATIONS[i % len(LOCATIONS)], calendar_name=names[i % len(names)]))
+    return events
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the answer size of the event list densities.")
+    parser.add_argument("--events", type=int, default=8, help="number of events (default: 8)")
+    parser.add_argument("--calendars", type=int, default=2, help="number of calendars, 1 to 4 (default: 2)")
+    parser.add_argument("--show", action="store_true", help="print the answers")
+    args = parser.parse_args(argv)
+
+    today = date.today()
+    events = make_events(args.events, args.calendars, today)
+    header = f"Next {len(events)} upcoming events:"
+    verbose_length = None
+    print(f"{len(events)} events from {min(args.calendars, 4)} calendars")
+    for density in EventFormatter.DENSITIES:
+        text, _ = EventFormatter(density, today=today).format(events, header)
+        verbose_length = verbose_length or len(text)
+        print(f"  {density:<9} {len(text):6} chars  {len(text) / len(events):6.1f} per event  "
+              f"{len(text) / verbose_length:6.0%} of verbose")
+        if args.show:
+            print(text + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
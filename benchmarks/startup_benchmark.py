@@ -0,0 +1,101 @@
+"""
+Time to the first {CALENDAR} answer of the extension, from a fresh interpreter.
+
+Every scenario runs in a new process that imports calendar_core and answers
+like the {CALENDAR} prompt does:
+
+- cold: parse the calendar in memory, then list the upcoming events
+- sqlite first start: parse the calendar into a new SQLite store
+- sqlite unchanged: reopen that store, the unchanged file is not parsed again
+- snapshot: list the upcoming events saved by the previous start, what the
+  extension answers with while the calendars parse in the background
+
+    python benchmarks/startup_benchmark.py --events 20000 --runs 5
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+from datetime import datetime, date, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run with -P so the folder of calendar.py never shadows the standard library calendar module
+SCENARIO = """
+import sys
+from time import perf_counter
+started = perf_counter()
+sys.path.append({repo!r})
+import json
+from datetime import date
+from calendar_core import CalendarManager, CalendarQueries, Event, MemoryEventStore, SQLiteEventStore
+mode, calendar_file, database, snapshot = {mode!r}, {calendar_file!r}, {database!r}, {snapshot!r}
+queries = CalendarQueries()
+if mode == "snapshot":
+    with open(snapshot) as f:
+        events = [Event.from_dict(event_dict) for event_dict in json.load(f)["events"]]
+else:
+    store = SQLiteEventStore(database) if mode.startswith("sqlite") else MemoryEventStore()
+    calendar_manager = CalendarManager([calendar_file], store)
+    events = calendar_manager.get_upcoming_events(date.today(), limit=CalendarQueries.UPCOMING_LIMIT)
+    if mode == "cold":
+        with open(snapshot, "w") as f:
+            json.dump({{"date": date.today().isoformat(), "events": [event.to_dict() for event in events]}}, f)
+answer = queries.format_upcoming_events(events)
+print((perf_counter() - started) * 1000)
+"""
+
+SCENARIOS = {"cold": "cold", "sqlite first start": "sqlite", "sqlite unchanged": "sqlite", "snapshot": "snapshot"}
+
+def write_calendar(path: str, count: int):
+    """Write a calendar of count timed events, one every three hours around today, and some all-day ones."""
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Newelle Calendar//Benchmark//EN", "X-WR-CALNAME:Benchmark"]
+    base = datetime.combine(date.today(), datetime.min.time()) - timedelta(hours=3 * count // 2)
+    for i in range(count):
+        start = base + timedelta(hours=3 * i)
+        lines += ["BEGIN:VEVENT", f"UID:benchmark-{i}", f"SUMMARY:Meeting {i % 7} with team",
+                  "DTSTART:" + start.strftime("%Y%m%dT%H%M%S"),
+                  "DTEND:" + (start + timedelta(minutes=45)).strftime("%Y%m%dT%H%M%S"),
+                  f"LOCATION:Room {i % 3}", "DESCRIPTION:Weekly review of the open tickets and of the plan",
+                  " ning for the next sprint", "END:VEVENT"]
+        if i % 10 == 0:
+            lines += ["BEGIN:VEVENT", f"UID:benchmark-day-{i}", "SUMMARY:Holiday",
+                      "DTSTART;VALUE=DATE:" + start.strftime("%Y%m%d"),
+                      "DTEND;VALUE=DATE:" + (start + timedelta(days=1)).strftime("%Y%m%d"), "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    with open(path, "w", newline="") as f:
+        f.write("\r\n".join(lines) + "\r\n")
+
+def run_scenario(scenario: str, calendar_file: str, database: str, snapshot: str) -> float:
+    """Run a scenario in a new interpreter, returning the ms from the import of calendar_core to the answer."""
+    code = SCENARIO.format(repo=REPO, mode=SCENARIOS[scenario], calendar_file=calendar_file, database=database,
+                           snapshot=snapshot)
+    result = subprocess.run([sys.executable, "-P", "-c", code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the time to the first {CALENDAR} answer.")
+    parser.add_argument("--events", type=int, default=20000, help="events of the generated calendar")
+    parser.add_argument("--runs", type=int, default=3, help="runs of each scenario, the median is shown")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        calendar_file = os.path.join(folder, "benchmark.ics")
+        write_calendar(calendar_file, args.events)
+        snapshot = os.path.join(folder, "snapshot.json")
+        print(f"{args.events} events, {os.path.getsize(calendar_file) / 1e6:.1f} MB, median of {args.runs} runs")
+        for scenario in SCENARIOS:
+            timings = []
+            for run in range(args.runs):
+                database = os.path.join(folder, "events.sqlite")
+                if scenario == "sqlite first start" and os.path.exists(database):
+                    os.remove(database)
+                timings.append(run_scenario(scenario, calendar_file, database, snapshot))
+            print(f"  {scenario:<20} {median(timings):9.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4678 @@
+"""
+GTK-free core of the Newelle calendar extension: the event model, the ICS
+reader and writer, the event stores and indexes and the calendar manager.
+
+It can be used without a display, for scripting, benchmarks and tests, and
+as a command line tool giving the same answers as the extension code blocks:
+
+    python calendar_core.py -f work.ics -f home.ics search Dentist 2025-01-01 2025-12-31
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    # Run as a script its folder comes first on the path, where the extension's
+    # calendar.py would shadow the standard library calendar module
+    _folder = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != _folder]
+
+import re
+import json
+import mmap
+import sqlite3
+import logging
+import argparse
+import threading
+import tempfile
+import gzip
+import heapq
+import zlib
+import hashlib
+import urllib.parse
+import base64
+from array import array
+from bisect import bisect_left, bisect_right
+import shutil
+from collections import OrderedDict
+from contextlib import nullcontext
+from time import perf_counter
+from datetime import datetime, date, time, timedelta
+from typing import List, Dict, Optional, Tuple
+from dateutil import tz
+import uuid
+
+# Optional, only speeds up the eventstats block and semantic search. Imported
+# by _load_numpy when first needed, as it takes longer to import than the rest
+numpy = None
+_numpy_loaded = False
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, writes are then only serialized within Newelle
+    fcntl = None
+
+__all__ = [
+    "Event", "CalendarStats", "calendar_stats", "CalendarProfiler", "calendar_profiler",
+    "ICSReader", "ICSLayout", "CalendarFileLock", "CalendarBackups", "CalendarOperationLog",
+    "CalendarManager", "EventColumns", "EventStore", "WordIndex", "MemoryEventStore", "SQLiteEventStore",
+    "CalDAVClient", "CalDAVCalendar", "CalendarSubscriptions",
+    "HashingEmbedder", "SentenceTransformerEmbedder", "EventEmbeddings",
+    "EventQuery", "SearchResult", "SearchResultCache", "EventFormatter", "CalendarQueries",
+]
+
+def _load_numpy():
+    """Import numpy into the module on first use, returning None if it is not installed."""
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy as numpy_module
+            numpy = numpy_module
+        except ImportError:
+            pass
+    return numpy
+
+class Event:
+    """Represents a calendar event."""
+    
+    def __init__(self, summary: str, start_time: datetime, end_time: datetime, 
+                 description: str = "", location: str = "", calendar_name: str = "",
+                 uid: str = None, all_day: bool = False, recurrence_id: str = ""):
+        self.summary = summary
+        self.start_time = start_time
+        self.end_time = end_time
+        self.description = description
+        self.location = location
+        self.calendar_name = calendar_name
+        self.uid = uid or str(uuid.uuid4())
+        self.all_day = all_day
+        self.recurrence_id = recurrence_id  # RECURRENCE-ID value of an overridden occurrence
+    
+    def __str__(self):
+        if self.all_day:
+            return f"{self.summary}"
+        return f"{self.start_time.strftime('%H:%M')} - {self.summary}"
+    
+    def sort_key(self):
+        """Key giving a stable ordering: start time, then title, then UID."""
+        start_time = self.start_time
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=tz.tzlocal())
+        return (start_time, self.summary.lower(), self.uid)
+    
+    def identity(self) -> Tuple[str, str]:
+        """Key identifying the event within its calendar: UID and recurrence-id."""
+        return (self.uid, self.recurrence_id)
+    
+    def to_dict(self):
+        """Convert event to dictionary for serialization."""
+        return {
+            'summary': self.summary,
+            'start_time': self.start_time.isoformat(),
+            'end_time': self.end_time.isoformat(),
+            'description': self.description,
+            'location': self.location,
+            'calendar_name': self.calendar_name,
+            'uid': self.uid,
+            'all_day': self.all_day,
+            'recurrence_id': self.recurrence_id
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Create event from dictionary."""
+        return cls(
+            summary=data['summary'],
+            start_time=datetime.fromisoformat(data['start_time']),
+            end_time=datetime.fromisoformat(data['end_time']),
+            description=data.get('description', ''),
+            location=data.get('location', ''),
+            calendar_name=data.get('calendar_name', ''),
+            uid=data.get('uid'),
+            all_day=data.get('all_day', False),
+            recurrence_id=data.get('recurrence_id', '')
+        )
+
+class CalendarStats:
+    """Timings and counters for the calendar hot paths, near free when disabled."""
+    
+    _NULL_TIMER = nullcontext()
+    
+    def __init__(self):
+        self.enabled = False
+        self.logger = logging.getLogger("newelle.calendar")
+        self.log_handler = None
+        self.timings = {}   # Dict[str, List[float]] - Name to [count, total, max] seconds
+        self.counters = {}  # Dict[str, int]
+        self.files = {}     # Dict[str, Tuple[float, int]] - File path to (parse seconds, events)
+    
+    def configure(self, enabled: bool, log_path: str = None):
+        """Enable or disable collection, logging to log_path when enabled."""
+        self.enabled = enabled
+        if self.log_handler is not None and (not enabled or self.log_handler.baseFilename != log_path):
+            self.logger.removeHandler(self.log_handler)
+            self.log_handler.close()
+            self.log_handler = None
+        if enabled and log_path and self.log_handler is None:
+            try:
+                self.log_handler = logging.FileHandler(log_path)
+                self.log_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self.logger.addHandler(self.log_handler)
+                self.logger.setLevel(logging.DEBUG)
+            except OSError as e:
+                print(f"Could not open calendar stats log {log_path}: {e}")
+    
+    def timer(self, name: str):
+        """Context manager timing a block under the given name."""
+        if not self.enabled:
+            return self._NULL_TIMER
+        return _StatsTimer(self, name)
+    
+    def record(self, name: str, seconds: float):
+        """Record a duration."""
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+        self.logger.debug("%s took %.2f ms", name, seconds * 1000)
+    
+    def count(self, name: str, amount: int = 1):
+        """Increment a counter."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def record_file(self, file_path: str, seconds: float, events: int):
+        """Record the parse time and event count of a calendar file."""
+        if self.enabled:
+            self.files[file_path] = (seconds, events)
+            self.logger.debug("Parsed %s: %d events in %.2f ms", file_path, events, seconds * 1000)
+    
+    def log(self, message: str, *args):
+        """Write a message to the debug log sink."""
+        if self.enabled:
+            self.logger.debug(message, *args)
+    
+    def reset(self):
+        """Forget all collected statistics."""
+        self.timings.clear()
+        self.counters.clear()
+        self.files.clear()
+    
+    def summary(self) -> str:
+        """Format the collected statistics as a compact table."""
+        lines = []
+        if self.files:
+            lines.append("Files (events, parse ms):")
+            for file_path, (seconds, events) in self.files.items():
+                lines.append(f"  {os.path.basename(file_path)}: {events}, {seconds * 1000:.1f}")
+        if self.timings:
+            lines.append("Timings (calls, avg ms, max ms):")
+            for name, (calls, total, longest) in sorted(self.timings.items()):
+                lines.append(f"  {name}: {calls}, {total / calls * 1000:.2f}, {longest * 1000:.2f}")
+        if self.counters:
+            lines.append("Counters:")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"  {name}: {value}")
+            for name in sorted(self.counters):
+                if name.endswith(".hit"):
+                    prefix = name[:-len(".hit")]
+                    hits = self.counters[name]
+                    total = hits + self.counters.get(prefix + ".miss", 0)
+                    lines.append(f"  {prefix} hit rate: {hits / total * 100:.0f}%")
+        return "\n".join(lines) if lines else "No statistics collected yet"
+
+class _StatsTimer:
+    """Times a block and records it into CalendarStats."""
+    
+    __slots__ = ("stats", "name", "start")
+    
+    def __init__(self, stats: CalendarStats, name: str):
+        self.stats = stats
+        self.name = name
+    
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        self.stats.record(self.name, perf_counter() - self.start)
+        return False
+
+calendar_stats = CalendarStats()
+
+class CalendarProfiler:
+    """Captures cProfile and tracemalloc snapshots of the calendar handlers."""
+    
+    MAX_BYTES = 20 * 1024 * 1024  # Disk cap for the profiles directory
+    TOP_ALLOCATIONS = 25
+    
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.max_bytes = self.MAX_BYTES
+        self.active = False
+    
+    def configure(self, enabled: bool, directory: str = None):
+        """Enable or disable profiling, writing the profiles to directory."""
+        self.enabled = enabled and directory is not None
+        self.directory = directory
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+    
+    def profile(self, name: str):
+        """Context manager profiling a block, a no-op when disabled or nested."""
+        if not self.enabled or self.active:
+            return nullcontext()
+        return _ProfileSession(self, name)
+    
+    def save(self, name: str, profiler, before, after):
+        """Write a cProfile profile and its tracemalloc allocation summary, then enforce the disk cap."""
+        stem = os.path.join(self.directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}")
+        try:
+            profiler.dump_stats(stem + ".prof")
+            with open(stem + ".txt", "w") as f:
+                f.write(f"Top {self.TOP_ALLOCATIONS} allocations in {name}:\n")
+                for stat in after.compare_to(before, "lineno")[:self.TOP_ALLOCATIONS]:
+                    f.write(f"{stat}\n")
+        except OSError as e:
+            print(f"Could not write calendar profile {stem}: {e}")
+        self._rotate()
+    
+    def _rotate(self):
+        """Delete the oldest files until the directory fits within max_bytes."""
+        try:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+class _ProfileSession:
+    """A single profiled block."""
+    
+    def __init__(self, profiler: CalendarProfiler, name: str):
+        self.owner = profiler
+        self.name = name
+        self.started_tracemalloc = False
+    
+    def __enter__(self):
+        # Only imported when profiling, they slow down the import of the extension
+        import cProfile
+        import tracemalloc
+        self.owner.active = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.before = tracemalloc.take_snapshot()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        import tracemalloc
+        self.profiler.disable()
+        after = tracemalloc.take_snapshot()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        self.owner.active = False
+        self.owner.save(self.name, self.profiler, self.before, after)
+        return False
+
+calendar_profiler = CalendarProfiler()
+
+class ICSReader:
+    """
+    Reads the events of an iCal file without building the iCal tree.
+    
+    The file is memory-mapped and its content lines are unfolded as memoryview
+    slices of the mapping, only the properties used by Event are decoded.
+    Anything unusual raises Unsupported so the caller can use icalendar.
+    The byte span of every VEVENT is recorded in layout for surgical rewrites.
+    """
+    
+    PROPERTIES = {b"DTSTART", b"DTEND", b"SUMMARY", b"UID", b"LOCATION", b"DESCRIPTION", b"RECURRENCE-ID"}
+    IDENTITY_PROPERTIES = {b"UID", b"RECURRENCE-ID"}
+    TEXT_ESCAPE_PATTERN = re.compile(r"\\([\\;,nN])")
+    
+    class Unsupported(Exception):
+        """Raised when a file needs the full iCal parser."""
+    
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.calendar_name = None
+        self.layout = None
+    
+    def read_events(self) -> List[Event]:
+        """Read all events of the file, their calendar_name is left for the caller."""
+        return self._read(build_events=True)
+    
+    def read_layout(self) -> "ICSLayout":
+        """Only record the VEVENT byte spans, without decoding dates."""
+        self._read(build_events=False)
+        return self.layout
+    
+    def _read(self, build_events: bool) -> List[Event]:
+        """Map the file and scan it, turning any failure into Unsupported."""
+        try:
+            stamp = os.stat(self.file_path)
+            with open(self.file_path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    events = self._read_events(buffer, build_events)
+            self.layout.stamp = (stamp.st_mtime_ns, stamp.st_size)
+            return events
+        except ICSReader.Unsupported:
+            raise
+        except Exception as e:
+            raise ICSReader.Unsupported(str(e)) from e
+    
+    def _read_events(self, buffer, build_events: bool = True) -> List[Event]:
+        """Collect the wanted properties of every VEVENT and build the events."""
+        events = []
+        spans = {}  # Dict[Tuple[str, str], List[Tuple[int, int]]] - Event identity to VEVENT byte spans
+        calendar_end = None
+        wanted = self.PROPERTIES if build_events else self.IDENTITY_PROPERTIES
+        view = memoryview(buffer)
+        try:
+            properties = None
+            event_start = 0
+            nested = 0  # Depth of subcomponents like VALARM inside the current VEVENT
+            for parts in self.iter_content_lines(buffer):
+                start, end = parts[0]
+                separator = self._find_separator(buffer, start, end)
+                if separator < 0:
+                    raise ICSReader.Unsupported("content line without a value")
+                name = buffer[start:separator].upper()
+                
+                if name == b"BEGIN" or name == b"END":
+                    component = bytes(buffer[separator + 1:end]).strip().upper()
+                    if name == b"BEGIN":
+                        if properties is not None:
+                            nested += 1
+                        elif component == b"VEVENT":
+                            properties = {}
+                            event_start = start
+                    elif properties is not None:
+                        if nested:
+                            nested -= 1
+                        elif component == b"VEVENT":
+                            # The span ends after the line break of END:VEVENT
+                            event_end = buffer.find(b"\n", parts[-1][1])
+                            event_end = len(buffer) if event_end < 0 else event_end + 1
+                            spans.setdefault(self._identity(properties), []).append((event_start, event_end))
+                            if build_events:
+                                event = self._build_event(properties)
+                                if event:
+                                    events.append(event)
+                            properties = None
+                    elif component == b"VCALENDAR":
+                        calendar_end = start
+                elif properties is not None:
+                    if not nested and name in wanted:
+                        properties[name] = self._decode_line(view, parts)
+                elif name == b"X-WR-CALNAME" and self.calendar_name is None:
+                    params, value = self._split_property(self._decode_line(view, parts))
+                    self.calendar_name = self._unescape_text(value)
+        finally:
+            view.release()
+        if calendar_end is None:
+            raise ICSReader.Unsupported("missing END:VCALENDAR")
+        self.layout = ICSLayout(None, spans, calendar_end)
+        return events
+    
+    @staticmethod
+    def iter_content_lines(buffer):
+        """
+        Iterate over the unfolded content lines of a buffer.
+        
+        Yields:
+            List of (start, end) byte ranges making up one logical line,
+            continuation ranges skip the leading folding whitespace
+        """
+        size = len(buffer)
+        position = 0
+        parts = None
+        while position < size:
+            newline = buffer.find(b"\n", position)
+            if newline < 0:
+                newline = size
+            end = newline
+            if end > position and buffer[end - 1] == 13:  # Strip the CR of CRLF
+                end -= 1
+            if end > position:
+                first = buffer[position]
+                if first == 32 or first == 9:
+                    if parts is not None:
+                        parts.append((position + 1, end))
+                else:
+                    if parts is not None:
+                        yield parts
+                    parts = [(position, end)]
+            position = newline + 1
+        if parts is not None:
+            yield parts
+    
+    @staticmethod
+    def _find_separator(buffer, start: int, end: int) -> int:
+        """Find where the property name ends in the first range of a content line."""
+        colon = buffer.find(b":", start, end)
+        semicolon = buffer.find(b";", start, end)
+        if semicolon >= 0 and (colon < 0 or semicolon < colon):
+            return semicolon
+        return colon
+    
+    @staticmethod
+    def _decode_line(view: memoryview, parts: List[Tuple[int, int]]) -> str:
+        """Join the memoryview slices of a content line and decode them."""
+        if len(parts) == 1:
+            start, end = parts[0]
+            return str(view[start:end], "utf-8", "replace")
+        return b"".join([view[start:end] for start, end in parts]).decode("utf-8", "replace")
+    
+    @staticmethod
+    def _split_property(line: str) -> Tuple[Dict[str, str], str]:
+        """Split a decoded content line into its parameters and value."""
+        colon = line.find(":")
+        quote = line.find('"')
+        if 0 <= quote < colon:
+            # A quoted parameter value may contain colons
+            in_quotes = False
+            for index, char in enumerate(line):
+                if char == '"':
+                    in_quotes = not in_quotes
+                elif char == ":" and not in_quotes:
+                    colon = index
+                    break
+        if colon < 0:
+            raise ICSReader.Unsupported("content line without a value")
+        params = {}
+        for param in line[:colon].split(";")[1:]:
+            key, _, value = param.partition("=")
+            params[key.upper()] = value.strip('"')
+        return params, line[colon + 1:]
+    
+    @classmethod
+    def _unescape_text(cls, value: str) -> str:
+        """Undo the escaping of a TEXT value."""
+        if "\\" not in value:
+            return value
+        return cls.TEXT_ESCAPE_PATTERN.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+    
+    @staticmethod
+    def _parse_date_value(params: Dict[str, str], value: str):
+        """Parse a DATE or DATE-TIME value the way icalendar would."""
+        value = value.strip()
+        if params.get("VALUE", "").upper() == "DATE" or len(value) == 8:
+            return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+        if len(value) < 15 or value[8] != "T" or params.get("VALUE", "DATE-TIME").upper() != "DATE-TIME":
+            raise ICSReader.Unsupported(f"unsupported date value {value}")
+        moment = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                          int(value[9:11]), int(value[11:13]), int(value[13:15]))
+        if value.endswith("Z"):
+            return moment.replace(tzinfo=tz.UTC)
+        tzid = params.get("TZID")
+        if tzid:
+            zone = tz.gettz(tzid)
+            if zone is None:
+                # Custom VTIMEZONE definitions are only understood by icalendar
+                raise ICSReader.Unsupported(f"unknown time zone {tzid}")
+            return moment.replace(tzinfo=zone)
+        return moment
+    
+    def _identity(self, properties: Dict[bytes, str]) -> Tuple[str, str]:
+        """Get the (UID, recurrence-id) of a VEVENT from its decoded content lines."""
+        uid = self._unescape_text(self._split_property(properties[b"UID"])[1]) if b"UID" in properties else ""
+        recurrence_id = self._split_property(properties[b"RECURRENCE-ID"])[1].strip() \
+            if b"RECURRENCE-ID" in properties else ""
+        return (uid, recurrence_id)
+    
+    def _build_event(self, properties: Dict[bytes, str]) -> Optional[Event]:
+        """Build an Event from the decoded content lines of a VEVENT."""
+        if b"DTSTART" not in properties:
+            return None
+        values = {}
+        for name, line in properties.items():
+            values[name] = self._split_property(line)
+        
+        start_dt = self._parse_date_value(*values[b"DTSTART"])
+        end_dt = self._parse_date_value(*values[b"DTEND"]) if b"DTEND" in values else None
+        if isinstance(start_dt, datetime) != isinstance(end_dt, datetime) and end_dt is not None:
+            raise ICSReader.Unsupported("DTSTART and DTEND have different value types")
+        
+        def text(name: bytes, default: str = "") -> str:
+            return self._unescape_text(values[name][1]) if name in values else default
+        
+        return CalendarManager._make_event(
+            summary=text(b"SUMMARY", "Untitled Event"),
+            start_dt=start_dt,
+            end_dt=end_dt,
+            description=text(b"DESCRIPTION"),
+            location=text(b"LOCATION"),
+            uid=text(b"UID"),
+            calendar_name="",
+            recurrence_id=values[b"RECURRENCE-ID"][1].strip() if b"RECURRENCE-ID" in values else ""
+        )
+
+class ICSLayout:
+    """Byte spans of the VEVENTs of an iCal file, valid for one file stamp."""
+    
+    def __init__(self, stamp: Optional[Tuple[int, int]], spans: Dict[Tuple[str, str], List[Tuple[int, int]]],
+                 calendar_end: int):
+        self.stamp = stamp
+        self.spans = spans  # (UID, recurrence-id) to byte spans
+        self.calendar_end = calendar_end  # Offset of the END:VCALENDAR line
+    
+    def plan(self, remove_identities, added: List[Tuple[Tuple[str, str], bytes]]) -> Optional[list]:
+        """
+        Turn a change into edits replacing byte ranges of the file.
+        
+        An added VEVENT whose identity is removed takes the place of the old
+        one, the others are inserted before END:VCALENDAR.
+        
+        Returns:
+            Edits (start, end, [(identity, data)]) sorted by start, or None if
+            a removed identity has no known span
+        """
+        edits = {}
+        for identity in remove_identities:
+            spans = self.spans.get(identity)
+            if not spans:
+                return None
+            for span in spans:
+                edits[span] = []
+        appended = []
+        for identity, data in added:
+            if identity in remove_identities:
+                edits[self.spans[identity][0]].append((identity, data))
+            else:
+                appended.append((identity, data))
+        if appended:
+            edits[(self.calendar_end, self.calendar_end)] = appended
+        return [(start, end, items) for (start, end), items in sorted(edits.items(), key=lambda edit: edit[0])]
+    
+    def apply(self, edits: list, stamp: Tuple[int, int]):
+        """Shift the spans once the edits of plan() were written to the file."""
+        replaced = {(start, end) for start, end, items in edits if start != end}
+        starts = [start for start, end, items in edits]
+        shifts = [0]
+        for start, end, items in edits:
+            shifts.append(shifts[-1] + sum(len(data) for identity, data in items) - (end - start))
+        
+        spans = {}
+        for identity, old_spans in self.spans.items():
+            kept = []
+            for start, end in old_spans:
+                if (start, end) not in replaced:
+                    shift = shifts[bisect_left(starts, start)]
+                    kept.append((start + shift, end + shift))
+            if kept:
+                spans[identity] = kept
+        for index, (start, end, items) in enumerate(edits):
+            position = start + shifts[index]
+            for identity, data in items:
+                spans.setdefault(identity, []).append((position, position + len(data)))
+                position += len(data)
+        
+        self.calendar_end += shifts[bisect_right(starts, self.calendar_end)]
+        self.spans = spans
+        self.stamp = stamp
+
+class CalendarFileLock:
+    """
+    Exclusive lock on a calendar file, across threads and processes.
+    
+    Threads wait on a lock shared per file. Other processes, such as a second
+    Newelle instance, wait on an fcntl advisory lock of a .lock file named by
+    a hash of the calendar path, kept in the user's cache folder so that
+    nothing is left next to the calendars. Every process writing calendars,
+    the extension as well as the command line tool, uses that same folder.
+    The lock is reentrant within a thread.
+    """
+    
+    directory = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                             "newelle-calendar", "locks")
+    _locks = {}  # Dict[str, CalendarFileLock] - Real path to lock
+    _locks_lock = threading.Lock()
+    
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+    
+    @property
+    def lock_path(self) -> str:
+        """The lock file of the calendar."""
+        name = hashlib.sha1(self.file_path.encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}.lock")
+    
+    @classmethod
+    def for_path(cls, file_path: str) -> "CalendarFileLock":
+        """Get the lock shared by every writer of a file."""
+        file_path = os.path.realpath(file_path)
+        with cls._locks_lock:
+            lock = cls._locks.get(file_path)
+            if lock is None:
+                lock = cls._locks[file_path] = cls(file_path)
+            return lock
+    
+    def __enter__(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1 and fcntl is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self.lock_file = open(self.lock_path, 'a')
+                with calendar_stats.timer("file.lock_wait"):
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            except OSError as e:
+                # E.g. a read-only folder, writes are still serialized within this process
+                calendar_stats.log("Could not lock %s: %s", self.lock_path, e)
+                if self.lock_file is not None:
+                    self.lock_file.close()
+                    self.lock_file = None
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        self.depth -= 1
+        if self.depth == 0 and self.lock_file is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.lock.release()
+
+class CalendarBackups:
+    """
+    Rotating backups of calendar files, taken before they are changed.
+    
+    A file is backed up at most once per time window, so a burst of changes
+    costs a single backup. The oldest kept generation holds the whole
+    calendar, the following ones only the VEVENTs added, changed or removed
+    since the previous generation, found by comparing hashes of their bytes.
+    Generations are gzip compressed and the last `generations` are kept.
+    """
+    
+    WINDOW_SECONDS = 3600
+    GENERATIONS = 10
+    
+    def __init__(self, directory: str = None, window_seconds: float = WINDOW_SECONDS, generations: int = GENERATIONS):
+        """
+        Initialize the backups.
+        
+        Args:
+            directory: Folder of the backups, by default a hidden folder next to each calendar
+            window_seconds: Minimum time between two backups of a file
+            generations: Number of backups kept per file
+        """
+        self.directory = directory
+        self.window_seconds = window_seconds
+        self.generations = max(generations, 1)
+    
+    def get_folder(self, file_path: str) -> str:
+        """Get the folder keeping the backups of a file."""
+        if self.directory is None:
+            return os.path.join(os.path.dirname(file_path), f".{os.path.basename(file_path)}.backups")
+        name = hashlib.sha1(os.path.realpath(file_path).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, name)
+    
+    def get_backups(self, file_path: str) -> List[dict]:
+        """Get the backups of a file, oldest first, as dicts with id, time, kind, events and changed."""
+        return self._load_manifest(self.get_folder(file_path))["generations"]
+    
+    def snapshot(self, file_path: str, force: bool = False, layout: "ICSLayout" = None) -> Optional[str]:
+        """
+        Back up a file, unless it was backed up within the time window.
+        
+        Args:
+            file_path: Calendar file
+            force: Back up even within the time window
+            layout: Known VEVENT spans of the file, it is scanned when missing or stale
+            
+        Returns:
+            Id of the new backup, None if no backup was taken
+        """
+        folder = self.get_folder(file_path)
+        manifest = self._load_manifest(folder)
+        generations = manifest["generations"]
+        now = datetime.now()
+        if not force and generations and now.timestamp() - generations[-1]["time"] < self.window_seconds:
+            calendar_stats.count("backup.skipped")
+            return None
+        
+        with calendar_stats.timer("backup.snapshot"):
+            frame, frame_end, events = self._split(file_path, layout)
+            hashes = {key: self._hash(data) for key, data in events.items()}
+            frame_hash = self._hash(frame)
+            previous = self._load_generation(folder, "hashes") if generations else None
+            if previous is None:
+                # First backup, or the hashes are lost: keep the whole calendar
+                generation = {"frame": frame, "frame_end": frame_end, "events": events, "removed": []}
+                kind = "full"
+            else:
+                generation = {
+                    "frame": frame if frame_hash != previous["frame"] else None,
+                    "frame_end": frame_end,
+                    "events": {key: data for key, data in events.items() if previous["events"].get(key) != hashes[key]},
+                    "removed": [key for key in previous["events"] if key not in hashes],
+                }
+                kind = "delta"
+            
+            backup_id = now.strftime("%Y%m%d-%H%M%S")
+            ids = {entry["id"] for entry in generations}
+            suffix = 1
+            while backup_id in ids:
+                suffix += 1
+                backup_id = f"{now.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+            os.makedirs(folder, exist_ok=True)
+            self._save_generation(folder, backup_id, generation)
+            self._save_generation(folder, "hashes", {"frame": frame_hash, "events": hashes}, compresslevel=1)
+            generations.append({"id": backup_id, "time": now.timestamp(), "kind": kind, "events": len(events),
+                                "changed": len(generation["events"]) + len(generation["removed"])})
+            self._rotate(folder, generations)
+            self._save_manifest(folder, manifest)
+        calendar_stats.count(f"backup.{kind}")
+        return backup_id
+    
+    def restore_data(self, file_path: str, backup_id: str) -> bytes:
+        """
+        Get the content of a file at one of its backups.
+        
+        Raises:
+            KeyError: if there is no such backup
+        """
+        folder = self.get_folder(file_path)
+        generations = self._load_manifest(folder)["generations"]
+        index = next((i for i, entry in enumerate(generations) if entry["id"] == backup_id), None)
+        if index is None:
+            raise KeyError(backup_id)
+        frame, frame_end, events = self._state_at(folder, generations, index)
+        return (frame[:frame_end] + "".join(events.values()) + frame[frame_end:]).encode("latin-1")
+    
+    def _state_at(self, folder: str, generations: List[dict], index: int):
+        """Rebuild (frame, frame end, events) at a generation from the full one before it."""
+        start = max(i for i in range(index + 1) if generations[i]["kind"] == "full")
+        frame, frame_end, events = "", 0, OrderedDict()
+        for entry in generations[start:index + 1]:
+            generation = self._load_generation(folder, entry["id"])
+            if generation is None:
+                raise KeyError(entry["id"])
+            if generation["frame"] is not None:
+                frame = generation["frame"]
+            frame_end = generation["frame_end"]
+            for key in generation["removed"]:
+                events.pop(key, None)
+            events.update(generation["events"])
+        return frame, frame_end, events
+    
+    def _rotate(self, folder: str, generations: List[dict]):
+        """Drop the oldest generations, turning the next one into a full one if it is a delta."""
+        while len(generations) > self.generations:
+            if generations[1]["kind"] == "delta":
+                frame, frame_end, events = self._state_at(folder, generations, 1)
+                self._save_generation(folder, generations[1]["id"],
+                                      {"frame": frame, "frame_end": frame_end, "events": events, "removed": []})
+                generations[1]["kind"] = "full"
+            self._remove_generation(folder, generations.pop(0)["id"])
+    
+    @staticmethod
+    def _split(file_path: str, layout: "ICSLayout" = None) -> Tuple[str, int, Dict[str, str]]:
+        """
+        Split a calendar into its frame and its VEVENTs.
+        
+        Returns:
+            Tuple of (calendar without its VEVENTs, offset in it where the VEVENTs
+            go back, VEVENT text by UID and recurrence-id). The bytes are decoded
+            as latin-1 so any content survives the round trip
+        """
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        if layout is None or layout.stamp != (st.st_mtime_ns, st.st_size):
+            try:
+                layout = ICSReader(file_path).read_layout()
+            except ICSReader.Unsupported:
+                layout = None
+        if layout is None or layout.stamp != (st.st_mtime_ns, st.st_size):
+            # Unknown layout, or the file changed since it was read: keep it as a whole
+            return data.decode("latin-1"), len(data), {}
+        
+        events = {}
+        spans = []
+        for identity, identity_spans in layout.spans.items():
+            events["\n".join(identity)] = "".join(data[start:end].decode("latin-1") for start, end in identity_spans)
+            spans.extend(identity_spans)
+        frame = []
+        position = 0
+        for start, end in sorted(spans):
+            frame.append(data[position:start])
+            position = end
+        frame.append(data[position:])
+        frame_end = layout.calendar_end - sum(end - start for start, end in spans)
+        return b"".join(frame).decode("latin-1"), frame_end, events
+    
+    @staticmethod
+    def _hash(text: str) -> str:
+        """Get the hash of a piece of a calendar, 64 bits are plenty to notice a change."""
+        return hashlib.sha1(text.encode("latin-1")).hexdigest()[:16]
+    
+    @staticmethod
+    def _load_manifest(folder: str) -> dict:
+        """Get the list of generations of a backup folder."""
+        try:
+            with open(os.path.join(folder, "manifest.json")) as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get("generations"), list):
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {"generations": []}
+    
+    @staticmethod
+    def _save_manifest(folder: str, manifest: dict):
+        """Save the list of generations of a backup folder."""
+        temp_path = os.path.join(folder, "manifest.json.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, os.path.join(folder, "manifest.json"))
+    
+    @staticmethod
+    def _load_generation(folder: str, name: str) -> Optional[dict]:
+        """Get a compressed generation, or None if it is missing or damaged."""
+        try:
+            with gzip.open(os.path.join(folder, f"{name}.json.gz"), 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _save_generation(folder: str, name: str, generation: dict, compresslevel: int = 6):
+        """Save a generation compressed."""
+        temp_path = os.path.join(folder, f"{name}.json.gz.tmp")
+        with gzip.open(temp_path, 'wb', compresslevel=compresslevel) as f:
+            f.write(json.dumps(generation).encode())
+        os.replace(temp_path, os.path.join(folder, f"{name}.json.gz"))
+    
+    @staticmethod
+    def _remove_generation(folder: str, name: str):
+        """Delete a generation dropped by the rotation."""
+        try:
+            os.remove(os.path.join(folder, f"{name}.json.gz"))
+        except OSError:
+            pass
+
+class CalendarOperationLog:
+    """
+    History of the changes made to the calendars, for undo and redo.
+    
+    Every operation lists the events it changed, each with its state before
+    and after: the event fields and the VEVENT text, as it was in the file
+    when known. Undoing puts the earlier VEVENTs back byte for byte. A new
+    operation clears the redo history. The history is kept in a JSON file
+    when a path is given, in memory otherwise.
+    """
+    
+    MAX_OPERATIONS = 100
+    
+    def __init__(self, path: str = None, max_operations: int = MAX_OPERATIONS):
+        """
+        Initialize the log.
+        
+        Args:
+            path: JSON file keeping the history across sessions
+            max_operations: Number of operations that can be undone
+        """
+        self.path = path
+        self.max_operations = max(max_operations, 1)
+        self.done = []    # Operations that can be undone, oldest first
+        self.undone = []  # Operations that can be redone, most recently undone last
+        self._load()
+    
+    def record(self, label: str, changes: List[dict]):
+        """
+        Add an operation to the history.
+        
+        Args:
+            label: Description of the operation, e.g. "Removed 'Dentist'"
+            changes: One dict per changed event with its "before" and "after" state,
+                None where the event did not exist
+        """
+        if not changes:
+            return
+        self.done.append({"label": label, "time": datetime.now().isoformat(timespec="seconds"),
+                          "changes": changes})
+        del self.done[:-self.max_operations]
+        self.undone.clear()
+        self.save()
+    
+    def can_undo(self) -> bool:
+        """Check whether there is an operation to undo."""
+        return bool(self.done)
+    
+    def can_redo(self) -> bool:
+        """Check whether there is an undone operation to redo."""
+        return bool(self.undone)
+    
+    def get_undo_label(self) -> Optional[str]:
+        """Get the label of the operation undo would reverse."""
+        return self.done[-1]["label"] if self.done else None
+    
+    def get_redo_label(self) -> Optional[str]:
+        """Get the label of the operation redo would apply again."""
+        return self.undone[-1]["label"] if self.undone else None
+    
+    def _load(self):
+        """Read the history from its file."""
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.done = list(data.get("done", []))[-self.max_operations:]
+            self.undone = list(data.get("undone", []))
+        except (OSError, ValueError, AttributeError):
+            pass
+    
+    def save(self):
+        """Write the history to its file."""
+        if not self.path:
+            return
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({"done": self.done, "undone": self.undone}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save the undo history: {e}")
+
+class CalendarManager:
+    """Manages multiple iCal calendars and their events."""
+    
+    def __init__(self, calendar_files: List[str] = None, store: "EventStore" = None,
+                 remote_sources: Dict[str, str] = None, caldav_sources: Dict[str, "CalDAVCalendar"] = None,
+                 fsync_policy: str = "file", backups: "CalendarBackups" = None,
+                 operation_log: "CalendarOperationLog" = None, embeddings: "EventEmbeddings" = None):
+        """
+        Initialize CalendarManager with a list of iCal file paths.
+        
+        Args:
+            calendar_files: List of paths to iCal files
+            store: Storage backend for the events, in memory by default
+            remote_sources: Files that are local copies of remote calendars, mapped to their URL.
+                These calendars are read-only
+            caldav_sources: Files that are local copies of CalDAV collections, mapped to the
+                collection. Changes to these calendars are written to the server first
+            fsync_policy: How written files are flushed to disk, one of FSYNC_POLICIES
+            backups: Where files are backed up before they are changed, next to them by default
+            operation_log: History of the changes for undo and redo, kept in memory by default
+            embeddings: Vector cache for semantic search, which is disabled without one
+        """
+        self.calendar_files = calendar_files or []
+        self.remote_sources = remote_sources or {}
+        self.caldav_sources = caldav_sources or {}
+        self.fsync_policy = fsync_policy if fsync_policy in self.FSYNC_POLICIES else "file"
+        self.backups = backups or CalendarBackups()
+        self.operation_log = operation_log or CalendarOperationLog()
+        self.embeddings = embeddings
+        self._embeddings_epoch = None  # index_epoch the vector cache was last pruned at
+        self.calendars = {}  # Dict[str, Optional[Calendar]] - None until needed for a write
+        self.store = store or MemoryEventStore()
+        self.calendar_colors = {}  # Dict[str, str] - Calendar name to color
+        self.calendar_paths = {}  # Dict[str, str] - Calendar name to file path
+        self.generation = 0  # Bumped on every change to the loaded events
+        self._file_stamps = {}  # Dict[str, Tuple[int, int]] - File path to (mtime_ns, size)
+        self._layouts = {}  # Dict[str, ICSLayout] - File path to VEVENT byte spans
+        self._listeners = []
+        self.index_epoch = 0  # Bumped when the events are reloaded wholesale
+        self._day_cache = OrderedDict()  # (date, epoch) -> sorted tuple of events, in LRU order
+        self._columns = None  # (generation, EventColumns) built on demand for analytics
+        with calendar_stats.timer("manager.load"):
+            self._load_calendars()
+    
+    CALENDAR_COLORS = ['#3584e4', '#33d17a', '#f6d32d', '#ff7800', '#e01b24', '#9141ac']
+    DAY_CACHE_SIZE = 400  # Per-day results kept by get_events_for_date
+    FSYNC_POLICIES = ("none", "file", "full")  # No fsync, fsync of the file, fsync of the file and its folder
+    WRITE_ATTEMPTS = 3  # Times a write is started again when the file changes while it is written
+    
+    class FileChanged(Exception):
+        """Raised when a calendar file changed on disk while it was being rewritten."""
+    
+    def _load_calendars(self):
+        """Load all iCal files and extract events."""
+        self._reset_day_cache()
+        self.calendars.clear()
+        self.calendar_paths.clear()
+        self._file_stamps.clear()
+        self._layouts.clear()
+        if self.store.persistent:
+            # Keep the events of files that are still configured, they are checked by fingerprint
+            for file_path, (fingerprint, calendar_name) in self.store.get_fingerprints().items():
+                if file_path not in self.calendar_files:
+                    self.store.remove_calendar(calendar_name)
+                    self.store.forget_file(file_path)
+        else:
+            self.store.clear()
+        
+        for file_path in self.calendar_files:
+            self._load_calendar_file(file_path)
+        
+        self._notify_changed()
+    
+    def _load_calendar_file(self, file_path: str) -> Optional[str]:
+        """Load a single iCal file, returning the calendar name on success."""
+        if not os.path.exists(file_path):
+            return None
+        try:
+            parse_start = perf_counter()
+            stamp = self._get_file_stamp(file_path)
+            fingerprint = self._format_fingerprint(stamp)
+            synced = self.store.get_fingerprints().get(file_path)
+            
+            if synced is not None and synced[0] == fingerprint:
+                # The store already holds the events of this exact file, parse it only when writing
+                cal = None
+                cal_name = synced[1]
+                events = None
+            else:
+                cal, cal_name, events = self._parse_calendar_file(file_path)
+            
+            self.calendars[cal_name] = cal
+            self.calendar_paths[cal_name] = file_path
+            self._file_stamps[file_path] = stamp
+            
+            # Assign color based on the position of the file in the settings
+            color_index = self.calendar_files.index(file_path)
+            self.calendar_colors[cal_name] = self.CALENDAR_COLORS[color_index % len(self.CALENDAR_COLORS)]
+            
+            if events is not None:
+                # Store the events, replacing whatever a persistent store kept for this file
+                if self.store.persistent:
+                    if synced is not None:
+                        self.store.remove_calendar(synced[1])
+                    self.store.remove_calendar(cal_name)
+                self.store.add_many(events)
+                self.store.set_fingerprint(file_path, cal_name, fingerprint)
+                calendar_stats.record_file(file_path, perf_counter() - parse_start, len(events))
+            return cal_name
+            
+        except Exception as e:
+            print(f"Error loading calendar {file_path}: {e}")
+            return None
+    
+    def _parse_calendar_file(self, file_path: str) -> Tuple[Optional[object], str, List[Event]]:
+        """
+        Parse the events of an iCal file.
+        
+        The memory-mapped reader is tried first, the iCal tree is then only built
+        on the first write. Files it cannot handle go through icalendar.
+        
+        Returns:
+            Tuple of (parsed calendar or None, calendar name, events)
+        """
+        from icalendar import Calendar
+        default_name = self._default_calendar_name(file_path)
+        try:
+            reader = ICSReader(file_path)
+            events = reader.read_events()
+            self._layouts[file_path] = reader.layout
+            cal_name = reader.calendar_name or default_name
+            for event in events:
+                event.calendar_name = cal_name
+            calendar_stats.count("parse.fast")
+            return None, cal_name, events
+        except ICSReader.Unsupported as e:
+            calendar_stats.count("parse.fallback")
+            calendar_stats.log("Parsing %s with icalendar: %s", file_path, e)
+        
+        with open(file_path, 'rb') as f:
+            cal = Calendar.from_ical(f.read())
+        # Unescaped like ICSReader does, so the name does not depend on the parser
+        cal_name = ICSReader._unescape_text(str(cal.get('X-WR-CALNAME', ''))) or default_name
+        return cal, cal_name, self._extract_events_from_calendar(cal, cal_name)
+    
+    def _default_calendar_name(self, file_path: str) -> str:
+        """Get the name of a calendar without X-WR-CALNAME, from its file or URL."""
+        url = self.remote_sources.get(file_path)
+        if url is None:
+            return os.path.basename(file_path)
+        parsed = urllib.parse.urlsplit(url)
+        return os.path.basename(parsed.path.rstrip("/")) or parsed.netloc
+    
+    def _get_file_stamp(self, file_path: str) -> Optional[Tuple[int, int]]:
+        """Get a cheap fingerprint of a file to detect external modifications."""
+        try:
+            st = os.stat(file_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+    
+    @staticmethod
+    def _format_fingerprint(stamp: Optional[Tuple[int, int]]) -> str:
+        """Format a file stamp as the fingerprint kept by persistent stores."""
+        return f"{stamp[0]}:{stamp[1]}" if stamp else ""
+    
+    def _drop_calendar(self, calendar_name: str):
+        """Remove a calendar and all its events from memory."""
+        self.calendars.pop(calendar_name, None)
+        path = self.calendar_paths.pop(calendar_name, None)
+        if path:
+            self._file_stamps.pop(path, None)
+            self._layouts.pop(path, None)
+            self.store.forget_file(path)
+        self.store.remove_calendar(calendar_name)
+    
+    def _get_calendar(self, calendar_name: str):
+        """Get the parsed iCal calendar, parsing the file if it was loaded from the store."""
+        from icalendar import Calendar
+        calendar = self.calendars.get(calendar_name)
+        if calendar is None and calendar_name in self.calendar_paths:
+            with open(self.calendar_paths[calendar_name], 'rb') as f:
+                calendar = Calendar.from_ical(f.read())
+            self.calendars[calendar_name] = calendar
+        return calendar
+    
+    def reload_calendar_file(self, file_path: str) -> bool:
+        """
+        Reload a single calendar file if it changed on disk.
+        
+        Returns:
+            True if the in-memory events were updated
+        """
+        if file_path not in self.calendar_files:
+            return False
+        if self._get_file_stamp(file_path) == self._file_stamps.get(file_path):
+            return False  # Unchanged, e.g. our own write
+        
+        self._reload_file_events(file_path)
+        self._notify_changed()
+        return True
+    
+    def _reload_calendars(self, *calendar_names: str):
+        """Replace the events of calendars in memory by the ones their files hold, after a failed write."""
+        for calendar_file in {self.calendar_paths.get(name) for name in calendar_names} - {None}:
+            self._reload_file_events(calendar_file)
+    
+    def _reload_file_events(self, file_path: str):
+        """Replace the events of a file in memory by the ones it currently holds."""
+        self._reset_day_cache()
+        for name, path in list(self.calendar_paths.items()):
+            if path == file_path:
+                self._drop_calendar(name)
+        self._load_calendar_file(file_path)
+    
+    def add_change_listener(self, callback):
+        """Register a callback called with the new generation after every change."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+    
+    def remove_change_listener(self, callback):
+        """Unregister a change callback."""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    def _notify_changed(self):
+        """Bump the generation counter and notify listeners."""
+        self.generation += 1
+        for callback in list(self._listeners):
+            try:
+                callback(self.generation)
+            except Exception as e:
+                print(f"Error in calendar change listener: {e}")
+    
+    def _extract_events_from_calendar(self, calendar, calendar_name: str) -> List[Event]:
+        """Extract the events of a parsed iCal calendar."""
+        events = []
+        for component in calendar.walk():
+            if component.name == "VEVENT":
+                try:
+                    event = self._parse_ical_event(component, calendar_name)
+                    if event:
+                        events.append(event)
+                except Exception as e:
+                    print(f"Error parsing event: {e}")
+        return events
+    
+    def _parse_ical_event(self, component, calendar_name: str) -> Optional[Event]:
+        """Parse an iCal event component into an Event object."""
+        try:
+            summary = str(component.get('summary', 'Untitled Event'))
+            
+            # Handle start time
+            dtstart = component.get('dtstart')
+            if dtstart is None:
+                return None
+            
+            dtend = component.get('dtend')
+            uid, recurrence_id = self._component_identity(component)
+            return self._make_event(
+                summary=summary,
+                start_dt=dtstart.dt,
+                end_dt=dtend.dt if dtend else None,
+                description=str(component.get('description', '')),
+                location=str(component.get('location', '')),
+                uid=uid,
+                calendar_name=calendar_name,
+                recurrence_id=recurrence_id
+            )
+        except Exception as e:
+            print(f"Error parsing event component: {e}")
+            return None
+    
+    @staticmethod
+    def _make_event(summary: str, start_dt, end_dt, description: str, location: str,
+                    uid: str, calendar_name: str, recurrence_id: str = "") -> Event:
+        """Build an Event from decoded DTSTART/DTEND values, shared by both parsers."""
+        all_day = isinstance(start_dt, date) and not isinstance(start_dt, datetime)
+        
+        if all_day:
+            # All-day event
+            start_time = datetime.combine(start_dt, datetime.min.time())
+            if end_dt:
+                end_time = datetime.combine(end_dt, datetime.min.time())
+            else:
+                end_time = start_time + timedelta(days=1)
+        else:
+            # Timed event
+            if start_dt.tzinfo is None:
+                start_time = start_dt.replace(tzinfo=tz.tzlocal())
+            else:
+                start_time = start_dt
+            
+            if end_dt:
+                end_time = end_dt
+                if end_time.tzinfo is None:
+                    end_time = end_time.replace(tzinfo=tz.tzlocal())
+            else:
+                # Default to 1 hour duration
+                end_time = start_time + timedelta(hours=1)
+        
+        return Event(
+            summary=summary,
+            start_time=start_time,
+            end_time=end_time,
+            description=description,
+            location=location,
+            calendar_name=calendar_name,
+            uid=uid,
+            all_day=all_day,
+            recurrence_id=recurrence_id
+        )
+    
+    def get_events_for_date(self, target_date: date) -> Tuple[Event, ...]:
+        """Get all events for a specific date, sorted by time, as a cached tuple."""
+        key = (target_date, self.index_epoch)
+        cached = self._day_cache.get(key)
+        if cached is not None:
+            self._day_cache.move_to_end(key)
+            calendar_stats.count("day_cache.hit")
+            return cached
+        calendar_stats.count("day_cache.miss")
+        
+        events = self.store.get_events_for_date(target_date)
+        
+        # Normalize timezones before sorting to avoid comparison errors
+        for event in events:
+            if event.start_time.tzinfo is None:
+                event.start_time = event.start_time.replace(tzinfo=tz.tzlocal())
+            if event.end_time.tzinfo is None:
+                event.end_time = event.end_time.replace(tzinfo=tz.tzlocal())
+        
+        result = tuple(sorted(events, key=lambda e: (e.all_day, e.start_time)))
+        self._day_cache[key] = result
+        if len(self._day_cache) > self.DAY_CACHE_SIZE:
+            self._day_cache.popitem(last=False)
+        return result
+    
+    def _invalidate_day(self, target_date: date):
+        """Forget the cached events of a single date."""
+        self._day_cache.pop((target_date, self.index_epoch), None)
+    
+    def _reset_day_cache(self):
+        """Start a new index epoch, dropping every cached day."""
+        self.index_epoch += 1
+        self._day_cache.clear()
+    
+    def find_event(self, event: Event) -> Optional[Event]:
+        """Get the current stored version of an event by calendar, UID and recurrence-id."""
+        return self.store.get_event(event.calendar_name, event.uid, event.recurrence_id)
+    
+    def get_upcoming_events(self, from_date: date, limit: int = 5) -> List[Event]:
+        """Get upcoming events starting from a specific date."""
+        upcoming = []
+        current_date = from_date
+        max_days = 30  # Look ahead maximum 30 days
+        
+        for _ in range(max_days):
+            if len(upcoming) >= limit:
+                break
+            
+            day_events = self.get_events_for_date(current_date)
+            for event in day_events:
+                if len(upcoming) >= limit:
+                    break
+                upcoming.append(event)
+            
+            current_date += timedelta(days=1)
+        
+        return upcoming[:limit]
+    
+    def add_event(self, event: Event) -> bool:
+        """Add a new event to the appropriate calendar."""
+        try:
+            # Find the calendar to add to (use first calendar if calendar_name not found)
+            calendar_name = self._resolve_calendar_name(event)
+            if not self._check_writable(calendar_name):
+                return False
+            self._index_event(event)
+            
+            # Write event to iCal file
+            written = True
+            if calendar_name in self.calendars:
+                written = self._write_event_to_calendar(event, calendar_name)
+            if written:
+                self.operation_log.record(f"Added {self._describe_event(event)}",
+                                          [{"before": None, "after": self._get_logged_state(event, False)}])
+            else:
+                self._reload_calendars(calendar_name)
+            
+            self._notify_changed()
+            return written
+        except Exception as e:
+            print(f"Error adding event: {e}")
+            return False
+    
+    def edit_event(self, old_event: Event, new_event: Event) -> bool:
+        """
+        Edit an existing event, replacing it in memory and in its file.
+        
+        The event is matched by UID and recurrence-id; when the calendar is
+        unchanged its VEVENT is rewritten in place.
+        """
+        try:
+            # The caller may hold an instance from before a reload
+            old_event = self.find_event(old_event)
+            if old_event is None:
+                return False  # Event not found in memory
+            calendar_name = self._resolve_calendar_name(new_event)
+            if not self._check_writable(old_event.calendar_name, calendar_name):
+                return False
+            before = self._get_logged_state(old_event)
+            if not self._reindex_event(old_event, new_event):
+                return False
+            
+            if old_event.calendar_name == calendar_name:
+                written = self._replace_event_in_calendar(old_event, new_event)
+            else:
+                # Added first, so a failed write never leaves the event in neither file
+                written = (self._write_event_to_calendar(new_event, calendar_name) and
+                           self._remove_event_from_calendar(old_event))
+            if written:
+                self.operation_log.record(f"Edited {self._describe_event(new_event)}",
+                                          [{"before": before, "after": self._get_logged_state(new_event, False)}])
+            else:
+                self._reload_calendars(old_event.calendar_name, calendar_name)
+            
+            self._notify_changed()
+            return written
+        except Exception as e:
+            print(f"Error editing event: {e}")
+            return False
+    
+    def remove_event(self, event: Event) -> bool:
+        """Remove an event."""
+        try:
+            # Remove from memory, resolving the stored instance in case of a reload
+            event = self.find_event(event)
+            if event is None or not self._check_writable(event.calendar_name):
+                return False
+            before = self._get_logged_state(event)
+            if not self._unindex_event(event):
+                return False  # Event not found in memory
+            
+            # Remove from iCal file
+            removed = self._remove_event_from_calendar(event)
+            if removed:
+                self.operation_log.record(f"Removed {self._describe_event(event)}",
+                                          [{"before": before, "after": None}])
+            else:
+                self._reload_calendars(event.calendar_name)
+            self._notify_changed()
+            return removed
+            
+        except Exception as e:
+            print(f"Error removing event: {e}")
+            return False
+    
+    def apply_batch(self, added: List[Event] = None, removed: List[Event] = None,
+                    edited: List[Tuple[Event, Event]] = None) -> bool:
+        """
+        Apply several changes at once, writing each affected file a single time.
+        
+        Args:
+            added: Events to add
+            removed: Events to remove
+            edited: (old_event, new_event) pairs to replace
+            
+        Returns:
+            True if every change was applied, none is applied otherwise
+        """
+        added = list(added or [])
+        removed = list(removed or [])
+        edited = list(edited or [])
+        try:
+            for event in added + [new for old, new in edited]:
+                self._resolve_calendar_name(event)
+            calendar_names = ({event.calendar_name for event in removed + added} |
+                              {event.calendar_name for pair in edited for event in pair})
+            if not self._check_writable(*calendar_names):
+                return False
+            for calendar_name in calendar_names - set(self.calendar_paths):
+                print(f"Could not find file for calendar: {calendar_name}")
+                return False
+            changes = ([{"before": self._get_logged_state(event), "after": None} for event in removed] +
+                       [{"before": self._get_logged_state(old), "after": None} for old, new in edited])
+            
+            # Update memory, edited events are replaced in place
+            for event in removed:
+                self._unindex_event(event)
+            for old_event, new_event in edited:
+                self._reindex_event(old_event, new_event)
+            for event in added:
+                self._index_event(event)
+            
+            # Update files, all of them or none, so the batch is a single operation to undo
+            writes = {}  # Dict[str, tuple] - Calendar name to its changes, see _write_calendars
+            for event, change in zip(removed + [old for old, new in edited], changes):
+                self._plan_change(writes, event.calendar_name, event.identity(),
+                                  self._get_logged_vevent(change["before"]), None)
+            for event in added + [new for old, new in edited]:
+                self._plan_change(writes, event.calendar_name, event.identity(),
+                                  None, self._build_ical_event(event).to_ical())
+            success = self._write_calendars(writes)
+            if success:
+                # An edit keeping its UID is one change, its new version is known after reindexing
+                for change, (old_event, new_event) in zip(changes[len(removed):], edited):
+                    if (new_event.calendar_name, new_event.identity()) == (old_event.calendar_name, old_event.identity()):
+                        change["after"] = self._get_logged_state(new_event, False)
+                    else:
+                        changes.append({"before": None, "after": self._get_logged_state(new_event, False)})
+                changes.extend({"before": None, "after": self._get_logged_state(event, False)} for event in added)
+                self.operation_log.record(f"Applied {len(changes)} changes", changes)
+            
+            self._notify_changed()
+            return success
+        except Exception as e:
+            print(f"Error applying batch: {e}")
+            return False
+    
+    def _resolve_calendar_name(self, event: Event) -> str:
+        """Get the calendar an event is written to, defaulting to the first writable one."""
+        if event.calendar_name not in self.calendars and self.calendars:
+            calendar_names = self.get_writable_calendar_names() or self.get_calendar_names()
+            event.calendar_name = calendar_names[0]
+        return event.calendar_name
+    
+    def is_read_only(self, calendar_name: str) -> bool:
+        """Check whether a calendar is a copy of a remote calendar that cannot be written."""
+        return self.calendar_paths.get(calendar_name) in self.remote_sources
+    
+    def _check_writable(self, *calendar_names: str) -> bool:
+        """Check that none of the calendars is read-only, printing the first one that is."""
+        for calendar_name in calendar_names:
+            if self.is_read_only(calendar_name):
+                print(f"Calendar {calendar_name} is read-only")
+                return False
+        return True
+    
+    def _index_event(self, event: Event):
+        """Add an event to the store."""
+        self.store.add(event)
+        self._invalidate_day(event.start_time.date())
+    
+    def _unindex_event(self, event: Event) -> bool:
+        """Remove an event from the store by UID and recurrence-id."""
+        self._invalidate_day(event.start_time.date())
+        if self.embeddings is not None:
+            self.embeddings.discard(event)
+        return self.store.remove(event)
+    
+    def _reindex_event(self, old_event: Event, new_event: Event) -> bool:
+        """Replace an event in the store, the new version keeps the identity of the old one."""
+        if new_event.uid == old_event.uid:
+            new_event.recurrence_id = old_event.recurrence_id
+        self._invalidate_day(old_event.start_time.date())
+        self._invalidate_day(new_event.start_time.date())
+        if self.embeddings is not None:
+            self.embeddings.discard(old_event)
+        return self.store.replace(old_event, new_event)
+    
+    def search_events(self, text: str, start_date: date, end_date: date) -> List[Event]:
+        """Get the events starting within [start_date, end_date] whose title contains text."""
+        start_ts = self._to_timestamp(datetime.combine(start_date, time.min))
+        end_ts = self._to_timestamp(datetime.combine(end_date + timedelta(days=1), time.min))
+        return self.store.search(text, start_ts, end_ts)
+    
+    def query_events(self, query: "EventQuery") -> List[Event]:
+        """
+        Get the events matching a query, in a stable order: start time, then title, then UID.
+        
+        The time range, calendars and text terms every result must match are
+        looked up in the indexes of the store, the whole query is then checked
+        on the remaining events.
+        """
+        plan = query.plan()
+        calendars = None
+        if plan["calendars"] is not None:
+            calendars = [name for name in self.get_calendar_names() if name.lower() in plan["calendars"]]
+        with calendar_stats.timer("query.candidates"):
+            candidates = self.store.find_candidates(plan["start_ts"], plan["end_ts"], calendars, plan["terms"])
+        calendar_stats.count("query.candidate_events", len(candidates))
+        return sorted((event for event in candidates if query.matches(event)), key=Event.sort_key)
+    
+    def semantic_search(self, text: str, start_date: date, end_date: date, limit: int = 10) -> List[Tuple[float, Event]]:
+        """
+        Get the events starting within [start_date, end_date] whose title, description
+        and location are closest in meaning to text.
+        
+        Events added or edited since the last search are embedded first, the
+        vectors of the others come from the cache.
+        
+        Returns:
+            (similarity, event) pairs, most similar first, empty if semantic search is disabled
+        """
+        if self.embeddings is None:
+            return []
+        if self._embeddings_epoch != self.index_epoch:
+            # Calendars were reloaded, events may have been removed outside Newelle
+            self.embeddings.prune(self.store.find_candidates(None, None, None, []))
+            self._embeddings_epoch = self.index_epoch
+        start_ts = self._to_timestamp(datetime.combine(start_date, time.min))
+        end_ts = self._to_timestamp(datetime.combine(end_date + timedelta(days=1), time.min))
+        with calendar_stats.timer("semantic.candidates"):
+            candidates = self.store.find_candidates(start_ts, end_ts, None, [])
+        calendar_stats.count("semantic.candidate_events", len(candidates))
+        with calendar_stats.timer("semantic.search"):
+            return self.embeddings.search(text, candidates, limit)
+    
+    def _create_backup(self, file_path: str) -> bool:
+        """Back up a calendar file before modifying it, at most once per backup window."""
+        if file_path in self.caldav_sources:
+            return True  # The server keeps the calendar
+        try:
+            self.backups.snapshot(file_path, layout=self._layouts.get(file_path))
+            return True
+        except Exception as e:
+            print(f"Warning: Could not create backup of {file_path}: {e}")
+            return False
+    
+    def list_backups(self, calendar_name: str) -> List[dict]:
+        """Get the backups of a calendar, oldest first, as dicts with id, time, kind, events and changed."""
+        calendar_file = self.calendar_paths.get(calendar_name)
+        if calendar_file is None or calendar_file in self.caldav_sources:
+            return []
+        return self.backups.get_backups(calendar_file)
+    
+    def restore_backup(self, calendar_name: str, backup_id: str) -> Optional[str]:
+        """
+        Restore a calendar file to one of its backups.
+        
+        The current content is backed up first, so the restore can be undone
+        by restoring that backup.
+        
+        Returns:
+            Id of the backup of the replaced content, None if the restore failed
+        """
+        calendar_file = self.calendar_paths.get(calendar_name)
+        if calendar_file is None or calendar_file in self.caldav_sources or not self._check_writable(calendar_name):
+            return None
+        try:
+            with CalendarFileLock.for_path(calendar_file):
+                data = self.backups.restore_data(calendar_file, backup_id)
+                previous_id = self.backups.snapshot(calendar_file, force=True)
+                self._replace_file(calendar_file, [data])
+                self._reload_file_events(calendar_file)
+            calendar_stats.log("Restored %s to backup %s", calendar_file, backup_id)
+            self._notify_changed()
+            return previous_id
+        except KeyError:
+            print(f"No backup {backup_id} of calendar {calendar_name}")
+            return None
+        except Exception as e:
+            print(f"Error restoring calendar {calendar_name}: {e}")
+            return None
+    
+    def undo(self, count: int = 1) -> List[str]:
+        """
+        Reverse the last operations, most recent first.
+        
+        Only the VEVENTs the operations changed are rewritten. Undoing stops at
+        the first operation whose events were changed since, e.g. by another
+        program, as reversing it would lose those changes.
+        
+        Returns:
+            Labels of the operations undone
+        """
+        return self._replay_operations(self.operation_log.done, self.operation_log.undone, count, "before")
+    
+    def redo(self, count: int = 1) -> List[str]:
+        """
+        Apply again the last undone operations.
+        
+        Returns:
+            Labels of the operations redone
+        """
+        return self._replay_operations(self.operation_log.undone, self.operation_log.done, count, "after")
+    
+    def _replay_operations(self, source: List[dict], target: List[dict], count: int, state: str) -> List[str]:
+        """Bring the events of the last operations of source to the given state, moving them to target."""
+        labels = []
+        while source and len(labels) < count:
+            operation = source[-1]
+            if not self._restore_states(operation["changes"], state):
+                print(f"Cannot revert '{operation['label']}': its events were changed since, "
+                      "or a calendar could not be written")
+                break
+            target.append(source.pop())
+            labels.append(operation["label"])
+        if labels:
+            self.operation_log.save()
+            self._notify_changed()
+        return labels
+    
+    def _restore_states(self, changes: List[dict], state: str) -> bool:
+        """
+        Bring the events of an operation to their state before or after it.
+        
+        Returns:
+            False if an event no longer is in the other state, nothing is changed then,
+            or if a calendar could not be written, the files are then left as they were
+        """
+        current_state = "after" if state == "before" else "before"
+        if state == "before":
+            changes = list(reversed(changes))
+        
+        # Every event must still be as the operation left it
+        writes = {}  # Dict[str, tuple] - Calendar name to its changes, see _write_calendars
+        to_unindex = []
+        to_index = []
+        for change in changes:
+            current, wanted = change[current_state], change[state]
+            if current is not None:
+                data = current["event"]
+                event = self.store.get_event(data["calendar_name"], data["uid"], data.get("recurrence_id", ""))
+                if event is None or not self._matches_logged_state(event, data):
+                    return False
+                self._plan_change(writes, event.calendar_name, event.identity(), self._get_logged_vevent(current), None)
+                to_unindex.append(event)
+            elif wanted is not None:
+                data = wanted["event"]
+                if self.store.get_event(data["calendar_name"], data["uid"], data.get("recurrence_id", "")):
+                    return False  # Added again since
+            if wanted is not None:
+                event = Event.from_dict(wanted["event"])
+                self._plan_change(writes, event.calendar_name, event.identity(), None, self._get_logged_vevent(wanted))
+                to_index.append(event)
+        if any(name not in self.calendar_paths for name in writes) or not self._check_writable(*writes):
+            return False
+        
+        for event in to_unindex:
+            self._unindex_event(event)
+        for event in to_index:
+            self._index_event(event)
+        return self._write_calendars(writes)
+    
+    @staticmethod
+    def _plan_change(writes: dict, calendar_name: str, identity: Tuple[str, str],
+                     old_vevent: Optional[bytes], new_vevent: Optional[bytes]):
+        """Add to writes the replacement of a VEVENT of a calendar, None meaning absent, and its reverse."""
+        remove_identities, raw_added, undo_identities, undo_raw_added = writes.setdefault(
+            calendar_name, (set(), [], set(), []))
+        if old_vevent is not None:
+            remove_identities.add(identity)
+            undo_raw_added.append((identity, old_vevent))
+        if new_vevent is not None:
+            raw_added.append((identity, new_vevent))
+            undo_identities.add(identity)
+    
+    def _write_calendars(self, writes: Dict[str, tuple]) -> bool:
+        """
+        Write the changes of several calendars, all of them or none.
+        
+        Args:
+            writes: Calendar name to (identities to remove, (identity, VEVENT) pairs to add,
+                and the same two for the reverse change), filled by _plan_change
+            
+        Returns:
+            False if a calendar could not be written. The calendars written before
+            it are then changed back, and as memory is updated before the files,
+            the events of every calendar are loaded again from its file
+        """
+        written = []
+        for calendar_name, (remove_identities, raw_added, undo_identities, undo_raw_added) in writes.items():
+            try:
+                self._write_calendar_changes(calendar_name, remove_identities, [], raw_added)
+            except Exception as e:
+                print(f"Could not write calendar {calendar_name}: {e}")
+                break
+            written.append(calendar_name)
+        else:
+            return True
+        
+        for calendar_name in reversed(written):
+            remove_identities, raw_added, undo_identities, undo_raw_added = writes[calendar_name]
+            try:
+                self._write_calendar_changes(calendar_name, undo_identities, [], undo_raw_added)
+            except Exception as e:
+                print(f"Could not change back calendar {calendar_name}: {e}")
+        self._reload_calendars(*writes)
+        return False
+    
+    def _get_logged_state(self, event: Event, from_file: bool = True) -> dict:
+        """
+        Get the state of an event kept by the operation log: its fields and VEVENT text.
+        
+        Args:
+            event: Event as it is stored
+            from_file: Whether to take the VEVENT as it is in the file, so undoing
+                restores the properties this extension does not read. Otherwise it
+                is the VEVENT this extension writes for the event
+        """
+        if not from_file:
+            return {"event": event.to_dict(), "vevent": self._build_ical_event(event).to_ical().decode("latin-1")}
+        vevent = None
+        calendar_file = self.calendar_paths.get(event.calendar_name)
+        if calendar_file and calendar_file not in self.caldav_sources:
+            layout = self._get_layout(calendar_file)
+            spans = layout.spans.get(event.identity()) if layout else None
+            if spans:
+                with open(calendar_file, 'rb') as f:
+                    pieces = []
+                    for start, end in spans:
+                        f.seek(start)
+                        pieces.append(f.read(end - start))
+                vevent = b"".join(pieces).decode("latin-1")
+        return {"event": event.to_dict(), "vevent": vevent}
+    
+    def _get_logged_vevent(self, state: dict) -> bytes:
+        """Get the VEVENT of a logged state, built from its fields when its text was not kept."""
+        vevent = state.get("vevent")
+        return vevent.encode("latin-1") if vevent else self._build_ical_event(Event.from_dict(state["event"])).to_ical()
+    
+    def _matches_logged_state(self, event: Event, data: dict) -> bool:
+        """Check whether an event is still as the operation log recorded it."""
+        logged = Event.from_dict(data)
+        return (event.summary == logged.summary and event.description == logged.description and
+                event.location == logged.location and event.all_day == logged.all_day and
+                self._to_timestamp(event.start_time) == self._to_timestamp(logged.start_time) and
+                self._to_timestamp(event.end_time) == self._to_timestamp(logged.end_time))
+    
+    @staticmethod
+    def _describe_event(event: Event) -> str:
+        """Describe an event in an operation label."""
+        return f"'{event.summary}' on {event.start_time.strftime('%Y-%m-%d')}"
+    
+    def _build_ical_event(self, event: Event):
+        """Convert an Event into an iCal VEVENT component."""
+        from icalendar import Event as ICalEvent
+        ical_event = ICalEvent()
+        ical_event.add('summary', event.summary)
+        ical_event.add('uid', event.uid)
+        
+        # Normalize timezone for event times
+        start_time = event.start_time
+        end_time = event.end_time
+        
+        if not event.all_day:
+            # Ensure timezone-aware datetimes for timed events
+            if start_time.tzinfo is None:
+                start_time = start_time.replace(tzinfo=tz.tzlocal())
+            if end_time.tzinfo is None:
+                end_time = end_time.replace(tzinfo=tz.tzlocal())
+        
+        if event.all_day:
+            # All-day event - use date only
+            ical_event.add('dtstart', start_time.date())
+            if end_time.date() != start_time.date():
+                ical_event.add('dtend', end_time.date())
+        else:
+            # Timed event
+            ical_event.add('dtstart', start_time)
+            ical_event.add('dtend', end_time)
+        
+        if event.recurrence_id:
+            from icalendar.prop import vDDDTypes
+            recurrence_id = vDDDTypes.from_ical(event.recurrence_id)
+            if isinstance(recurrence_id, datetime) and recurrence_id.tzinfo is None and start_time.tzinfo:
+                # The occurrence is identified in the time zone of the event
+                recurrence_id = recurrence_id.replace(tzinfo=start_time.tzinfo)
+            ical_event.add('recurrence-id', recurrence_id)
+        if event.description:
+            ical_event.add('description', event.description)
+        if event.location:
+            ical_event.add('location', event.location)
+        
+        return ical_event
+    
+    def _flush_calendar(self, calendar_name: str, expected_stamp: Optional[Tuple[int, int]] = None):
+        """Write an in-memory calendar back to its file."""
+        calendar_file = self.calendar_paths[calendar_name]
+        self._replace_file(calendar_file, [self._get_calendar(calendar_name).to_ical()], expected_stamp)
+        self._record_write(calendar_name)
+    
+    def _record_write(self, calendar_name: str) -> Optional[Tuple[int, int]]:
+        """Remember the stamp of a file we just wrote so the watcher ignores it."""
+        calendar_file = self.calendar_paths[calendar_name]
+        stamp = self._get_file_stamp(calendar_file)
+        self._file_stamps[calendar_file] = stamp
+        self.store.set_fingerprint(calendar_file, calendar_name, self._format_fingerprint(stamp))
+        return stamp
+    
+    def _replace_file(self, file_path: str, chunks, expected_stamp: Optional[Tuple[int, int]] = None):
+        """
+        Write a file atomically through a temporary file next to it.
+        
+        The temporary file is flushed to disk according to the fsync policy
+        before it replaces the file, so a crash leaves either version whole.
+        
+        Raises:
+            CalendarManager.FileChanged: if the file no longer has expected_stamp,
+                i.e. it was changed since it was read. Nothing is written then
+        """
+        directory = os.path.dirname(file_path) or "."
+        fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix=".tmp", dir=directory)
+        try:
+            with calendar_stats.timer("file.write"):
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                    if self.fsync_policy != "none":
+                        f.flush()
+                        with calendar_stats.timer("file.fsync"):
+                            os.fsync(f.fileno())
+                shutil.copymode(file_path, temp_path)
+                if expected_stamp is not None and self._get_file_stamp(file_path) != expected_stamp:
+                    raise self.FileChanged(file_path)
+                os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if self.fsync_policy == "full":
+            # Make the rename itself durable
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                with calendar_stats.timer("file.fsync"):
+                    os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+    
+    def _get_layout(self, file_path: str) -> Optional[ICSLayout]:
+        """Get the VEVENT byte spans of a file, scanning it again if they are stale."""
+        layout = self._layouts.get(file_path)
+        if layout is None or layout.stamp != self._get_file_stamp(file_path):
+            try:
+                layout = ICSReader(file_path).read_layout()
+            except ICSReader.Unsupported:
+                layout = None
+            self._layouts[file_path] = layout
+        return layout
+    
+    def _write_calendar_changes(self, calendar_name: str, remove_identities, added: List[Event],
+                                raw_added: List[Tuple[Tuple[str, str], bytes]] = ()):
+        """
+        Remove VEVENTs by (UID, recurrence-id) from a calendar file and write new events.
+        
+        raw_added holds VEVENTs written as given, with their (UID, recurrence-id).
+        The file is locked while it is written. The changes are applied to the
+        file as it is on disk, so when another program changed it since it was
+        loaded both changes are kept and its events are loaded again.
+        """
+        calendar_file = self.calendar_paths[calendar_name]
+        with CalendarFileLock.for_path(calendar_file):
+            self._create_backup(calendar_file)
+            merged = self._get_file_stamp(calendar_file) != self._file_stamps.get(calendar_file)
+            for attempt in range(self.WRITE_ATTEMPTS):
+                try:
+                    self._apply_file_changes(calendar_name, remove_identities, added, raw_added)
+                    break
+                except self.FileChanged:
+                    # Changed between our read and our write, apply the changes to the new content
+                    if attempt == self.WRITE_ATTEMPTS - 1:
+                        raise
+                    calendar_stats.count("file.write_retry")
+                    merged = True
+            if merged:
+                calendar_stats.count("file.merge")
+                calendar_stats.log("Merged changes to %s with changes made by another program", calendar_file)
+                self._reload_file_events(calendar_file)
+    
+    def _apply_file_changes(self, calendar_name: str, remove_identities, added: List[Event],
+                            raw_added: List[Tuple[Tuple[str, str], bytes]] = ()):
+        """
+        Apply VEVENT removals and additions to the current content of a calendar file.
+        
+        Only the affected byte spans are rewritten, the whole calendar is
+        re-serialized when the file layout cannot be used. CalDAV calendars
+        are written to the server, which then updates the local copy.
+        """
+        calendar_file = self.calendar_paths[calendar_name]
+        source = self.caldav_sources.get(calendar_file)
+        if source is not None:
+            source.write_changes(remove_identities, [self._build_ical_event(event) for event in added] +
+                                 self._parse_vevents(raw_added), self._component_identity)
+            self._layouts.pop(calendar_file, None)
+            self._record_write(calendar_name)
+            self.calendars[calendar_name] = None
+            return
+        if self._splice_calendar_file(calendar_name, remove_identities, added, raw_added):
+            return
+        
+        from icalendar import Calendar
+        stamp = self._get_file_stamp(calendar_file)
+        with open(calendar_file, 'rb') as f:
+            calendar = Calendar.from_ical(f.read())
+        calendar.subcomponents[:] = [
+            component for component in calendar.subcomponents
+            if not (component.name == "VEVENT" and self._component_identity(component) in remove_identities)
+        ]
+        for event in added:
+            calendar.add_component(self._build_ical_event(event))
+        for component in self._parse_vevents(raw_added):
+            calendar.add_component(component)
+        self.calendars[calendar_name] = calendar
+        self._flush_calendar(calendar_name, stamp)
+    
+    @staticmethod
+    def _parse_vevents(raw_added: List[Tuple[Tuple[str, str], bytes]]) -> list:
+        """Parse VEVENTs given as text into iCal components."""
+        if not raw_added:
+            return []
+        from icalendar import Event as ICalEvent
+        return [component for identity, data in raw_added for component in ICalEvent.from_ical(data, multiple=True)]
+    
+    def _splice_calendar_file(self, calendar_name: str, remove_identities, added: List[Event],
+                              raw_added: List[Tuple[Tuple[str, str], bytes]] = ()) -> bool:
+        """
+        Rewrite only the byte spans of the changed VEVENTs of a calendar file.
+        
+        Returns:
+            False if the file layout is unknown and nothing was written
+        """
+        calendar_file = self.calendar_paths[calendar_name]
+        layout = self._get_layout(calendar_file)
+        if layout is None:
+            return False
+        
+        edits = layout.plan(remove_identities,
+                            [(event.identity(), self._build_ical_event(event).to_ical()) for event in added] +
+                            list(raw_added))
+        if edits is None:
+            return False
+        with open(calendar_file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                with memoryview(buffer) as view:
+                    chunks = self._splice_chunks(view, edits)
+                    try:
+                        self._replace_file(calendar_file, chunks, layout.stamp)
+                    finally:
+                        # Slices of the map must be gone before it is closed, even on errors
+                        for chunk in chunks:
+                            if isinstance(chunk, memoryview):
+                                chunk.release()
+        
+        layout.apply(edits, self._record_write(calendar_name))
+        # The parsed tree no longer matches the file, parse it again when needed
+        self.calendars[calendar_name] = None
+        return True
+    
+    @staticmethod
+    def _splice_chunks(view: memoryview, edits: list) -> list:
+        """Get the pieces of the new file: slices of the old one around the edited spans."""
+        chunks = []
+        position = 0
+        for start, end, items in edits:
+            chunks.append(view[position:start])
+            chunks.extend(data for identity, data in items)
+            position = end
+        chunks.append(view[position:])
+        return chunks
+    
+    @staticmethod
+    def _component_identity(component) -> Tuple[str, str]:
+        """Get the (UID, recurrence-id) of an iCal VEVENT component."""
+        recurrence_id = component.get('recurrence-id')
+        return (str(component.get('uid', '')), recurrence_id.to_ical().decode() if recurrence_id else "")
+    
+    def _write_event_to_calendar(self, event: Event, calendar_name: str) -> bool:
+        """Write an event to the appropriate iCal file."""
+        try:
+            # Find the file path for this calendar
+            calendar_file = self.calendar_paths.get(calendar_name)
+            
+            if not calendar_file:
+                print(f"Could not find file for calendar: {calendar_name}")
+                return False
+            
+            # Append the event to the file
+            self._write_calendar_changes(calendar_name, set(), [event])
+            
+            calendar_stats.log("Added event '%s' to %s", event.summary, calendar_file)
+            return True
+            
+        except Exception as e:
+            print(f"Error writing event to calendar file: {e}")
+            return False
+    
+
+    def _replace_event_in_calendar(self, old_event: Event, new_event: Event) -> bool:
+        """Replace the VEVENT of an event in its iCal file."""
+        try:
+            calendar_file = self.calendar_paths.get(old_event.calendar_name)
+            
+            if not calendar_file:
+                print(f"Could not find file for calendar: {old_event.calendar_name}")
+                return False
+            
+            self._write_calendar_changes(old_event.calendar_name, {old_event.identity()}, [new_event])
+            
+            calendar_stats.log("Edited event '%s' in %s", new_event.summary, calendar_file)
+            return True
+            
+        except Exception as e:
+            print(f"Error editing event in calendar file: {e}")
+            return False
+    
+    def _remove_event_from_calendar(self, event: Event) -> bool:
+        """Remove an event from the appropriate iCal file."""
+        try:
+            # Find the file path for this calendar
+            calendar_file = self.calendar_paths.get(event.calendar_name)
+            
+            if not calendar_file:
+                print(f"Could not find file for calendar: {event.calendar_name}")
+                return False
+            
+            # Cut the event out of the file
+            self._write_calendar_changes(event.calendar_name, {event.identity()}, [])
+            
+            calendar_stats.log("Removed event '%s' from %s", event.summary, calendar_file)
+            return True
+            
+        except Exception as e:
+            print(f"Error removing event from calendar file: {e}")
+            return False
+    
+    def get_calendar_names(self) -> List[str]:
+        """Get list of all calendar names."""
+        return list(self.calendars.keys())
+    
+    def get_writable_calendar_names(self) -> List[str]:
+        """Get the names of the calendars events can be added to."""
+        return [name for name in self.calendars if not self.is_read_only(name)]
+    
+    def get_calendar_color(self, calendar_name: str) -> str:
+        """Get the color associated with a calendar."""
+        return self.calendar_colors.get(calendar_name, '#3584e4')
+    
+    def reload_calendars(self):
+        """Reload all calendars from files."""
+        self._load_calendars()
+    
+    def has_events_on_date(self, target_date: date) -> bool:
+        """Check if there are any events on a specific date."""
+        return self.store.has_events_on_date(target_date)
+    
+    @staticmethod
+    def _to_timestamp(value: datetime) -> float:
+        """Convert a datetime to a POSIX timestamp, treating naive values as local time."""
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=tz.tzlocal())
+        return value.timestamp()
+    
+    def _iter_intervals(self, start_ts: float, end_ts: float, calendars: List[str] = None):
+        """Yield (start, end, event) overlapping [start_ts, end_ts), in start order."""
+        for interval_start, interval_end, event in self.store.iter_intervals(start_ts, end_ts):
+            if calendars and event.calendar_name not in calendars:
+                continue
+            yield interval_start, interval_end, event
+    
+    def get_events_in_range(self, start: datetime, end: datetime, calendars: List[str] = None) -> List[Event]:
+        """Get events overlapping [start, end), sorted by start time."""
+        return [event for _, _, event in
+                self._iter_intervals(self._to_timestamp(start), self._to_timestamp(end), calendars)]
+    
+    def get_busy_intervals(self, start: datetime, end: datetime, calendars: List[str] = None,
+                           buffer: timedelta = timedelta(0)) -> List[Tuple[datetime, datetime]]:
+        """
+        Get the merged busy intervals within [start, end).
+        
+        All-day events are treated as free time, like transparent events.
+        
+        Args:
+            start: Start of the range
+            end: End of the range
+            calendars: Calendar names to consider, all calendars if empty
+            buffer: Extra time blocked before and after every event
+        """
+        start_ts = self._to_timestamp(start)
+        end_ts = self._to_timestamp(end)
+        pad = buffer.total_seconds()
+        busy = []
+        for interval_start, interval_end, event in self._iter_intervals(start_ts - pad, end_ts + pad, calendars):
+            if event.all_day:
+                continue
+            busy_start = max(interval_start - pad, start_ts)
+            busy_end = min(interval_end + pad, end_ts)
+            if busy_end <= busy_start:
+                continue
+            if busy and busy_start <= busy[-1][1]:
+                busy[-1][1] = max(busy[-1][1], busy_end)
+            else:
+                busy.append([busy_start, busy_end])
+        local = tz.tzlocal()
+        return [(datetime.fromtimestamp(s, local), datetime.fromtimestamp(e, local)) for s, e in busy]
+    
+    def get_free_slots(self, start_date: date, end_date: date, work_start: time, work_end: time,
+                       calendars: List[str] = None, buffer: timedelta = timedelta(0),
+                       min_duration: timedelta = timedelta(0)) -> List[Tuple[datetime, datetime]]:
+        """
+        Get the free time within working hours for every day of [start_date, end_date].
+        
+        Busy intervals are computed once for the whole range and walked
+        alongside the working-hours windows.
+        """
+        local = tz.tzlocal()
+        windows = []
+        current_date = start_date
+        while current_date <= end_date:
+            window_start = datetime.combine(current_date, work_start, tzinfo=local)
+            window_end = datetime.combine(current_date, work_end, tzinfo=local)
+            if window_end > window_start:
+                windows.append((window_start, window_end))
+            current_date += timedelta(days=1)
+        if not windows:
+            return []
+        
+        busy = self.get_busy_intervals(windows[0][0], windows[-1][1], calendars, buffer)
+        free = []
+        i = 0
+        for window_start, window_end in windows:
+            # Skip busy intervals that ended before this window
+            while i < len(busy) and busy[i][1] <= window_start:
+                i += 1
+            cursor = window_start
+            j = i
+            while j < len(busy) and busy[j][0] < window_end:
+                if busy[j][0] > cursor:
+                    free.append((cursor, busy[j][0]))
+                cursor = max(cursor, busy[j][1])
+                j += 1
+            if cursor < window_end:
+                free.append((cursor, window_end))
+        return [(s, e) for s, e in free if e - s >= min_duration]
+    
+    def find_slots(self, duration: timedelta, start_date: date, end_date: date, work_start: time, work_end: time,
+                   calendars: List[str] = None, buffer: timedelta = timedelta(0), count: int = 3,
+                   not_before: datetime = None) -> List[Tuple[datetime, datetime]]:
+        """
+        Find the earliest free slots of a given duration.
+        
+        Args:
+            duration: Length of the slots
+            start_date: First day to search
+            end_date: Last day to search
+            work_start: Start of the working hours
+            work_end: End of the working hours
+            calendars: Calendar names to consider, all calendars if empty
+            buffer: Free time required before and after other events
+            count: Maximum number of slots to return
+            not_before: Earliest allowed slot start, e.g. now
+            
+        Returns:
+            Up to count (start, end) slots, earliest first
+        """
+        slots = []
+        if duration <= timedelta(0) or count <= 0:
+            return slots
+        for free_start, free_end in self.get_free_slots(start_date, end_date, work_start, work_end,
+                                                        calendars, buffer, duration):
+            slot_start = max(free_start, not_before) if not_before else free_start
+            # Offer back-to-back slots while the free interval has room
+            while slot_start + duration <= free_end:
+                slots.append((slot_start, slot_start + duration))
+                if len(slots) >= count:
+                    return slots
+                slot_start += duration
+        return slots
+    
+    def get_event_columns(self) -> "EventColumns":
+        """Get the columnar view of all events, rebuilt after changes."""
+        if self._columns is None or self._columns[0] != self.generation:
+            with calendar_stats.timer("columns.build"):
+                intervals = list(self.store.iter_intervals(float("-inf"), float("inf")))
+                self._columns = (self.generation, EventColumns(intervals, self.get_calendar_names()))
+        return self._columns[1]
+    
+    def get_time_usage(self, start_date: date, end_date: date, work_start: time, work_end: time,
+                       group: str = "day", calendars: List[str] = None, top: int = 5) -> Dict[str, list]:
+        """
+        Summarize the time taken by events during [start_date, end_date].
+        
+        All-day events are treated as free time and overlapping events are
+        counted once in busy times. Every aggregate is computed from a single
+        selection of the columnar view.
+        
+        Args:
+            group: "day" or "week", weeks starting on Monday
+            calendars: Calendar names to consider, all calendars if empty
+            top: Number of free blocks and recurring titles to report
+            
+        Returns:
+            Dict with "periods": (first day, events, busy seconds, busy seconds within working
+            hours, working hours seconds) per period; "calendars": (name, events, seconds in
+            events); "free_blocks": the longest (start, end) free times within working hours;
+            "titles": (title, occurrences, seconds) of the most repeated event titles
+        """
+        local = tz.tzlocal()
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        if not days:
+            return {"periods": [], "calendars": [], "free_blocks": [], "titles": []}
+        day_starts = [self._to_timestamp(datetime.combine(day, time.min, tzinfo=local)) for day in days]
+        day_ends = day_starts[1:] + [self._to_timestamp(datetime.combine(days[-1] + timedelta(days=1), time.min,
+                                                                          tzinfo=local))]
+        work_starts = [self._to_timestamp(datetime.combine(day, work_start, tzinfo=local)) for day in days]
+        work_ends = [max(self._to_timestamp(datetime.combine(day, work_end, tzinfo=local)), work_start_ts)
+                     for day, work_start_ts in zip(days, work_starts)]
+        range_start, range_end = day_starts[0], day_ends[-1]
+        
+        columns = self.get_event_columns()
+        positions = columns.select(range_start, range_end, calendars)
+        merged = columns.merge(positions)
+        busy = columns.busy_between(merged, day_starts, day_ends)
+        work_busy = columns.busy_between(merged, work_starts, work_ends)
+        counts = columns.counts_between(positions, day_starts + [range_end])
+        
+        periods = OrderedDict()  # First day of the period -> [events, busy, busy within working hours, working hours]
+        for i, day in enumerate(days):
+            period_start = day - timedelta(days=day.weekday()) if group == "week" else day
+            totals = periods.setdefault(period_start, [0, 0.0, 0.0, 0.0])
+            totals[0] += counts[i]
+            totals[1] += float(busy[i])
+            totals[2] += float(work_busy[i])
+            totals[3] += work_ends[i] - work_starts[i]
+        
+        by_calendar = columns.totals_by_calendar(positions, range_start, range_end)
+        free = columns.free_between(merged, work_starts, work_ends)
+        free.sort(key=lambda block: (block[0] - block[1], block[0]))
+        
+        titles = {}  # Normalized title -> [title, occurrences, seconds]
+        for i in positions:
+            event = columns.events[i]
+            entry = titles.setdefault(event.summary.strip().lower(), [event.summary.strip(), 0, 0.0])
+            entry[1] += 1
+            entry[2] += max(min(columns.ends[i], range_end) - max(columns.starts[i], range_start), 0)
+        recurring = sorted((entry for entry in titles.values() if entry[1] > 1), key=lambda entry: (-entry[1], -entry[2]))
+        
+        return {
+            "periods": [(period_start, *totals) for period_start, totals in periods.items()],
+            "calendars": sorted(((name, count, seconds) for name, (count, seconds) in by_calendar.items()),
+                                key=lambda total: -total[2]),
+            "free_blocks": [(datetime.fromtimestamp(s, local), datetime.fromtimestamp(e, local)) for s, e in free[:top]],
+            "titles": [tuple(entry) for entry in recurring[:top]]
+        }
+    
+    def find_conflicts(self, event: Event, calendars: List[str] = None) -> List[Event]:
+        """Get the timed events overlapping an event, other than the event itself."""
+        if event.all_day:
+            return []
+        return [other for other in self.get_events_in_range(event.start_time, event.end_time, calendars)
+                if other.uid != event.uid and not other.all_day]
+
+class EventColumns:
+    """
+    Columnar view of all events for bulk analytics.
+    
+    Start and end times are kept as sorted int64 epoch seconds next to
+    calendar ids and flags, so ranges are selected with searchsorted and
+    busy time is aggregated without per-event Python loops. Without NumPy
+    the same queries run on plain lists.
+    """
+    
+    ALL_DAY = 1
+    
+    def __init__(self, intervals: List[Tuple[float, float, Event]], calendar_names: List[str]):
+        self.calendar_names = list(calendar_names)
+        calendar_ids = {name: index for index, name in enumerate(self.calendar_names)}
+        self.events = [event for _, _, event in intervals]
+        starts = [int(start) for start, _, _ in intervals]
+        ends = [int(end) for _, end, _ in intervals]
+        ids = [calendar_ids.get(event.calendar_name, -1) for event in self.events]
+        flags = [self.ALL_DAY if event.all_day else 0 for event in self.events]
+        self.max_duration = max((end - start for start, end in zip(starts, ends)), default=0)
+        if _load_numpy() is not None:
+            self.starts = numpy.array(starts, dtype=numpy.int64)
+            self.ends = numpy.array(ends, dtype=numpy.int64)
+            self.calendar_ids = numpy.array(ids, dtype=numpy.int32)
+            self.flags = numpy.array(flags, dtype=numpy.uint8)
+        else:
+            self.starts, self.ends, self.calendar_ids, self.flags = starts, ends, ids, flags
+    
+    def __len__(self):
+        return len(self.events)
+    
+    def select(self, start_ts: float, end_ts: float, calendars: List[str] = None, include_all_day: bool = False):
+        """
+        Get the positions of the events overlapping [start_ts, end_ts), in start order.
+        
+        Args:
+            calendars: Calendar names to keep, all calendars if empty
+            include_all_day: Whether all-day events are selected
+        """
+        wanted = {self.calendar_names.index(name) for name in calendars or [] if name in self.calendar_names}
+        if numpy is not None:
+            low = numpy.searchsorted(self.starts, start_ts - self.max_duration, side="left")
+            high = numpy.searchsorted(self.starts, end_ts, side="left")
+            positions = numpy.arange(low, high)
+            starts, ends = self.starts[low:high], self.ends[low:high]
+            mask = (ends > start_ts) | (starts >= start_ts)
+            if not include_all_day:
+                mask &= (self.flags[low:high] & self.ALL_DAY) == 0
+            if calendars:
+                mask &= numpy.isin(self.calendar_ids[low:high], list(wanted))
+            return positions[mask]
+        
+        low = bisect_left(self.starts, start_ts - self.max_duration)
+        high = bisect_left(self.starts, end_ts)
+        return [
+            i for i in range(low, high)
+            if (self.ends[i] > start_ts or self.starts[i] >= start_ts)
+            and (include_all_day or not self.flags[i] & self.ALL_DAY)
+            and (not calendars or self.calendar_ids[i] in wanted)
+        ]
+    
+    def merge(self, positions):
+        """Merge the selected events into disjoint busy intervals (starts, ends), overlaps counted once."""
+        if numpy is not None:
+            return self._merge(self.starts[positions], self.ends[positions])
+        merged_starts, merged_ends = [], []
+        for i in positions:
+            if merged_starts and self.starts[i] <= merged_ends[-1]:
+                merged_ends[-1] = max(merged_ends[-1], self.ends[i])
+            else:
+                merged_starts.append(self.starts[i])
+                merged_ends.append(self.ends[i])
+        return merged_starts, merged_ends
+    
+    def busy_between(self, merged, window_starts: List[float], window_ends: List[float]):
+        """
+        Get the busy seconds of merged intervals within each window.
+        
+        The cumulative busy time is evaluated at every window boundary
+        instead of clipping every interval to every window.
+        """
+        merged_starts, merged_ends = merged
+        if numpy is not None:
+            lengths = merged_ends - merged_starts
+            prefix = numpy.concatenate(([0], numpy.cumsum(lengths)))
+            
+            def busy_until(moments):
+                moments = numpy.asarray(moments, dtype=numpy.float64)
+                if not len(merged_starts):
+                    return numpy.zeros(len(moments))
+                index = numpy.searchsorted(merged_starts, moments, side="right") - 1
+                safe = index.clip(0, None)
+                inside = numpy.clip(moments - merged_starts[safe], 0, lengths[safe])
+                return numpy.where(index >= 0, prefix[safe] + inside, 0)
+            
+            return busy_until(window_ends) - busy_until(window_starts)
+        
+        prefix = [0]
+        for start, end in zip(merged_starts, merged_ends):
+            prefix.append(prefix[-1] + end - start)
+        
+        def busy_until(moment):
+            index = bisect_right(merged_starts, moment) - 1
+            if index < 0:
+                return 0
+            start, end = merged_starts[index], merged_ends[index]
+            return prefix[index] + min(max(moment - start, 0), end - start)
+        
+        return [busy_until(end) - busy_until(start) for start, end in zip(window_starts, window_ends)]
+    
+    def free_between(self, merged, window_starts: List[float], window_ends: List[float]) -> List[Tuple[float, float]]:
+        """Get the gaps between merged intervals within each window, walking both in order."""
+        merged_starts, merged_ends = list(merged[0]), list(merged[1])
+        free = []
+        i = 0
+        for window_start, window_end in zip(window_starts, window_ends):
+            while i < len(merged_starts) and merged_ends[i] <= window_start:
+                i += 1
+            cursor = window_start
+            j = i
+            while j < len(merged_starts) and merged_starts[j] < window_end:
+                if merged_starts[j] > cursor:
+                    free.append((cursor, merged_starts[j]))
+                cursor = max(cursor, merged_ends[j])
+                j += 1
+            if cursor < window_end:
+                free.append((cursor, window_end))
+        return free
+    
+    def counts_between(self, positions, edges: List[float]) -> List[int]:
+        """Count the selected events by the window [edges[k], edges[k + 1]) they start in."""
+        if numpy is not None:
+            index = numpy.searchsorted(edges, self.starts[positions], side="right") - 1
+            index = index[(index >= 0) & (index < len(edges) - 1)]
+            return numpy.bincount(index, minlength=len(edges) - 1).tolist()
+        counts = [0] * (len(edges) - 1)
+        for i in positions:
+            index = bisect_right(edges, self.starts[i]) - 1
+            if 0 <= index < len(counts):
+                counts[index] += 1
+        return counts
+    
+    def totals_by_calendar(self, positions, start_ts: float, end_ts: float) -> Dict[str, Tuple[int, float]]:
+        """Get the event count and the seconds spent in events within [start_ts, end_ts) per calendar."""
+        if numpy is not None:
+            ids = self.calendar_ids[positions] + 1  # Unknown calendars have id -1
+            durations = numpy.clip(numpy.minimum(self.ends[positions], end_ts) -
+                                   numpy.maximum(self.starts[positions], start_ts), 0, None)
+            counts = numpy.bincount(ids, minlength=len(self.calendar_names) + 1)
+            seconds = numpy.bincount(ids, weights=durations, minlength=len(self.calendar_names) + 1)
+            return {name: (int(counts[index + 1]), float(seconds[index + 1]))
+                    for index, name in enumerate(self.calendar_names) if counts[index + 1]}
+        totals = {}
+        for i in positions:
+            name = self.calendar_names[self.calendar_ids[i]] if self.calendar_ids[i] >= 0 else ""
+            count, seconds = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, seconds + max(min(self.ends[i], end_ts) - max(self.starts[i], start_ts), 0))
+        return {name: total for name, total in totals.items() if name}
+    
+    @staticmethod
+    def _merge(starts, ends):
+        """Merge intervals sorted by start into disjoint (starts, ends) arrays."""
+        if not len(starts):
+            return starts, ends
+        running_end = numpy.maximum.accumulate(ends)
+        opens_group = numpy.empty(len(starts), dtype=bool)
+        opens_group[0] = True
+        opens_group[1:] = starts[1:] > running_end[:-1]
+        group_starts = numpy.flatnonzero(opens_group)
+        group_ends = numpy.append(group_starts[1:] - 1, len(starts) - 1)
+        return starts[group_starts], running_end[group_ends]
+
+class EventStore:
+    """Storage backend holding the events of a CalendarManager."""
+    
+    persistent = False  # Whether events survive restarts, synchronised by file fingerprint
+    
+    def clear(self):
+        """Remove every event."""
+        raise NotImplementedError
+    
+    def add(self, event: Event):
+        """Add an event."""
+        raise NotImplementedError
+    
+    def add_many(self, events: List[Event]):
+        """Add several events at once."""
+        for event in events:
+            self.add(event)
+    
+    def remove(self, event: Event) -> bool:
+        """Remove an event by calendar, UID and recurrence-id, returning whether it was found."""
+        raise NotImplementedError
+    
+    def get_event(self, calendar_name: str, uid: str, recurrence_id: str = "") -> Optional[Event]:
+        """Get the stored event with an identity, whatever its current date."""
+        raise NotImplementedError
+    
+    def replace(self, old_event: Event, new_event: Event) -> bool:
+        """Replace a stored event, returning False and changing nothing if it was not found."""
+        if not self.remove(old_event):
+            return False
+        self.add(new_event)
+        return True
+    
+    def remove_calendar(self, calendar_name: str):
+        """Remove every event of a calendar."""
+        raise NotImplementedError
+    
+    def get_events_for_date(self, target_date: date) -> List[Event]:
+        """Get the events starting on a date, in no particular order."""
+        raise NotImplementedError
+    
+    def has_events_on_date(self, target_date: date) -> bool:
+        """Check if any event starts on a date."""
+        raise NotImplementedError
+    
+    def iter_intervals(self, start_ts: float, end_ts: float):
+        """Yield (start, end, event) overlapping [start_ts, end_ts), in start order."""
+        raise NotImplementedError
+    
+    def search(self, text: str, start_ts: float, end_ts: float) -> List[Event]:
+        """Get the events starting in [start_ts, end_ts) whose title contains text, in start order."""
+        raise NotImplementedError
+    
+    def find_candidates(self, start_ts: Optional[float], end_ts: Optional[float], calendars: Optional[List[str]],
+                        terms: List[Tuple[str, str]]) -> List[Event]:
+        """
+        Narrow down the events a query may match using the indexes.
+        
+        Args:
+            start_ts: Earliest start of the events, None for no limit
+            end_ts: Start the events are before, None for no limit
+            calendars: Names of the calendars of the events, None for any
+            terms: ("text" or "location", lowercase text) pairs; the title, description
+                or location, or the location, of every event contains the text
+            
+        Returns:
+            Events in start order, possibly some not matching the terms but none that match left out
+        """
+        raise NotImplementedError
+    
+    def count(self) -> int:
+        """Get the number of stored events."""
+        raise NotImplementedError
+    
+    def get_fingerprints(self) -> Dict[str, Tuple[str, str]]:
+        """Get file path to (fingerprint, calendar name) of the files the store is in sync with."""
+        return {}
+    
+    def set_fingerprint(self, file_path: str, calendar_name: str, fingerprint: str):
+        """Record that the store is in sync with a file."""
+    
+    def forget_file(self, file_path: str):
+        """Forget the fingerprint of a file."""
+    
+    def close(self):
+        """Release the resources held by the store."""
+
+class WordIndex:
+    """
+    Inverted index from the words of event texts to the events, for the memory store.
+    
+    A text is looked up by its words: an event containing the text contains
+    each of its words inside one of its own words, so the events of the
+    indexed words containing them include every match.
+    """
+    
+    WORD_PATTERN = re.compile(r"\w+")
+    FIELDS = {"text": ("summary", "description", "location"), "location": ("location",)}
+    SPLIT_CACHE_SIZE = 4096  # Texts whose words are kept, occurrences of a recurring event share theirs
+    
+    def __init__(self, events=()):
+        self.postings = {field: {} for field in self.FIELDS}  # Dict[str, Dict[str, set]] - field to word to events
+        self._split_cache = {}  # Dict[str, frozenset]
+        for event in events:
+            self.add(event)
+    
+    def _get_words(self, event: Event, field: str) -> frozenset:
+        """Get the lowercase words of the attributes of an event making up a field."""
+        text = " ".join(getattr(event, name) for name in self.FIELDS[field])
+        words = self._split_cache.get(text)
+        if words is None:
+            if len(self._split_cache) >= self.SPLIT_CACHE_SIZE:
+                self._split_cache.clear()
+            words = self._split_cache[text] = frozenset(self.WORD_PATTERN.findall(text.lower()))
+        return words
+    
+    def add(self, event: Event):
+        """Index the words of an event."""
+        for field, postings in self.postings.items():
+            for word in self._get_words(event, field):
+                postings.setdefault(word, set()).add(event)
+    
+    def remove(self, event: Event):
+        """Drop an event from the index."""
+        for field, postings in self.postings.items():
+            for word in self._get_words(event, field):
+                events = postings.get(word)
+                if events is not None:
+                    events.discard(event)
+                    if not events:
+                        del postings[word]
+    
+    def lookup(self, field: str, text: str) -> Optional[set]:
+        """Get the events whose field may contain a lowercase text, None if the text has no word."""
+        words = set(self.WORD_PATTERN.findall(text))
+        if not words:
+            return None
+        postings = self.postings[field]
+        result = None
+        # Longer words are contained in fewer indexed words, start with them
+        for word in sorted(words, key=len, reverse=True):
+            events = set()
+            for indexed_word, indexed_events in postings.items():
+                if word in indexed_word:
+                    events |= indexed_events
+            result = events if result is None else result & events
+            if not result:
+                break
+        return result
+
+class MemoryEventStore(EventStore):
+    """Keeps events as Python objects grouped by start date."""
+    
+    def __init__(self):
+        self.events = {}  # Dict[date, List[Event]]
+        self.by_identity = {}  # Dict[Tuple[str, str, str], List[Event]] - (calendar, UID, recurrence-id)
+        self._interval_index = []  # List[Tuple[float, float, Event]] sorted by start
+        self._interval_starts = []
+        self._interval_max_duration = 0
+        self._dirty = True
+        self._words = None  # WordIndex built by the first query with text, then kept up to date
+    
+    def clear(self):
+        self.events.clear()
+        self.by_identity.clear()
+        self._dirty = True
+        self._words = None
+    
+    def add(self, event: Event):
+        event_date = event.start_time.date()
+        if event_date not in self.events:
+            self.events[event_date] = []
+        self.events[event_date].append(event)
+        self.by_identity.setdefault((event.calendar_name,) + event.identity(), []).append(event)
+        self._dirty = True
+        if self._words is not None:
+            self._words.add(event)
+    
+    def remove(self, event: Event) -> bool:
+        key = (event.calendar_name,) + event.identity()
+        stored = self.by_identity.get(key)
+        if not stored:
+            return False
+        # Duplicated identities are removed by start date first
+        event_date = event.start_time.date()
+        target = next((e for e in stored if e.start_time.date() == event_date), stored[0])
+        stored.remove(target)
+        if not stored:
+            del self.by_identity[key]
+        
+        target_date = target.start_time.date()
+        events_list = self.events[target_date]
+        events_list.remove(target)
+        if not events_list:
+            del self.events[target_date]
+        self._dirty = True
+        if self._words is not None:
+            self._words.remove(target)
+        return True
+    
+    def get_event(self, calendar_name: str, uid: str, recurrence_id: str = "") -> Optional[Event]:
+        stored = self.by_identity.get((calendar_name, uid, recurrence_id))
+        return stored[0] if stored else None
+    
+    def remove_calendar(self, calendar_name: str):
+        for event_date in list(self.events.keys()):
+            remaining = [e for e in self.events[event_date] if e.calendar_name != calendar_name]
+            if remaining:
+                self.events[event_date] = remaining
+            else:
+                del self.events[event_date]
+        self.by_identity = {key: events for key, events in self.by_identity.items() if key[0] != calendar_name}
+        self._dirty = True
+        self._words = None
+    
+    def get_events_for_date(self, target_date: date) -> List[Event]:
+        return self.events.get(target_date, [])
+    
+    def has_events_on_date(self, target_date: date) -> bool:
+        return target_date in self.events and len(self.events[target_date]) > 0
+    
+    def _get_interval_index(self) -> List[Tuple[float, float, Event]]:
+        """Get all events as (start, end, event) sorted by start, rebuilt after changes."""
+        if self._dirty:
+            build_start = perf_counter()
+            intervals = []
+            for events in self.events.values():
+                for event in events:
+                    start_ts = CalendarManager._to_timestamp(event.start_time)
+                    end_ts = max(CalendarManager._to_timestamp(event.end_time), start_ts)
+                    intervals.append((start_ts, end_ts, event))
+            intervals.sort(key=lambda interval: (interval[0], interval[1], interval[2].uid))
+            self._interval_index = intervals
+            self._interval_starts = [interval[0] for interval in intervals]
+            self._interval_max_duration = max((end - start for start, end, _ in intervals), default=0)
+            self._dirty = False
+            if calendar_stats.enabled:
+                calendar_stats.record("index.build", perf_counter() - build_start)
+        return self._interval_index
+    
+    def iter_intervals(self, start_ts: float, end_ts: float):
+        index = self._get_interval_index()
+        # No event starting before start_ts - max_duration can reach the range
+        i = bisect_left(self._interval_starts, start_ts - self._interval_max_duration)
+        stop = bisect_left(self._interval_starts, end_ts)
+        for interval_start, interval_end, event in index[i:stop]:
+            if interval_end <= start_ts and interval_start < start_ts:
+                continue
+            yield interval_start, interval_end, event
+    
+    def search(self, text: str, start_ts: float, end_ts: float) -> List[Event]:
+        index = self._get_interval_index()
+        search_term = text.lower()
+        i = bisect_left(self._interval_starts, start_ts)
+        stop = bisect_left(self._interval_starts, end_ts)
+        return [event for _, _, event in index[i:stop] if search_term in event.summary.lower()]
+    
+    def find_candidates(self, start_ts: Optional[float], end_ts: Optional[float], calendars: Optional[List[str]],
+                        terms: List[Tuple[str, str]]) -> List[Event]:
+        index = self._get_interval_index()
+        i = bisect_left(self._interval_starts, start_ts) if start_ts is not None else 0
+        stop = bisect_left(self._interval_starts, end_ts) if end_ts is not None else len(index)
+        calendars = set(calendars) if calendars is not None else None
+        
+        matching = None  # Events containing the words of every term, None when there are no words
+        if terms:
+            if self._words is None:
+                self._words = WordIndex(event for _, _, event in index)
+            for field, text in terms:
+                events = self._words.lookup(field, text)
+                if events is not None:
+                    matching = events if matching is None else matching & events
+        if matching is not None and len(matching) < stop - i:
+            # Fewer events contain the words than start in the range, sort them instead of scanning it
+            candidates = []
+            for event in matching:
+                start = CalendarManager._to_timestamp(event.start_time)
+                if (start_ts is None or start >= start_ts) and (end_ts is None or start < end_ts):
+                    candidates.append((start, max(CalendarManager._to_timestamp(event.end_time), start), event))
+            candidates.sort(key=lambda interval: (interval[0], interval[1], interval[2].uid))
+        else:
+            candidates = index[i:stop]
+        return [event for _, _, event in candidates
+                if (matching is None or event in matching) and (calendars is None or event.calendar_name in calendars)]
+    
+    def count(self) -> int:
+        return sum(len(events) for events in self.events.values())
+
+class SQLiteEventStore(EventStore):
+    """
+    Keeps events in an SQLite database with indexed times and a full-text index.
+    
+    Events survive restarts: a calendar file is only parsed again when its
+    fingerprint changed, so large calendars cost little Python memory.
+    """
+    
+    persistent = True
+    SCHEMA_VERSION = 2
+    INSERT_EVENT = ("INSERT INTO events (uid, recurrence_id, calendar, day, start_ts, end_ts, summary, "
+                    "description, location, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        # Calendars may be loaded in a background thread, then used on the main loop
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.fts = False
+        self._max_duration = None
+        self._create_schema()
+    
+    def _create_schema(self):
+        """Create the tables, recreating them if the schema changed."""
+        with self.lock, self.connection:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                self.connection.executescript("""
+                    DROP TABLE IF EXISTS events_fts;
+                    DROP TABLE IF EXISTS events;
+                    DROP TABLE IF EXISTS files;
+                """)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY,
+                    uid TEXT NOT NULL,
+                    recurrence_id TEXT NOT NULL,
+                    calendar TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    start_ts REAL NOT NULL,
+                    end_ts REAL NOT NULL,
+                    summary TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS events_start ON events(start_ts);
+                CREATE INDEX IF NOT EXISTS events_end ON events(end_ts);
+                CREATE INDEX IF NOT EXISTS events_day ON events(day);
+                CREATE INDEX IF NOT EXISTS events_calendar ON events(calendar);
+                CREATE INDEX IF NOT EXISTS events_uid ON events(uid);
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    calendar TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL
+                );
+            """)
+            try:
+                self.connection.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+                        summary, description, location, content='events', content_rowid='id', tokenize='trigram'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+                        INSERT INTO events_fts(rowid, summary, description, location)
+                        VALUES (new.id, new.summary, new.description, new.location);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+                        INSERT INTO events_fts(events_fts, rowid, summary, description, location)
+                        VALUES ('delete', old.id, old.summary, old.description, old.location);
+                    END;
+                """)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                # FTS5 or its trigram tokenizer is unavailable, fall back to scanning titles
+                print(f"Full-text search unavailable in calendar store: {e}")
+            self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    def _row(self, event: Event) -> tuple:
+        """Convert an event to a row of the events table."""
+        start_ts = CalendarManager._to_timestamp(event.start_time)
+        end_ts = max(CalendarManager._to_timestamp(event.end_time), start_ts)
+        return (event.uid, event.recurrence_id, event.calendar_name, event.start_time.date().isoformat(),
+                start_ts, end_ts, event.summary, event.description, event.location, json.dumps(event.to_dict()))
+    
+    def _query(self, sql: str, parameters: tuple = ()) -> List[Event]:
+        """Run a query selecting the data column and decode the events."""
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [Event.from_dict(json.loads(row[0])) for row in rows]
+    
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM events")
+            self.connection.execute("DELETE FROM files")
+        self._max_duration = None
+    
+    def add(self, event: Event):
+        self.add_many([event])
+    
+    def add_many(self, events: List[Event]):
+        with self.lock, self.connection:
+            self.connection.executemany(self.INSERT_EVENT, [self._row(event) for event in events])
+        self._max_duration = None
+    
+    def _delete(self, event: Event) -> bool:
+        """Delete the row of an event, the caller holds the lock and the transaction."""
+        cursor = self.connection.execute(
+            "DELETE FROM events WHERE id = (SELECT id FROM events WHERE uid = ? AND recurrence_id = ? "
+            "AND calendar = ? ORDER BY day = ? DESC LIMIT 1)",
+            (event.uid, event.recurrence_id, event.calendar_name, event.start_time.date().isoformat())
+        )
+        return cursor.rowcount > 0
+    
+    def remove(self, event: Event) -> bool:
+        with self.lock, self.connection:
+            removed = self._delete(event)
+        self._max_duration = None
+        return removed
+    
+    def get_event(self, calendar_name: str, uid: str, recurrence_id: str = "") -> Optional[Event]:
+        events = self._query("SELECT data FROM events WHERE uid = ? AND recurrence_id = ? AND calendar = ? LIMIT 1",
+                             (uid, recurrence_id, calendar_name))
+        return events[0] if events else None
+    
+    def replace(self, old_event: Event, new_event: Event) -> bool:
+        with self.lock, self.connection:
+            if not self._delete(old_event):
+                return False
+            self.connection.execute(self.INSERT_EVENT, self._row(new_event))
+        self._max_duration = None
+        return True
+    
+    def remove_calendar(self, calendar_name: str):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM events WHERE calendar = ?", (calendar_name,))
+        self._max_duration = None
+    
+    def get_events_for_date(self, target_date: date) -> List[Event]:
+        return self._query("SELECT data FROM events WHERE day = ?", (target_date.isoformat(),))
+    
+    def has_events_on_date(self, target_date: date) -> bool:
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM events WHERE day = ? LIMIT 1",
+                                          (target_date.isoformat(),)).fetchone()
+        return row is not None
+    
+    def _get_max_duration(self) -> float:
+        """Get the longest event duration, bounding how early an overlapping event can start."""
+        if self._max_duration is None:
+            with self.lock:
+                row = self.connection.execute("SELECT MAX(end_ts - start_ts) FROM events").fetchone()
+            self._max_duration = row[0] or 0
+        return self._max_duration
+    
+    def iter_intervals(self, start_ts: float, end_ts: float):
+        earliest_start = start_ts - self._get_max_duration()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT start_ts, end_ts, data FROM events "
+                "WHERE start_ts >= ? AND start_ts < ? AND (end_ts > ? OR start_ts >= ?) "
+                "ORDER BY start_ts, end_ts, uid",
+                (earliest_start, end_ts, start_ts, start_ts)
+            ).fetchall()
+        for interval_start, interval_end, data in rows:
+            yield interval_start, interval_end, Event.from_dict(json.loads(data))
+    
+    def search(self, text: str, start_ts: float, end_ts: float) -> List[Event]:
+        if not text:
+            return self._query("SELECT data FROM events WHERE start_ts >= ? AND start_ts < ? "
+                               "ORDER BY start_ts, end_ts, uid", (start_ts, end_ts))
+        if self.fts and len(text) >= 3:
+            # The trigram tokenizer matches substrings, like the in-memory search
+            phrase = '"' + text.replace('"', '""') + '"'
+            return self._query(
+                "SELECT e.data FROM events_fts JOIN events e ON e.id = events_fts.rowid "
+                "WHERE events_fts MATCH ? AND e.start_ts >= ? AND e.start_ts < ? "
+                "ORDER BY e.start_ts, e.end_ts, e.uid",
+                (f"summary : {phrase}", start_ts, end_ts)
+            )
+        return self._query("SELECT data FROM events WHERE instr(lower(summary), ?) > 0 "
+                           "AND start_ts >= ? AND start_ts < ? ORDER BY start_ts, end_ts, uid",
+                           (text.lower(), start_ts, end_ts))
+    
+    def find_candidates(self, start_ts: Optional[float], end_ts: Optional[float], calendars: Optional[List[str]],
+                        terms: List[Tuple[str, str]]) -> List[Event]:
+        conditions, parameters, phrases = [], [], []
+        if start_ts is not None:
+            conditions.append("e.start_ts >= ?")
+            parameters.append(start_ts)
+        if end_ts is not None:
+            conditions.append("e.start_ts < ?")
+            parameters.append(end_ts)
+        if calendars is not None:
+            conditions.append(f"e.calendar IN ({', '.join('?' * len(calendars))})")
+            parameters.extend(calendars)
+        for field, text in terms:
+            columns = ("location",) if field == "location" else ("summary", "description", "location")
+            if self.fts and len(text) >= 3:
+                # The trigram tokenizer matches substrings ignoring case, like the query
+                phrase = '"' + text.replace('"', '""') + '"'
+                phrases.append("{" + " ".join(columns) + "} : " + phrase)
+            elif text.isascii():
+                # lower() only folds ASCII, other text is checked after the query
+                conditions.append("(" + " OR ".join(f"instr(lower(e.{column}), ?) > 0" for column in columns) + ")")
+                parameters.extend([text] * len(columns))
+        
+        if phrases:
+            sql = "SELECT e.data FROM events_fts JOIN events e ON e.id = events_fts.rowid WHERE events_fts MATCH ?"
+            parameters.insert(0, " AND ".join(phrases))
+        else:
+            sql = "SELECT e.data FROM events e WHERE 1"
+        return self._query(sql + "".join(f" AND {condition}" for condition in conditions) +
+                           " ORDER BY e.start_ts, e.end_ts, e.uid", tuple(parameters))
+    
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    
+    def get_fingerprints(self) -> Dict[str, Tuple[str, str]]:
+        with self.lock:
+            rows = self.connection.execute("SELECT path, fingerprint, calendar FROM files").fetchall()
+        return {path: (fingerprint, calendar) for path, fingerprint, calendar in rows}
+    
+    def set_fingerprint(self, file_path: str, calendar_name: str, fingerprint: str):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO files (path, calendar, fingerprint) VALUES (?, ?, ?)",
+                                    (file_path, calendar_name, fingerprint))
+    
+    def forget_file(self, file_path: str):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class CalDAVClient:
+    """
+    Minimal WebDAV client for CalDAV servers.
+    
+    Clients are shared per server and account, so every calendar on a server
+    goes through a single keep-alive connection. The connection is opened
+    again when the server closed it while idle.
+    """
+    
+    TIMEOUT = 30  # Seconds before a request is given up
+    USER_AGENT = "Newelle-Calendar"
+    _clients = {}  # Dict[tuple, CalDAVClient] - (scheme, host, port, user) to client
+    _clients_lock = threading.Lock()
+    
+    def __init__(self, scheme: str, host: str, port: Optional[int], authorization: Optional[str]):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.authorization = authorization
+        self.connection = None
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def for_url(cls, url: str) -> Tuple["CalDAVClient", str]:
+        """
+        Get the shared client for the server of a caldav+http(s) URL.
+        
+        Returns:
+            Tuple of (client, path of the URL)
+        """
+        parsed = urllib.parse.urlsplit(url)
+        scheme = parsed.scheme.lower().split("+")[-1]
+        authorization = None
+        if parsed.username:
+            credentials = f"{urllib.parse.unquote(parsed.username)}:{urllib.parse.unquote(parsed.password or '')}"
+            authorization = "Basic " + base64.b64encode(credentials.encode()).decode()
+        key = (scheme, parsed.hostname, parsed.port, parsed.username)
+        with cls._clients_lock:
+            client = cls._clients.get(key)
+            if client is None or client.authorization != authorization:
+                client = cls._clients[key] = cls(scheme, parsed.hostname, parsed.port, authorization)
+        return client, parsed.path or "/"
+    
+    def request(self, method: str, path: str, body: bytes = None, headers: Dict[str, str] = None):
+        """
+        Send a request on the shared connection.
+        
+        Returns:
+            Tuple of (status, response headers, response body)
+            
+        Raises:
+            OSError: if the server cannot be reached
+        """
+        import http.client
+        headers = dict(headers or {})
+        headers["User-Agent"] = self.USER_AGENT
+        if self.authorization:
+            headers["Authorization"] = self.authorization
+        with self.lock, calendar_stats.timer(f"caldav.{method.lower()}"):
+            for attempt in range(2):
+                reused = self.connection is not None
+                if not reused:
+                    connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+                    self.connection = connection_class(self.host, self.port, timeout=self.TIMEOUT)
+                try:
+                    self.connection.request(method, path, body=body, headers=headers)
+                    response = self.connection.getresponse()
+                    data = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    self.close()
+                    if reused and attempt == 0:
+                        continue  # The server dropped the idle connection
+                    raise OSError(f"{method} {path}: {e}") from e
+                if response.will_close:
+                    self.close()
+                return response.status, response.headers, data
+    
+    def close(self):
+        """Close the connection, the next request opens a new one."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class CalDAVCalendar:
+    """
+    A calendar collection on a CalDAV server, mirrored to a local iCal file.
+    
+    The first sync downloads every resource, later syncs send the token of the
+    previous one (RFC 6578 sync-collection) so only the changed resources are
+    downloaded. Changes are uploaded with PUT and DELETE conditional on the
+    ETag of the resource, so changes made by other clients are not overwritten.
+    The local file is read by CalendarManager like any other calendar.
+    """
+    
+    SCHEMES = ("caldav+http", "caldav+https")
+    NAMESPACES = {"d": "DAV:", "c": "urn:ietf:params:xml:ns:caldav"}
+    PROPFIND_NAME = ('<?xml version="1.0" encoding="utf-8"?>'
+                     '<d:propfind xmlns:d="DAV:"><d:prop><d:displayname/></d:prop></d:propfind>')
+    SYNC_COLLECTION = ('<?xml version="1.0" encoding="utf-8"?>'
+                       '<d:sync-collection xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+                       '<d:sync-token>{token}</d:sync-token><d:sync-level>1</d:sync-level>'
+                       '<d:prop><d:getetag/><c:calendar-data/></d:prop></d:sync-collection>')
+    MULTIGET = ('<?xml version="1.0" encoding="utf-8"?>'
+                '<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+                '<d:prop><d:getetag/><c:calendar-data/></d:prop>{hrefs}</c:calendar-multiget>')
+    UID_PATTERN = re.compile(r"^UID(?:;[^:\r\n]*)?:(.*)$", re.MULTILINE)
+    
+    class Conflict(Exception):
+        """Raised when a resource changed on the server since the last sync."""
+    
+    def __init__(self, url: str, cache_path: str, state_path: str):
+        """
+        Initialize the calendar.
+        
+        Args:
+            url: caldav+http(s) URL of the collection, credentials may be given in it
+            cache_path: Local iCal copy of the calendar
+            state_path: File keeping the sync token, ETags and resources between runs
+        """
+        self.url = url
+        self.cache_path = cache_path
+        self.state_path = state_path
+        self.client, self.collection = CalDAVClient.for_url(url)
+        self.collection = urllib.parse.unquote(self.collection.rstrip("/")) + "/"
+        self.lock = threading.Lock()
+        self.state = self._load_state()
+    
+    @classmethod
+    def is_caldav(cls, location: str) -> bool:
+        """Check whether a calendar location is a CalDAV collection."""
+        return urllib.parse.urlsplit(location).scheme.lower() in cls.SCHEMES
+    
+    @property
+    def display_url(self) -> str:
+        """The URL without credentials, for messages."""
+        parsed = urllib.parse.urlsplit(self.url)
+        netloc = parsed.netloc.rpartition("@")[2]
+        return urllib.parse.urlunsplit((parsed.scheme, netloc, parsed.path, "", ""))
+    
+    def sync(self) -> bool:
+        """
+        Download the resources changed since the last sync.
+        
+        Returns:
+            True if the local copy changed
+            
+        Raises:
+            OSError: if the server cannot be reached or refuses the sync
+        """
+        with self.lock:
+            return self._sync()
+    
+    def _sync(self) -> bool:
+        """Sync with the lock held."""
+        from xml.sax.saxutils import escape as xml_escape
+        if not self.state.get("name"):
+            self.state["name"] = self._get_display_name()
+        token = self.state.get("sync_token", "")
+        status, headers, data = self._request("REPORT", self.collection,
+                                              self.SYNC_COLLECTION.format(token=xml_escape(token)), depth="1")
+        if status in (403, 409, 410) and token:
+            # The server forgot the token, start over with a full sync
+            calendar_stats.count("caldav.full_sync")
+            self.state["sync_token"] = ""
+            self.state["resources"] = {}
+            self._sync()
+            return True
+        if status != 207:
+            raise OSError(f"Sync of {self.display_url} failed: HTTP {status}")
+        
+        root = self._parse_multistatus(data)
+        resources = self.state["resources"]
+        changed = False
+        missing = []
+        for href, etag, calendar_data in self._iter_responses(root):
+            if etag is None:
+                changed = resources.pop(href, None) is not None or changed  # Deleted
+            elif resources.get(href, {}).get("etag") == etag:
+                continue  # Unchanged, e.g. our own write
+            elif calendar_data:
+                resources[href] = {"etag": etag, "data": calendar_data}
+                changed = True
+            else:
+                missing.append(href)
+        if missing:
+            changed = self._fetch_resources(missing) or changed
+        self.state["sync_token"] = root.findtext("d:sync-token", "", self.NAMESPACES)
+        calendar_stats.count("caldav.sync")
+        
+        if changed or not os.path.exists(self.cache_path):
+            self._write_cache()
+        self._save_state()
+        return changed
+    
+    def _fetch_resources(self, hrefs: List[str]) -> bool:
+        """Download resources a sync reported without their data."""
+        from xml.sax.saxutils import escape as xml_escape
+        body = self.MULTIGET.format(hrefs="".join(f"<d:href>{xml_escape(urllib.parse.quote(href))}</d:href>"
+                                                  for href in hrefs))
+        status, headers, data = self._request("REPORT", self.collection, body, depth="1")
+        if status != 207:
+            raise OSError(f"Download from {self.display_url} failed: HTTP {status}")
+        changed = False
+        for href, etag, calendar_data in self._iter_responses(self._parse_multistatus(data)):
+            if etag is not None and calendar_data:
+                self.state["resources"][href] = {"etag": etag, "data": calendar_data}
+                changed = True
+        return changed
+    
+    def _get_display_name(self) -> str:
+        """Get the name of the collection, or the last part of its path."""
+        default_name = os.path.basename(self.collection.rstrip("/")) or self.client.host
+        try:
+            status, headers, data = self._request("PROPFIND", self.collection, self.PROPFIND_NAME, depth="0")
+            if status == 207:
+                name = self._parse_multistatus(data).findtext(".//d:displayname", "", self.NAMESPACES)
+                return name.strip() or default_name
+        except ValueError:
+            pass
+        return default_name
+    
+    def _request(self, method: str, href: str, body=None, depth: str = None, headers: Dict[str, str] = None):
+        """Send a request for a resource of the collection, a str body being sent as XML."""
+        headers = dict(headers or {})
+        if isinstance(body, str):
+            headers["Content-Type"] = "application/xml; charset=utf-8"
+            body = body.encode()
+        if depth is not None:
+            headers["Depth"] = depth
+        return self.client.request(method, urllib.parse.quote(href), body, headers)
+    
+    @classmethod
+    def _parse_multistatus(cls, data: bytes):
+        """Parse a 207 Multi-Status response."""
+        from xml.etree import ElementTree
+        try:
+            return ElementTree.fromstring(data)
+        except ElementTree.ParseError as e:
+            raise ValueError(f"Invalid CalDAV response: {e}") from e
+    
+    def _iter_responses(self, root):
+        """
+        Iterate the resources of a Multi-Status response.
+        
+        Yields:
+            Tuples of (href, ETag or None if deleted, calendar data or None)
+        """
+        for response in root.findall("d:response", self.NAMESPACES):
+            href = self._normalize_href(response.findtext("d:href", "", self.NAMESPACES))
+            if not href or href == self.collection:
+                continue
+            if " 404" in response.findtext("d:status", "", self.NAMESPACES):
+                yield href, None, None
+                continue
+            for propstat in response.findall("d:propstat", self.NAMESPACES):
+                if " 200" not in propstat.findtext("d:status", "", self.NAMESPACES):
+                    continue
+                etag = propstat.findtext("d:prop/d:getetag", None, self.NAMESPACES)
+                if etag is not None:
+                    yield href, etag, propstat.findtext("d:prop/c:calendar-data", None, self.NAMESPACES)
+                break
+    
+    @staticmethod
+    def _normalize_href(href: str) -> str:
+        """Get the decoded path of an href, servers may send it as a full URL."""
+        return urllib.parse.unquote(urllib.parse.urlsplit(href.strip()).path)
+    
+    def write_changes(self, remove_identities, components: list, component_identity):
+        """
+        Remove VEVENTs by (UID, recurrence-id) from the server and upload new ones.
+        
+        All VEVENTs of a UID live in the same resource, which is uploaded again
+        as a whole, or deleted when none is left.
+        
+        Args:
+            remove_identities: (UID, recurrence-id) of the VEVENTs to remove
+            components: iCal VEVENT components to upload
+            component_identity: Function getting the (UID, recurrence-id) of a component
+            
+        Raises:
+            CalDAVCalendar.Conflict: if a resource was changed by another client,
+                the local copy is synced again before raising
+            OSError: if the server cannot be reached or refuses a change
+        """
+        changes = {}  # Dict[str, Tuple[set, list]] - UID to (identities to remove, components to add)
+        for identity in remove_identities:
+            changes.setdefault(identity[0], (set(), []))[0].add(identity)
+        for component in components:
+            changes.setdefault(str(component.get('uid', '')), (set(), []))[1].append(component)
+        
+        with self.lock:
+            hrefs = self._get_uid_hrefs()
+            try:
+                for uid, (removed, added) in changes.items():
+                    self._write_resource(uid, hrefs.get(uid), removed, added, component_identity)
+            except self.Conflict:
+                calendar_stats.count("caldav.conflict")
+                self._sync()
+                raise
+            finally:
+                self._write_cache()
+                self._save_state()
+    
+    def _write_resource(self, uid: str, href: Optional[str], removed: set, added: list, component_identity):
+        """Upload the new version of the resource holding a UID."""
+        from icalendar import Calendar
+        if href is None:
+            if not added:
+                return  # Nothing on the server to remove
+            calendar = Calendar()
+            calendar.add('prodid', '-//Newelle//Calendar//EN')
+            calendar.add('version', '2.0')
+            href = self.collection + re.sub(r"[^\w.@-]", "_", uid) + ".ics"
+            headers = {"If-None-Match": "*"}
+        else:
+            if not self.state["resources"][href].get("etag"):
+                # Written without an ETag in the answer, the change must not be unconditional
+                self._fetch_resources([href])
+            resource = self.state["resources"][href]
+            if not resource.get("etag"):
+                raise self.Conflict(f"{href} has no ETag to be changed safely")
+            calendar = Calendar.from_ical(resource["data"])
+            calendar.subcomponents[:] = [
+                component for component in calendar.subcomponents
+                if not (component.name == "VEVENT" and component_identity(component) in removed)
+            ]
+            headers = {"If-Match": resource["etag"]}
+        for component in added:
+            calendar.add_component(component)
+        
+        data = None
+        if any(component.name == "VEVENT" for component in calendar.subcomponents):
+            data = calendar.to_ical()
+            headers["Content-Type"] = "text/calendar; charset=utf-8"
+            status, response_headers, _ = self._request("PUT", href, data, headers=headers)
+        else:
+            status, response_headers, _ = self._request("DELETE", href, headers=headers)
+        
+        if status == 412:
+            raise self.Conflict(f"{href} was changed on the server")
+        if status not in (200, 201, 204, 404):
+            raise OSError(f"Could not write {href} to {self.display_url}: HTTP {status}")
+        if data is not None:
+            self.state["resources"][href] = {"etag": response_headers.get("ETag"), "data": data.decode()}
+            if self.state["resources"][href]["etag"] is None:
+                # Servers may leave the ETag out, get it with the resource as the server keeps it
+                try:
+                    self._fetch_resources([href])
+                except (OSError, ValueError) as e:
+                    calendar_stats.log("Could not get the ETag of %s, it is fetched before its next change: %s",
+                                       href, e)
+        else:
+            self.state["resources"].pop(href, None)
+    
+    def _get_uid_hrefs(self) -> Dict[str, str]:
+        """Get the resource holding each UID."""
+        hrefs = {}
+        for href, resource in self.state["resources"].items():
+            for uid in self.UID_PATTERN.findall(self._unfold(resource["data"])):
+                hrefs[uid.strip()] = href
+        return hrefs
+    
+    @staticmethod
+    def _unfold(data: str) -> str:
+        """Join the folded lines of iCal data."""
+        return re.sub(r"\r?\n[ \t]", "", data)
+    
+    def _write_cache(self):
+        """Write the local iCal copy: every resource merged into one VCALENDAR."""
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Newelle//Calendar//EN",
+                 "X-WR-CALNAME:" + re.sub(r"([\\;,])", r"\\\1", self.state.get("name", "")).replace("\n", "\\n")]
+        timezones = set()
+        for href in sorted(self.state["resources"]):
+            lines.extend(self._iter_components(self.state["resources"][href]["data"], timezones))
+        lines.append("END:VCALENDAR")
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(("\r\n".join(lines) + "\r\n").encode())
+        os.replace(temp_path, self.cache_path)
+    
+    @staticmethod
+    def _iter_components(data: str, timezones: set):
+        """Iterate the lines of the components of a resource, skipping already written time zones."""
+        depth = 0
+        block = []
+        for line in CalDAVCalendar._unfold(data).splitlines():
+            upper = line.upper()
+            if upper.startswith("BEGIN:"):
+                depth += 1
+            if depth >= 2:
+                block.append(line)
+            if upper.startswith("END:"):
+                depth -= 1
+                if depth == 1 and block:
+                    if block[0].upper() == "BEGIN:VTIMEZONE":
+                        tzid = next((item.partition(":")[2] for item in block if item.upper().startswith("TZID")), None)
+                        if tzid in timezones:
+                            block = []
+                            continue
+                        timezones.add(tzid)
+                    yield from block
+                    block = []
+    
+    def _load_state(self) -> dict:
+        """Get the sync token and resources saved by the last sync."""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("url") == self.url and isinstance(state.get("resources"), dict):
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"url": self.url, "sync_token": "", "name": "", "resources": {}}
+    
+    def _save_state(self):
+        """Save the sync token and resources for the next run."""
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            temp_path = f"{self.state_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(temp_path, self.state_path)
+        except OSError as e:
+            print(f"Could not save the state of calendar {self.display_url}: {e}")
+
+class CalendarSubscriptions:
+    """
+    Keeps local copies of remote iCal calendars up to date.
+    
+    Every calendar is checked from a background thread with a conditional
+    request, so an unchanged calendar costs a 304 response and is not written
+    again. The copies are kept in the cache directory with the ETag and
+    Last-Modified headers, and are read by CalendarManager like local files.
+    CalDAV collections are synced by the same thread through CalDAVCalendar.
+    """
+    
+    SCHEMES = ("http", "https", "webcal", "webcals") + CalDAVCalendar.SCHEMES
+    TIMEOUT = 30  # Seconds before a request is given up
+    USER_AGENT = "Newelle-Calendar"
+    
+    def __init__(self, cache_dir: str, refresh_seconds: float, on_updated=None):
+        """
+        Initialize the subscriptions.
+        
+        Args:
+            cache_dir: Directory of the local copies
+            refresh_seconds: Time between two checks of a calendar
+            on_updated: Called from the worker thread with the local path of a changed calendar
+        """
+        self.cache_dir = cache_dir
+        self.refresh_seconds = refresh_seconds
+        self.on_updated = on_updated
+        self.urls = []
+        self.caldav = {}  # Dict[str, CalDAVCalendar] - URL to collection
+        self.worker = None
+        self.stop_event = threading.Event()
+    
+    @classmethod
+    def is_remote(cls, location: str) -> bool:
+        """Check whether a calendar location is a URL rather than a file path."""
+        return urllib.parse.urlsplit(location).scheme.lower() in cls.SCHEMES
+    
+    @staticmethod
+    def fetch_url(url: str) -> str:
+        """Get the URL requested for a calendar location, webcal being served over https."""
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme.lower() in ("webcal", "webcals"):
+            return urllib.parse.urlunsplit(("https",) + tuple(parsed[1:]))
+        return url
+    
+    def cache_path(self, url: str) -> str:
+        """Get the local copy of a remote calendar."""
+        name = hashlib.sha1(url.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}.ics")
+    
+    def get_caldav(self, url: str) -> CalDAVCalendar:
+        """Get the CalDAV collection of a caldav+http(s) URL."""
+        calendar = self.caldav.get(url)
+        if calendar is None:
+            path = self.cache_path(url)
+            calendar = self.caldav[url] = CalDAVCalendar(url, path, os.path.splitext(path)[0] + ".caldav.json")
+        return calendar
+    
+    def start(self, urls: List[str]):
+        """Start checking the calendars in a background thread."""
+        self.stop()
+        self.urls = list(urls)
+        if not self.urls:
+            return
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self._run, args=(self.stop_event,), daemon=True)
+        self.worker.start()
+    
+    def stop(self):
+        """Stop the background thread after its current request."""
+        self.stop_event.set()
+        self.worker = None
+    
+    def _run(self, stop_event: threading.Event):
+        """Check every calendar that is due, then sleep until the next one is."""
+        while not stop_event.is_set():
+            now = datetime.now().timestamp()
+            next_check = now + self.refresh_seconds
+            for url in self.urls:
+                if stop_event.is_set():
+                    return
+                due = self._get_next_check(url)
+                if due <= now:
+                    if self.refresh(url) and self.on_updated is not None and not stop_event.is_set():
+                        self.on_updated(self.cache_path(url))
+                    due = now + self.refresh_seconds
+                next_check = min(next_check, due)
+            stop_event.wait(max(next_check - datetime.now().timestamp(), 1))
+    
+    def refresh(self, url: str) -> bool:
+        """
+        Check a remote calendar and update its local copy.
+        
+        Returns:
+            True if the local copy changed
+        """
+        if CalDAVCalendar.is_caldav(url):
+            return self._sync_caldav(url)
+        import urllib.error
+        import urllib.request
+        path = self.cache_path(url)
+        meta = self._load_meta(url)
+        request = urllib.request.Request(self.fetch_url(url), headers={"User-Agent": self.USER_AGENT})
+        if os.path.exists(path):
+            # Validators of a missing copy would only get us a useless 304
+            if meta.get("etag"):
+                request.add_header("If-None-Match", meta["etag"])
+            if meta.get("last_modified"):
+                request.add_header("If-Modified-Since", meta["last_modified"])
+        
+        meta["checked"] = datetime.now().timestamp()
+        try:
+            with calendar_stats.timer("subscription.fetch"):
+                with urllib.request.urlopen(request, timeout=self.TIMEOUT) as response:
+                    data = response.read()
+                    headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                calendar_stats.count("subscription.not_modified")
+                self._save_meta(url, meta)
+            else:
+                print(f"Could not refresh calendar {url}: HTTP {e.code}")
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Could not refresh calendar {url}: {e}")
+            return False
+        
+        meta["etag"] = headers.get("ETag")
+        meta["last_modified"] = headers.get("Last-Modified")
+        changed = self._read_cache(path) != data
+        if changed:
+            # Servers without validators resend the same calendar, only new content is written
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            calendar_stats.count("subscription.updated")
+        else:
+            calendar_stats.count("subscription.unchanged")
+        self._save_meta(url, meta)
+        return changed
+    
+    def _sync_caldav(self, url: str) -> bool:
+        """Sync a CalDAV collection, returning True if its local copy changed."""
+        calendar = self.get_caldav(url)
+        meta = self._load_meta(url)
+        meta["checked"] = datetime.now().timestamp()
+        try:
+            changed = calendar.sync()
+        except (OSError, ValueError) as e:
+            print(f"Could not sync calendar {calendar.display_url}: {e}")
+            return False
+        self._save_meta(url, meta)
+        return changed
+    
+    def _get_next_check(self, url: str) -> float:
+        """Get when a calendar should be checked, now if it has no local copy yet."""
+        if not os.path.exists(self.cache_path(url)):
+            return 0
+        return self._load_meta(url).get("checked", 0) + self.refresh_seconds
+    
+    @staticmethod
+    def _read_cache(path: str) -> Optional[bytes]:
+        """Get the content of a local copy, or None if there is none."""
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def _meta_path(self, url: str) -> str:
+        """Get the file keeping the validators and check time of a remote calendar."""
+        return os.path.splitext(self.cache_path(url))[0] + ".json"
+    
+    def _load_meta(self, url: str) -> dict:
+        """Get the saved validators of a remote calendar."""
+        try:
+            with open(self._meta_path(url)) as f:
+                meta = json.load(f)
+            return meta if meta.get("url") == url else {"url": url}
+        except (OSError, ValueError):
+            return {"url": url}
+    
+    def _save_meta(self, url: str, meta: dict):
+        """Save the validators of a remote calendar."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._meta_path(url), 'w') as f:
+                json.dump(meta, f)
+        except OSError as e:
+            print(f"Could not save the state of calendar {url}: {e}")
+
+class HashingEmbedder:
+    """
+    Deterministic embedder that needs no model, for offline use and tests.
+    
+    Words and their character trigrams are hashed into a fixed number of
+    dimensions, so texts sharing words or word parts ("dentist", "dental")
+    end up close. It does not know synonyms; a model plugged in as embedder
+    is needed for those.
+    
+    An embedder is any object with a name, identifying its vectors in the
+    cache, and an embed method returning one vector per text.
+    """
+    
+    WORD_PATTERN = re.compile(r"\w+")
+    STOP_WORDS = frozenset(
+        "a an and are at be by do does for from i in is it me my of on or the to what when where which who "
+        "will with".split())
+    TRIGRAM_WEIGHT = 0.35
+    PREFIX_LENGTH = 4
+    PREFIX_WEIGHT = 1.5
+    
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Get the unit length vectors of texts, all zero for texts without words."""
+        return [self._embed_text(text) for text in texts]
+    
+    def _embed_text(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in self.WORD_PATTERN.findall(text.lower()):
+            if word in self.STOP_WORDS:
+                continue
+            self._add_feature(vector, word, 1.0)
+            if len(word) > self.PREFIX_LENGTH:
+                # Words sharing their start often share their meaning: dentist, dental
+                self._add_feature(vector, word[:self.PREFIX_LENGTH] + "~", self.PREFIX_WEIGHT)
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                self._add_feature(vector, padded[i:i + 3], self.TRIGRAM_WEIGHT)
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector] if norm else vector
+    
+    def _add_feature(self, vector: List[float], feature: str, weight: float):
+        # crc32 rather than hash(), which changes between runs
+        digest = zlib.crc32(feature.encode('utf-8'))
+        vector[digest % self.dimensions] += weight if digest & 0x80000000 else -weight
+
+class SentenceTransformerEmbedder:
+    """
+    Embedder running a local sentence-transformers model.
+    
+    The model is loaded on first use, from the local cache of the
+    sentence-transformers package.
+    """
+    
+    def __init__(self, model_name: str):
+        """
+        Initialize the embedder.
+    
+        Raises:
+            ImportError: if sentence-transformers is not installed
+        """
+        import sentence_transformers
+        self.model_name = model_name
+        self.name = f"sentence-transformers-{model_name}"
+        self._module = sentence_transformers
+        self._model = None
+        self._lock = threading.Lock()
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Get the unit length vectors of texts."""
+        with self._lock:
+            if self._model is None:
+                self._model = self._module.SentenceTransformer(self.model_name)
+            return self._model.encode(list(texts), normalize_embeddings=True).tolist()
+
+class EventEmbeddings:
+    """
+    Vectors of the title, description and location of events, for semantic search.
+    
+    The cache is an SQLite database mapping the calendar, UID and recurrence-id
+    of every event to a hash of its embedded text, and each text hash to its
+    vector: an event is embedded again only when its text changed, and
+    occurrences sharing a text share a vector. The cache is emptied when the
+    embedder changes.
+    """
+    
+    BATCH_SIZE = 64  # Texts passed to the embedder at once
+    MIN_SCORE = 0.15  # Cosine similarity below which events are not returned, above hash collision noise
+    
+    def __init__(self, database_path: str = ":memory:", embedder=None):
+        """
+        Initialize the cache.
+    
+        Args:
+            database_path: File of the cache, kept in memory by default
+            embedder: Embedder of the texts, a HashingEmbedder by default
+        """
+        _load_numpy()
+        self.database_path = database_path
+        self.embedder = embedder or HashingEmbedder()
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.hashes = None  # Dict[(calendar, uid, recurrence_id), str] - Event to text hash, loaded on first use
+        self.vectors = None  # Dict[str, vector] - Text hash to vector, loaded on first use
+        self._create_schema()
+    
+    def _create_schema(self):
+        """Create the tables, emptying them if the vectors come from another embedder."""
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS events (
+                    calendar TEXT NOT NULL,
+                    uid TEXT NOT NULL,
+                    recurrence_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (calendar, uid, recurrence_id)
+                );
+                CREATE TABLE IF NOT EXISTS vectors (content_hash TEXT PRIMARY KEY, vector BLOB NOT NULL);
+            """)
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'embedder'").fetchone()
+            if row is None or row[0] != self.embedder.name:
+                self.connection.execute("DELETE FROM events")
+                self.connection.execute("DELETE FROM vectors")
+                self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedder', ?)",
+                                        (self.embedder.name,))
+    
+    @staticmethod
+    def _key(event: Event) -> Tuple[str, str, str]:
+        return event.calendar_name, event.uid, event.recurrence_id
+    
+    @staticmethod
+    def get_text(event: Event) -> str:
+        """Get the text of an event that is embedded."""
+        return "\n".join(part for part in (event.summary, event.location, event.description) if part)
+    
+    @staticmethod
+    def _to_vector(values):
+        """Convert embedder output to the vectors kept in memory."""
+        if numpy is not None:
+            return numpy.asarray(values, dtype=numpy.float32)
+        return array('f', values)
+    
+    @staticmethod
+    def _from_blob(blob: bytes):
+        if numpy is not None:
+            return numpy.frombuffer(blob, dtype=numpy.float32)
+        vector = array('f')
+        vector.frombytes(blob)
+        return vector
+    
+    def _load(self):
+        """Read the cache into memory."""
+        if self.vectors is not None:
+            return
+        with calendar_stats.timer("embeddings.load"):
+            self.hashes = {(calendar, uid, recurrence_id): content_hash for calendar, uid, recurrence_id, content_hash
+                           in self.connection.execute("SELECT calendar, uid, recurrence_id, content_hash FROM events")}
+            self.vectors = {content_hash: self._from_blob(blob) for content_hash, blob
+                            in self.connection.execute("SELECT content_hash, vector FROM vectors")}
+    
+    def get_hashes(self, events: List[Event]) -> List[str]:
+        """
+        Get the text hashes of events, embedding the texts that have no vector yet.
+    
+        Returns:
+            One hash per event, in the order of events, each a key of self.vectors
+        """
+        with self.lock:
+            self._load()
+            hashes = []
+            missing = {}  # Text hash -> text
+            changed = []
+            for event in events:
+                text = self.get_text(event)
+                content_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                hashes.append(content_hash)
+                if content_hash not in self.vectors:
+                    missing[content_hash] = text
+                key = self._key(event)
+                if self.hashes.get(key) != content_hash:
+                    self.hashes[key] = content_hash
+                    changed.append(key + (content_hash,))
+            with self.connection:
+                if missing:
+                    self._embed(missing)
+                self.connection.executemany("INSERT OR REPLACE INTO events (calendar, uid, recurrence_id, content_hash) "
+                                            "VALUES (?, ?, ?, ?)", changed)
+            return hashes
+    
+    def _embed(self, missing: Dict[str, str]):
+        """Embed texts and cache their vectors."""
+        items = list(missing.items())
+        rows = []
+        with calendar_stats.timer("embeddings.embed"):
+            for i in range(0, len(items), self.BATCH_SIZE):
+                batch = items[i:i + self.BATCH_SIZE]
+                for (content_hash, _), values in zip(batch, self.embedder.embed([text for _, text in batch])):
+                    vector = self._to_vector(values)
+                    self.vectors[content_hash] = vector
+                    rows.append((content_hash, vector.tobytes()))
+        calendar_stats.count("embeddings.embedded_texts", len(items))
+        self.connection.executemany("INSERT OR REPLACE INTO vectors (content_hash, vector) VALUES (?, ?)", rows)
+    
+    def discard(self, event: Event):
+        """Forget the text hash of an event that was removed or changed, its vector is dropped by prune."""
+        with self.lock, self.connection:
+            if self.hashes is not None:
+                self.hashes.pop(self._key(event), None)
+            self.connection.execute("DELETE FROM events WHERE calendar = ? AND uid = ? AND recurrence_id = ?",
+                                    self._key(event))
+    
+    def prune(self, events: List[Event]):
+        """Forget all events but the given ones, such as those removed from files outside Newelle, and unused vectors."""
+        keys = {self._key(event) for event in events}
+        with self.lock:
+            self._load()
+            stale = [key for key in self.hashes if key not in keys]
+            for key in stale:
+                del self.hashes[key]
+            used = set(self.hashes.values())
+            unused = [content_hash for content_hash in self.vectors if content_hash not in used]
+            for content_hash in unused:
+                del self.vectors[content_hash]
+            with self.connection:
+                self.connection.executemany(
+                    "DELETE FROM events WHERE calendar = ? AND uid = ? AND recurrence_id = ?", stale)
+                self.connection.executemany("DELETE FROM vectors WHERE content_hash = ?",
+                                            [(content_hash,) for content_hash in unused])
+    
+    def search(self, text: str, events: List[Event], limit: int = 10) -> List[Tuple[float, Event]]:
+        """
+        Get the events most similar to a text by brute force cosine similarity.
+    
+        Args:
+            text: What to look for, in any words
+            events: Events to rank, usually those of a time window
+            limit: Number of events returned at most
+    
+        Returns:
+            (similarity, event) pairs, most similar first, then in start order
+        """
+        if not events or limit <= 0:
+            return []
+        query = self._to_vector(self.embedder.embed([text])[0])
+        hashes = self.get_hashes(events)
+        with calendar_stats.timer("embeddings.rank"):
+            # Events sharing a text are scored once
+            unique_hashes = list(dict.fromkeys(hashes))
+            vectors = [self.vectors[content_hash] for content_hash in unique_hashes]
+            if numpy is not None:
+                scores = (numpy.stack(vectors) @ query).tolist()
+            else:
+                scores = [sum(a * b for a, b in zip(vector, query)) for vector in vectors]
+            text_scores = dict(zip(unique_hashes, scores))
+        # Rounded so float noise does not reorder events with the same text score
+        ranked = [(round(text_scores[content_hash], 4), event) for content_hash, event in zip(hashes, events)
+                  if text_scores[content_hash] >= self.MIN_SCORE]
+        return heapq.nsmallest(limit, ranked, key=lambda item: (-item[0],) + Event.sort_key(item[1]))
+    
+    def close(self):
+        """Release the database."""
+        with self.lock:
+            self.connection.close()
+
+class EventQuery:
+    """
+    A searchevent query, parsed and planned for the event indexes.
+    
+    Syntax, terms are joined with AND unless OR is given:
+        word, "quoted phrase"   text in the title, description or location
+        calendar:NAME           events of a calendar
+        location:TEXT           text in the location
+        after:DATE, before:DATE events starting at or after / before a date or date and time
+        duration>N, duration<N  events longer / shorter than N minutes, or Nh hours, Nd days
+        allday                  all-day events
+        NOT x, -x, x OR y, (x)  negation, alternatives and grouping; NOT binds tightest, then AND, then OR
+    
+    Text matches substrings, ignoring case, like the title search. Values with
+    spaces are quoted: location:"Room 1", after:"2025-01-15 14:00".
+    """
+    
+    TOKEN_PATTERN = re.compile(r'[()]|[^\s()"]*"[^"]*"|[^\s()]+')
+    FILTER_PATTERN = re.compile(r'^(calendar|location|after|before):(.+)$', re.IGNORECASE)
+    DURATION_PATTERN = re.compile(r'^duration(>=|<=|>|<)(\d+(?:\.\d+)?)(m|min|h|d)?$', re.IGNORECASE)
+    DURATION_UNITS = {"m": 60, "min": 60, "h": 3600, "d": 86400}
+    
+    class Invalid(ValueError):
+        """Raised for a query that cannot be parsed."""
+    
+    def __init__(self, text: str):
+        """
+        Parse a query.
+        
+        Raises:
+            EventQuery.Invalid: if the query is empty or malformed
+        """
+        self.text = text
+        self._tokens = self.TOKEN_PATTERN.findall(text)
+        self._position = 0
+        if not self._tokens:
+            raise self.Invalid("Empty query")
+        self.tree = self._parse_or()
+        if self._position < len(self._tokens):
+            raise self.Invalid(f"Unexpected '{self._tokens[self._position]}'")
+    
+    def _peek(self) -> Optional[str]:
+        """Get the next token without consuming it."""
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+    
+    def _parse_or(self) -> tuple:
+        """Parse alternatives: and ("OR" and)*."""
+        children = [self._parse_and()]
+        while self._peek() == "OR":
+            self._position += 1
+            children.append(self._parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+    
+    def _parse_and(self) -> tuple:
+        """Parse a conjunction: not (["AND"] not)*."""
+        children = [self._parse_not()]
+        while self._peek() not in (None, ")", "OR"):
+            if self._peek() == "AND":
+                self._position += 1
+            children.append(self._parse_not())
+        return children[0] if len(children) == 1 else ("and", children)
+    
+    def _parse_not(self) -> tuple:
+        """Parse a negation: "NOT" not | "-" not | atom."""
+        token = self._peek()
+        if token == "NOT":
+            self._position += 1
+            return ("not", self._parse_not())
+        if token is not None and token.startswith("-") and len(token) > 1:
+            self._tokens[self._position] = token[1:]
+            return ("not", self._parse_not())
+        return self._parse_atom()
+    
+    def _parse_atom(self) -> tuple:
+        """Parse a group, a filter or a text term."""
+        token = self._peek()
+        if token is None or token in (")", "AND", "OR"):
+            raise self.Invalid(f"Expected a term {'at the end' if token is None else f'before {token}'}")
+        self._position += 1
+        if token == "(":
+            node = self._parse_or()
+            if self._peek() != ")":
+                raise self.Invalid("Missing )")
+            self._position += 1
+            return node
+        if token.lower() == "allday":
+            return ("allday",)
+        
+        duration = self.DURATION_PATTERN.match(token)
+        if duration:
+            seconds = float(duration.group(2)) * self.DURATION_UNITS[(duration.group(3) or "m").lower()]
+            return ("duration", duration.group(1), seconds)
+        match = self.FILTER_PATTERN.match(token)
+        if match:
+            field, value = match.group(1).lower(), self._unquote(match.group(2))
+            if field in ("after", "before"):
+                return (field, self._parse_time(value))
+            if field == "calendar":
+                return ("calendar", value.lower())
+            return ("location", value.lower())
+        return ("text", self._unquote(token).lower())
+    
+    def _unquote(self, value: str) -> str:
+        """Remove the quotes around a value."""
+        if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+        if not value:
+            raise self.Invalid("Empty value")
+        return value
+    
+    def _parse_time(self, value: str) -> float:
+        """Parse the date or date and time of after: and before: as a timestamp, dates at midnight."""
+        try:
+            if len(value) == 10:
+                return CalendarManager._to_timestamp(datetime.combine(date.fromisoformat(value), time.min))
+            return CalendarManager._to_timestamp(datetime.fromisoformat(value))
+        except ValueError:
+            raise self.Invalid(f"Invalid date '{value}', use YYYY-MM-DD or YYYY-MM-DD HH:MM")
+    
+    def plan(self) -> dict:
+        """
+        Get the filters that can be pushed into the indexes, from the terms every result must match.
+        
+        Returns:
+            Dict of start_ts and end_ts (start time range, None when open),
+            calendars (lowercase names, None for any) and terms ((field, text)
+            pairs the text or location of every result contains)
+        """
+        plan = {"start_ts": None, "end_ts": None, "calendars": None, "terms": []}
+        conjuncts = self.tree[1] if self.tree[0] == "and" else [self.tree]
+        for node in conjuncts:
+            kind = node[0]
+            if kind == "after":
+                plan["start_ts"] = node[1] if plan["start_ts"] is None else max(plan["start_ts"], node[1])
+            elif kind == "before":
+                plan["end_ts"] = node[1] if plan["end_ts"] is None else min(plan["end_ts"], node[1])
+            elif kind in ("text", "location"):
+                plan["terms"].append(node)
+            elif kind == "calendar" or (kind == "or" and all(child[0] == "calendar" for child in node[1])):
+                names = {node[1]} if kind == "calendar" else {child[1] for child in node[1]}
+                plan["calendars"] = names if plan["calendars"] is None else plan["calendars"] & names
+        return plan
+    
+    def matches(self, event: Event) -> bool:
+        """Check whether an event matches the query."""
+        return self._evaluate(self.tree, event)
+    
+    def _evaluate(self, node: tuple, event: Event) -> bool:
+        """Evaluate a node of the query tree for an event."""
+        kind = node[0]
+        if kind == "and":
+            return all(self._evaluate(child, event) for child in node[1])
+        if kind == "or":
+            return any(self._evaluate(child, event) for child in node[1])
+        if kind == "not":
+            return not self._evaluate(node[1], event)
+        if kind == "text":
+            return (node[1] in event.summary.lower() or node[1] in event.description.lower() or
+                    node[1] in event.location.lower())
+        if kind == "location":
+            return node[1] in event.location.lower()
+        if kind == "calendar":
+            return event.calendar_name.lower() == node[1]
+        if kind == "allday":
+            return event.all_day
+        start_ts = CalendarManager._to_timestamp(event.start_time)
+        if kind == "after":
+            return start_ts >= node[1]
+        if kind == "before":
+            return start_ts < node[1]
+        duration = CalendarManager._to_timestamp(event.end_time) - start_ts
+        return {">": duration > node[2], "<": duration < node[2],
+                ">=": duration >= node[2], "<=": duration <= node[2]}[node[1]]
+
+class SearchResult:
+    """A sorted search result that can be sliced into pages."""
+    
+    def __init__(self, result_id: str, plan: dict, events: List[Event], generation: int):
+        self.result_id = result_id
+        self.plan = plan  # The search criteria, used to recompute the result
+        self.events = tuple(events)
+        self.generation = generation  # Calendar generation the result was computed at
+    
+    def __len__(self):
+        return len(self.events)
+    
+    def page(self, offset: int, limit: int) -> List[Event]:
+        """Get a slice of the result."""
+        return list(self.events[offset:offset + limit])
+
+class SearchResultCache:
+    """Bounded LRU cache of search results, addressed by a short ID."""
+    
+    MAX_ENTRIES = 16
+    
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # Dict[str, SearchResult]
+    
+    def put(self, plan: dict, events: List[Event], generation: int, result_id: str = None) -> SearchResult:
+        """Store a result, evicting the least recently used one if full."""
+        result_id = result_id or uuid.uuid4().hex[:8]
+        result = SearchResult(result_id, plan, events, generation)
+        self.entries[result_id] = result
+        self.entries.move_to_end(result_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return result
+    
+    def get(self, result_id: str) -> Optional[SearchResult]:
+        """Get a result by ID, marking it as recently used."""
+        result = self.entries.get(result_id)
+        if result is not None:
+            self.entries.move_to_end(result_id)
+        return result
+
+class EventFormatter:
+    """
+    Formats event lists for the AI within a character budget.
+    
+    Densities:
+        verbose: day headers with full dates, location and calendar on their own lines
+        compact: one line per event under short day headers, calendars only when mixed
+        columnar: one row per event under a single column header, calendars abbreviated
+    
+    Events that do not fit the budget are summarized per day, e.g. "+7 more on Friday".
+    """
+    
+    DENSITIES = ("verbose", "compact", "columnar")
+    OVERFLOW_DAYS = 3  # Days named in the overflow summary before "later"
+    
+    def __init__(self, density: str = "compact", budget: int = 0, today: date = None):
+        self.density = density if density in self.DENSITIES else "compact"
+        self.budget = max(budget, 0)  # Characters, 0 for no limit
+        self.today = today or date.today()
+    
+    def format(self, events: List[Event], header: str, footer=None) -> Tuple[str, int]:
+        """
+        Format events under a header, keeping within the budget.
+        
+        Args:
+            events: Events in display order
+            header: First line of the text
+            footer: Optional callable getting the number of shown events and returning extra lines
+            
+        Returns:
+            Tuple of (text, number of events shown); at least one event is always shown
+        """
+        blocks = self._event_blocks(events)
+        shown = len(blocks)
+        if self.budget:
+            # Start from the most events whose lines fit, then drop events until the summaries fit too
+            used = len(header)
+            shown = 0
+            for block in blocks:
+                used += len(block) + 1
+                if used > self.budget:
+                    break
+                shown += 1
+            shown = max(shown, 1)
+        while True:
+            text = self._compose(events, blocks, shown, header, footer)
+            if not self.budget or len(text) <= self.budget or shown <= 1:
+                return text, min(shown, len(events))
+            shown -= 1
+    
+    def _compose(self, events: List[Event], blocks: List[str], shown: int, header: str, footer) -> str:
+        """Join the header, the first shown event blocks, the overflow summary and the footer."""
+        lines = [header]
+        if self.density == "verbose":
+            lines.append("")
+        elif self.density == "columnar" and events:
+            lines.append("date|time|title|location|cal")
+            if self._calendar_codes(events):
+                lines.append("cal: " + " ".join(f"{code}={name}" for name, code in self._calendar_codes(events).items()))
+        lines += blocks[:shown]
+        overflow = self._format_overflow(events[shown:])
+        if overflow:
+            lines.append(overflow)
+        if footer:
+            lines += footer(min(shown, len(events)))
+        return "\n".join(lines)
+    
+    def _event_blocks(self, events: List[Event]) -> List[str]:
+        """Get the text of every event, starting with its day header when the day changes."""
+        multiple_calendars = len({event.calendar_name for event in events}) > 1
+        codes = self._calendar_codes(events)
+        same_year = all(event.start_time.year == self.today.year for event in events)
+        blocks = []
+        current_date = None
+        for event in events:
+            event_date = event.start_time.date()
+            summary, location = self._flatten(event.summary), self._flatten(event.location)
+            lines = []
+            if self.density == "columnar":
+                day = event_date.strftime("%m-%d" if same_year else "%Y-%m-%d")
+                lines.append("|".join([day, self._format_time(event, "-"), self._escape_column(summary),
+                                       self._escape_column(location), codes.get(event.calendar_name, "")]))
+            else:
+                calendar_name = self._flatten(event.calendar_name)
+                if event_date != current_date:
+                    lines.append(self._format_day(event_date, same_year))
+                    current_date = event_date
+                if self.density == "verbose":
+                    lines.append(f"  • {summary} ({self._format_time(event, ' - ')})")
+                    if location:
+                        lines.append(f"    📍 {location}")
+                    if calendar_name:
+                        lines.append(f"    📅 {calendar_name}")
+                else:
+                    line = f" {self._format_time(event, '-')} {summary}"
+                    if location:
+                        line += f" @{location}"
+                    if multiple_calendars and calendar_name:
+                        line += f" [{calendar_name}]"
+                    lines.append(line)
+            blocks.append("\n".join(lines))
+        return blocks
+    
+    @staticmethod
+    def _flatten(text: str) -> str:
+        """Put a text on a single line, an event taking more lines would look like several."""
+        if "\n" not in text and "\r" not in text:
+            return text
+        return " ".join(text.split())
+    
+    @staticmethod
+    def _escape_column(text: str) -> str:
+        """Escape the column separator of the columnar density."""
+        return text.replace("|", "\\|")
+    
+    def _format_day(self, event_date: date, same_year: bool) -> str:
+        """Format a day header."""
+        relative = {self.today: "Today", self.today + timedelta(days=1): "Tomorrow",
+                    self.today - timedelta(days=1): "Yesterday"}.get(event_date)
+        if self.density == "verbose":
+            return f"📅 {relative or event_date.strftime('%A, %B %d, %Y')}"
+        day = event_date.strftime("%a %m-%d" if same_year else "%a %Y-%m-%d")
+        return f"{relative} {day}:" if relative else f"{day}:"
+    
+    @staticmethod
+    def _format_time(event: Event, separator: str) -> str:
+        """Format the time range of an event."""
+        if event.all_day:
+            return "All day"
+        return f"{event.start_time.strftime('%H:%M')}{separator}{event.end_time.strftime('%H:%M')}"
+    
+    @staticmethod
+    def _calendar_codes(events: List[Event]) -> Dict[str, str]:
+        """Get short codes for the calendars of the events, empty when there is only one."""
+        names = list(dict.fromkeys(event.calendar_name for event in events if event.calendar_name))
+        if len(names) < 2:
+            return {}
+        return {name: str(index + 1) for index, name in enumerate(names)}
+    
+    def _format_overflow(self, hidden: List[Event]) -> str:
+        """Summarize the events left out, e.g. "+3 more today, +7 more on Friday"."""
+        if not hidden:
+            return ""
+        by_day = OrderedDict()
+        for event in hidden:
+            event_date = event.start_time.date()
+            by_day[event_date] = by_day.get(event_date, 0) + 1
+        parts = []
+        for event_date, count in list(by_day.items())[:self.OVERFLOW_DAYS]:
+            if event_date == self.today:
+                parts.append(f"+{count} more today")
+            elif event_date == self.today + timedelta(days=1):
+                parts.append(f"+{count} more tomorrow")
+            elif self.today < event_date < self.today + timedelta(days=7):
+                parts.append(f"+{count} more on {event_date.strftime('%A')}")
+            else:
+                parts.append(f"+{count} more on {event_date.isoformat()}")
+        later = sum(list(by_day.values())[self.OVERFLOW_DAYS:])
+        if later:
+            parts.append(f"+{later} more later")
+        return ", ".join(parts)
+
+class CalendarQueries:
+    """
+    Text answers of the read-only code blocks: searchevent, events, freebusy and eventstats.
+    
+    The extension and the command line both answer through this class, so
+    they search and format the same way.
+    """
+    
+    SEARCH_PAGE_SIZE = 10
+    UPCOMING_LIMIT = 20
+    QUERY_PREFIX = "query "  # First line of a searchevent block holding an EventQuery
+    SIMILAR_PREFIX = "similar "  # First line of a searchevent block holding a semantic search
+    SIMILAR_LIMIT = 10  # Most similar events returned by a semantic search
+    SIMILAR_WINDOW_DAYS = 365  # Days before and after today searched when no dates are given
+    
+    def __init__(self, calendar_manager: CalendarManager = None, formatter: EventFormatter = None,
+                 working_hours: Tuple[time, time] = (time(9, 0), time(18, 0))):
+        """
+        Initialize the queries.
+        
+        Args:
+            calendar_manager: Calendars to query, only needed for searches
+            formatter: Formatter of event lists, compact without budget by default
+            working_hours: (start, end) of the working day, for free time and time usage
+        """
+        self.calendar_manager = calendar_manager
+        self.formatter = formatter or EventFormatter()
+        self.working_hours = working_hours
+    
+    @classmethod
+    def build_search_plan(cls, lines: List[str]) -> dict:
+        """
+        Get the search plan of the lines of a searchevent block.
+        
+        The first line is a title, a query after QUERY_PREFIX or a description
+        after SIMILAR_PREFIX; the next two are a date or a date range.
+        """
+        lines = [line.strip() for line in lines] + ["", "", ""]
+        plan = {"event_name": lines[0], "start_date_str": lines[1], "end_date_str": lines[2], "query": "",
+                "similar": ""}
+        if lines[0].lower().startswith(cls.QUERY_PREFIX):
+            plan["event_name"], plan["query"] = "", lines[0][len(cls.QUERY_PREFIX):].strip()
+        elif lines[0].lower().startswith(cls.SIMILAR_PREFIX):
+            plan["event_name"], plan["similar"] = "", lines[0][len(cls.SIMILAR_PREFIX):].strip()
+        return plan
+    
+    def execute_search_plan(self, plan: dict) -> List[Event]:
+        """
+        Run a search plan and return the matching events in a stable order.
+        
+        Args:
+            plan: Dict of event_name, start_date_str, end_date_str, query and similar, see build_search_plan
+            
+        Raises:
+            EventQuery.Invalid: if the query cannot be parsed
+            ValueError: if a date is not in YYYY-MM-DD format
+        """
+        if plan.get("query"):
+            return self.calendar_manager.query_events(self._build_query(plan))
+        if plan.get("similar"):
+            return self._search_similar_events(plan)
+        event_name = plan["event_name"]
+        start_date_str = plan["start_date_str"]
+        end_date_str = plan["end_date_str"]
+        found_events = []
+        
+        if event_name and not start_date_str:
+            found_events = self._search_events_by_name(event_name)
+        
+        # A range is checked before a single date, with or without a name
+        elif start_date_str and end_date_str:
+            start_date = date.fromisoformat(start_date_str)
+            end_date = date.fromisoformat(end_date_str)
+            found_events = self._search_events_in_range(start_date, end_date, event_name)
+        
+        elif not event_name and start_date_str:
+            search_date = date.fromisoformat(start_date_str)
+            found_events = self.calendar_manager.get_events_for_date(search_date)
+        
+        elif event_name and start_date_str:
+            search_date = date.fromisoformat(start_date_str)
+            events_on_date = self.calendar_manager.get_events_for_date(search_date)
+            found_events = [e for e in events_on_date if event_name.lower() in e.summary.lower()]
+        
+        return sorted(found_events, key=Event.sort_key)
+    
+    @staticmethod
+    def _build_query(plan: dict) -> EventQuery:
+        """Parse the query of a plan, restricted to its dates when it has some."""
+        text = plan["query"]
+        if plan["start_date_str"]:
+            start_date = date.fromisoformat(plan["start_date_str"])
+            end_date = date.fromisoformat(plan["end_date_str"]) if plan["end_date_str"] else start_date
+            text = f"({text}) after:{start_date.isoformat()} before:{(end_date + timedelta(days=1)).isoformat()}"
+        return EventQuery(text)
+    
+    def _search_similar_events(self, plan: dict) -> List[Event]:
+        """Get the events closest in meaning to the text of a plan, in start order."""
+        if plan["start_date_str"]:
+            start_date = date.fromisoformat(plan["start_date_str"])
+            end_date = date.fromisoformat(plan["end_date_str"]) if plan["end_date_str"] else start_date
+        else:
+            start_date = date.today() - timedelta(days=self.SIMILAR_WINDOW_DAYS)
+            end_date = date.today() + timedelta(days=self.SIMILAR_WINDOW_DAYS)
+        ranked = self.calendar_manager.semantic_search(plan["similar"], start_date, end_date, self.SIMILAR_LIMIT)
+        return sorted((event for _, event in ranked), key=Event.sort_key)
+    
+    def _search_events_by_name(self, event_name: str) -> List[Event]:
+        """Search for events by name across all dates."""
+        # Look through recent and upcoming events (30 days back and forward)
+        start_date = date.today() - timedelta(days=30)
+        end_date = date.today() + timedelta(days=30)
+        return self.calendar_manager.search_events(event_name, start_date, end_date)
+    
+    def _search_events_in_range(self, start_date: date, end_date: date, event_name: str = "") -> List[Event]:
+        """Search for events in a date range, optionally filtered by name."""
+        return self.calendar_manager.search_events(event_name or "", start_date, end_date)
+    
+    def get_upcoming_events(self) -> List[Event]:
+        """Get the events listed by the events block."""
+        return self.calendar_manager.get_upcoming_events(date.today(), limit=self.UPCOMING_LIMIT)
+    
+    def format_search_results(self, events: List[Event], result: SearchResult = None, offset: int = 0) -> str:
+        """
+        Format a page of search results.
+        
+        Args:
+            events: The events of the page
+            result: The whole result, for the total and the hint to the next page
+            offset: Position of the page in the result
+        """
+        total = len(result) if result is not None else len(events)
+        if not total:
+            return "No events found matching your search criteria."
+        if not events:
+            return f"No more results: the search found {total} event{'s' if total != 1 else ''}."
+        
+        if not self.formatter.budget:
+            events = events[:self.SEARCH_PAGE_SIZE]  # Limit to one page without a budget
+        
+        def footer(shown):
+            lines = []
+            if shown < total:
+                lines.append(f"Shown {offset + 1}-{offset + shown} of {total}.")
+            remaining = total - offset - shown
+            if remaining > 0:
+                if len(events) == shown:
+                    lines.append(f"... and {remaining} more event{'s' if remaining != 1 else ''}")
+                if result is not None and result.result_id:
+                    lines.append(f"Use ```searchevent\npage {result.result_id} {offset + shown}\n``` to see the next results.")
+            return lines
+        
+        header = f"Found {total} event{'s' if total != 1 else ''}:"
+        return self.formatter.format(events, header, footer)[0]
+    
+    def format_upcoming_events(self, events: List[Event]) -> str:
+        """Format upcoming events."""
+        if not events:
+            return "No upcoming events found."
+        
+        header = f"Next {len(events)} upcoming event{'s' if len(events) != 1 else ''}:"
+        return self.formatter.format(events, header)[0]
+    
+    def get_free_busy(self, start_str: str, end_str: str = "", calendars: List[str] = None) -> str:
+        """
+        Describe when a range is busy, or the free time of each day within working hours.
+        
+        Args:
+            start_str: Start of the range, YYYY-MM-DD HH:MM, or YYYY-MM-DD for whole days
+            end_str: End of the range in the same format, the start by default
+            calendars: Calendar names to consider, all calendars if empty
+            
+        Raises:
+            ValueError: if a date is not in one of the formats
+        """
+        end_str = end_str or start_str
+        if len(start_str) == 10 and len(end_str) == 10:
+            start_date = date.fromisoformat(start_str)
+            end_date = date.fromisoformat(end_str)
+            work_start, work_end = self.working_hours
+            slots = self.calendar_manager.get_free_slots(start_date, end_date, work_start, work_end, calendars)
+            return self._format_free_slots(slots, start_date, end_date)
+        start_time = datetime.fromisoformat(start_str)
+        end_time = datetime.fromisoformat(end_str)
+        busy = self.calendar_manager.get_busy_intervals(start_time, end_time, calendars)
+        busy_events = [e for e in self.calendar_manager.get_events_in_range(start_time, end_time, calendars)
+                       if not e.all_day]
+        return self._format_busy_intervals(busy, busy_events, start_time, end_time)
+    
+    def get_time_usage(self, start_date: date, end_date: date, group: str = None, calendars: List[str] = None) -> str:
+        """
+        Summarize the time taken by events during [start_date, end_date].
+        
+        Args:
+            group: day or week, by default days for ranges shorter than a month
+            calendars: Calendar names to consider, all calendars if empty
+        """
+        group = group or ("day" if (end_date - start_date).days < 31 else "week")
+        work_start, work_end = self.working_hours
+        usage = self.calendar_manager.get_time_usage(start_date, end_date, work_start, work_end, group, calendars)
+        return self._format_time_usage(usage, start_date, end_date, group)
+    
+    def _format_busy_intervals(self, busy, events, start_time, end_time):
+        """Format the busy intervals of a time range as a compact summary."""
+        range_str = f"{start_time.strftime('%Y-%m-%d %H:%M')}-{end_time.strftime('%H:%M')}"
+        if not busy:
+            return f"Free {range_str}"
+        intervals = ", ".join(f"{s.strftime('%H:%M')}-{e.strftime('%H:%M')}" for s, e in busy)
+        titles = ", ".join(e.summary for e in events[:5])
+        if len(events) > 5:
+            titles += f", +{len(events) - 5} more"
+        return f"Busy during {range_str}: {intervals} ({titles})"
+    
+    def _format_free_slots(self, slots, start_date, end_date):
+        """Format free slots grouped by day as a compact summary."""
+        by_day = {}
+        for slot_start, slot_end in slots:
+            by_day.setdefault(slot_start.date(), []).append(f"{slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}")
+        lines = ["Free time within working hours:"]
+        current_date = start_date
+        while current_date <= end_date:
+            free = by_day.get(current_date)
+            lines.append(f"{current_date.strftime('%a %Y-%m-%d')}: {', '.join(free) if free else 'no free time'}")
+            current_date += timedelta(days=1)
+        return "\n".join(lines)
+    
+    def _format_time_usage(self, usage, start_date, end_date, group):
+        """Format the time usage summary as compact tables."""
+        periods = usage["periods"]
+        total_events = sum(period[1] for period in periods)
+        total_busy = sum(period[2] for period in periods)
+        total_work_busy = sum(period[3] for period in periods)
+        total_work = sum(period[4] for period in periods)
+        lines = [f"Time usage from {start_date} to {end_date}: {total_events} events, {total_busy / 3600:.1f}h busy "
+                 "(all-day events not counted, overlaps counted once)",
+                 f"{'Week of' if group == 'week' else 'Day':<14} {'Events':>6} {'Busy':>7} {'Work hours busy':>15}"]
+        for period_start, events, busy, work_busy, work in periods:
+            label = period_start.strftime('%Y-%m-%d') if group == "week" else period_start.strftime('%a %Y-%m-%d')
+            share = f"{work_busy / work:.0%}" if work else "-"
+            lines.append(f"{label:<14} {events:>6} {busy / 3600:>6.1f}h {share:>15}")
+        total_share = f"{total_work_busy / total_work:.0%}" if total_work else "-"
+        lines.append(f"{'Total':<14} {total_events:>6} {total_busy / 3600:>6.1f}h {total_share:>15}")
+        
+        if usage["calendars"]:
+            lines += ["", f"{'Calendar':<20} {'Events':>6} {'In events':>10}"]
+            for name, count, seconds in usage["calendars"]:
+                lines.append(f"{name[:20]:<20} {count:>6} {seconds / 3600:>9.1f}h")
+        if usage["free_blocks"]:
+            blocks = [f"{s.strftime('%a %Y-%m-%d %H:%M')}-{e.strftime('%H:%M')} ({(e - s).total_seconds() / 3600:.1f}h)"
+                      for s, e in usage["free_blocks"]]
+            lines += ["", "Longest free blocks within working hours: " + ", ".join(blocks)]
+        if usage["titles"]:
+            titles = [f"{title} x{count} ({seconds / 3600:.1f}h)" for title, count, seconds in usage["titles"]]
+            lines += ["", "Most repeated events: " + ", ".join(titles)]
+        return "\n".join(lines)
+
+def _parse_working_hours(value: str) -> Tuple[time, time]:
+    """Parse working hours given as HH:MM-HH:MM."""
+    start_str, end_str = value.split("-")
+    return time.fromisoformat(start_str.strip()), time.fromisoformat(end_str.strip())
+
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser."""
+    parser = argparse.ArgumentParser(
+        description="Load, query and search iCal calendars like the Newelle calendar extension, without a display.")
+    parser.add_argument("-f", "--file", dest="files", metavar="FILE", action="append", required=True,
+                        help="iCal file to load, can be given several times")
+    parser.add_argument("--sqlite", metavar="PATH", help="keep the events in this SQLite database instead of in memory")
+    parser.add_argument("--density", choices=EventFormatter.DENSITIES, default="compact",
+                        help="layout of event lists (default: compact)")
+    parser.add_argument("--budget", type=int, default=0, help="character budget of event lists, 0 for none")
+    parser.add_argument("--embeddings", metavar="PATH",
+                        help="enable 'similar ...' searches, caching the event vectors in this SQLite database "
+                             "(':memory:' for none)")
+    parser.add_argument("--model", metavar="NAME",
+                        help="sentence-transformers model embedding the events, a hashing embedder by default")
+    parser.add_argument("--working-hours", type=_parse_working_hours, default="09:00-18:00",
+                        help="working hours as HH:MM-HH:MM (default: 09:00-18:00)")
+    parser.add_argument("--repeat", type=int, default=1, help="run the command this many times, timing each run")
+    parser.add_argument("--stats", action="store_true", help="print performance statistics at the end")
+    parser.add_argument("--profile", metavar="DIR", help="write cProfile profiles of the command to DIR")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    commands.add_parser("load", help="load the calendars and report their size")
+    query = commands.add_parser("query", help="list the upcoming events like the events block, "
+                                              "or the events of a date range")
+    query.add_argument("start_date", nargs="?", default="", help="YYYY-MM-DD")
+    query.add_argument("end_date", nargs="?", default="", help="YYYY-MM-DD")
+    search = commands.add_parser("search", help="search events like the searchevent block")
+    search.add_argument("event_name", help="text in the title, empty for any, 'query ...' for a query "
+                                           "or 'similar ...' for a semantic search")
+    search.add_argument("start_date", nargs="?", default="", help="YYYY-MM-DD")
+    search.add_argument("end_date", nargs="?", default="", help="YYYY-MM-DD")
+    search.add_argument("--offset", type=int, default=0, help="first result shown")
+    search.add_argument("--limit", type=int, help="number of results shown")
+    freebusy = commands.add_parser("freebusy", help="busy intervals or free time like the freebusy block")
+    freebusy.add_argument("start", help="YYYY-MM-DD HH:MM, or YYYY-MM-DD for the free time of whole days")
+    freebusy.add_argument("end", nargs="?", default="", help="same format as start")
+    freebusy.add_argument("--calendars", default="", help="comma separated calendar names")
+    stats = commands.add_parser("stats", help="time usage like the eventstats block")
+    stats.add_argument("start_date", type=date.fromisoformat, help="YYYY-MM-DD")
+    stats.add_argument("end_date", type=date.fromisoformat, help="YYYY-MM-DD")
+    stats.add_argument("--group", choices=("day", "week"), help="period of the rows")
+    stats.add_argument("--calendars", default="", help="comma separated calendar names")
+    return parser
+
+def _run_command(args, calendar_manager: CalendarManager, queries: CalendarQueries) -> str:
+    """Run a command line command and return its answer."""
+    if args.command == "load":
+        names = calendar_manager.get_calendar_names()
+        return f"Loaded {calendar_manager.store.count()} events from {len(names)} calendars: {', '.join(names)}"
+    if args.command == "query" and not args.start_date:
+        return queries.format_upcoming_events(queries.get_upcoming_events())
+    if args.command in ("query", "search"):
+        event_name = args.event_name if args.command == "search" else ""
+        plan = CalendarQueries.build_search_plan([event_name, args.start_date, args.end_date])
+        if not plan["event_name"] and not plan["start_date_str"] and not plan["query"] and not plan["similar"]:
+            raise ValueError("Please provide search criteria")
+        if plan["similar"] and calendar_manager.embeddings is None:
+            raise ValueError("Semantic search is disabled, enable it with --embeddings")
+        result = SearchResult("", plan, queries.execute_search_plan(plan), calendar_manager.generation)
+        offset = getattr(args, "offset", 0)
+        limit = getattr(args, "limit", None)
+        return queries.format_search_results(result.page(offset, limit or queries.SEARCH_PAGE_SIZE), result, offset)
+    calendars = [name.strip() for name in args.calendars.split(",") if name.strip()]
+    if args.command == "freebusy":
+        return queries.get_free_busy(args.start, args.end, calendars)
+    return queries.get_time_usage(args.start_date, args.end_date, args.group, calendars)
+
+def main(argv: List[str] = None) -> int:
+    """Run the command line tool, returning its exit status."""
+    args = _build_parser().parse_args(argv)
+    calendar_stats.configure(args.stats)
+    calendar_profiler.configure(bool(args.profile), args.profile)
+    store = SQLiteEventStore(args.sqlite) if args.sqlite else MemoryEventStore()
+    embeddings = None
+    if args.embeddings:
+        try:
+            embedder = SentenceTransformerEmbedder(args.model) if args.model else HashingEmbedder()
+        except ImportError:
+            print("Error: sentence-transformers is not installed", file=sys.stderr)
+            return 1
+        embeddings = EventEmbeddings(args.embeddings, embedder)
+    
+    started = perf_counter()
+    with calendar_profiler.profile("cli-load"), calendar_stats.timer("cli.load"):
+        calendar_manager = CalendarManager([os.path.expanduser(path) for path in args.files], store,
+                                           embeddings=embeddings)
+    print(f"Loaded in {(perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    queries = CalendarQueries(calendar_manager, EventFormatter(args.density, args.budget), args.working_hours)
+    
+    try:
+        for run in range(max(args.repeat, 1)):
+            started = perf_counter()
+            with calendar_profiler.profile(f"cli-{args.command}"), calendar_stats.timer(f"cli.{args.command}"):
+                answer = _run_command(args, calendar_manager, queries)
+            print(f"{args.command} run {run + 1} took {(perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        calendar_manager.store.close()
+        if embeddings is not None:
+            embeddings.close()
+    
+    print(answer)
+    if args.stats:
+        print(calendar_stats.summary(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# Appended, not prepended: the folder also holds calendar.py, which must not
+# shadow the standard library calendar module. Run the tests with
+# python -P -m pytest tests so the working directory is not on the path either.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from calendar_core import CalendarFileLock
+
+@pytest.fixture(autouse=True)
+def lock_directory(tmp_path, monkeypatch):
+    """Keep the lock files of the tests out of the user's cache folder."""
+    directory = tmp_path / "locks"
+    monkeypatch.setattr(CalendarFileLock, "directory", str(directory))
+    return directory
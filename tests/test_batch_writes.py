@@ -0,0 +1,119 @@
+import os
+from datetime import datetime, timedelta
+
+from calendar_core import CalendarManager, Event
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Newelle Calendar//Tests//EN\r
+X-WR-CALNAME:{name}\r
+BEGIN:VEVENT\r
+UID:{name}-standup\r
+SUMMARY:Standup\r
+DTSTART:20250303T090000\r
+DTEND:20250303T091500\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+def load(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / f"{name.lower()}.ics"
+        path.write_bytes(CALENDAR.format(name=name).encode())
+        paths.append(str(path))
+    return paths, CalendarManager(paths)
+
+def state(calendar_manager):
+    day = datetime(2025, 3, 3).date()
+    return sorted((e.calendar_name, e.uid, e.summary, e.start_time) for e in calendar_manager.get_events_for_date(day))
+
+def test_lock_files_are_kept_out_of_the_calendar_folder(tmp_path, lock_directory):
+    (path,), calendar_manager = load(tmp_path, "Work")
+    start = datetime(2025, 3, 3, 12)
+    assert calendar_manager.add_event(Event("Lunch", start, start + timedelta(hours=1), calendar_name="Work"))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".lock")]
+    assert [name for name in os.listdir(lock_directory) if name.endswith(".lock")]
+
+def test_failed_batch_leaves_the_events_as_in_the_file(tmp_path, monkeypatch):
+    (work, home), calendar_manager = load(tmp_path, "Work", "Home")
+    before = state(calendar_manager)
+    standup = calendar_manager.find_event(Event("", None, None, calendar_name="Work", uid="Work-standup"))
+    start = datetime(2025, 3, 3, 12)
+
+    def fail(file_path, chunks, expected_stamp=None):
+        raise OSError("disk full")
+    monkeypatch.setattr(calendar_manager, "_replace_file", fail)
+    moved = Event("Standup moved", start, start + timedelta(minutes=15), calendar_name="Work", uid="Work-standup")
+    assert not calendar_manager.apply_batch(added=[Event("Lunch", start, start + timedelta(hours=1),
+                                                         calendar_name="Home")],
+                                            edited=[(standup, moved)])
+    assert state(calendar_manager) == before
+    assert calendar_manager.store.count() == 2
+    assert state(CalendarManager([work, home])) == before
+
+def test_batch_is_written_to_every_calendar_or_none(tmp_path, monkeypatch):
+    (work, home), calendar_manager = load(tmp_path, "Work", "Home")
+    before = state(calendar_manager)
+    with open(work, 'rb') as f:
+        original = f.read()
+    replace_file = calendar_manager._replace_file
+
+    def fail_for_home(file_path, chunks, expected_stamp=None):
+        if file_path == home:
+            raise OSError("disk full")
+        return replace_file(file_path, chunks, expected_stamp)
+    monkeypatch.setattr(calendar_manager, "_replace_file", fail_for_home)
+    start = datetime(2025, 3, 3, 12)
+    standup = calendar_manager.find_event(Event("", None, None, calendar_name="Work", uid="Work-standup"))
+    moved = Event("Standup moved", start, start + timedelta(minutes=15), calendar_name="Work", uid="Work-standup")
+    assert not calendar_manager.apply_batch(added=[
+        Event("Lunch", start, start + timedelta(hours=1), calendar_name="Work", uid="work-lunch"),
+        Event("Dinner", start + timedelta(hours=7), start + timedelta(hours=8), calendar_name="Home", uid="home-dinner"),
+    ], edited=[(standup, moved)])
+    # The Work calendar was written first, then changed back when Home failed
+    assert state(calendar_manager) == before
+    assert state(CalendarManager([work, home])) == before
+    with open(work, 'rb') as f:
+        assert f.read() == original
+    assert not calendar_manager.operation_log.can_undo()
+
+def fail_writes(monkeypatch, calendar_manager):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(calendar_manager, "_write_calendar_changes", fail)
+
+def test_failed_single_writes_leave_the_events_as_in_the_file(tmp_path, monkeypatch):
+    (work, home), calendar_manager = load(tmp_path, "Work", "Home")
+    before = state(calendar_manager)
+    standup = calendar_manager.find_event(Event("", None, None, calendar_name="Work", uid="Work-standup"))
+    fail_writes(monkeypatch, calendar_manager)
+    start = datetime(2025, 3, 3, 12)
+
+    assert not calendar_manager.add_event(Event("Lunch", start, start + timedelta(hours=1), calendar_name="Work"))
+    assert state(calendar_manager) == before
+    moved = Event("Standup moved", start, start + timedelta(minutes=15), calendar_name="Work", uid="Work-standup")
+    assert not calendar_manager.edit_event(standup, moved)
+    assert state(calendar_manager) == before
+    other = Event("Standup", standup.start_time, standup.end_time, calendar_name="Home", uid="Work-standup")
+    assert not calendar_manager.edit_event(standup, other)
+    assert state(calendar_manager) == before
+    assert not calendar_manager.remove_event(standup)
+    assert state(calendar_manager) == before
+    assert not calendar_manager.operation_log.can_undo()
+
+def test_move_to_a_calendar_that_cannot_be_written_keeps_the_event(tmp_path, monkeypatch):
+    (work, home), calendar_manager = load(tmp_path, "Work", "Home")
+    before = state(calendar_manager)
+    standup = calendar_manager.find_event(Event("", None, None, calendar_name="Work", uid="Work-standup"))
+    write_calendar_changes = calendar_manager._write_calendar_changes
+
+    def fail_for_home(calendar_name, *args, **kwargs):
+        if calendar_name == "Home":
+            raise OSError("disk full")
+        return write_calendar_changes(calendar_name, *args, **kwargs)
+    monkeypatch.setattr(calendar_manager, "_write_calendar_changes", fail_for_home)
+    other = Event("Standup", standup.start_time, standup.end_time, calendar_name="Home", uid="Work-standup")
+    assert not calendar_manager.edit_event(standup, other)
+    assert state(calendar_manager) == before
+    assert state(CalendarManager([work, home])) == before
@@ -0,0 +1,49 @@
+from calendar_core import main
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Newelle Calendar//Tests//EN\r
+X-WR-CALNAME:Work\r
+BEGIN:VEVENT\r
+UID:monday\r
+SUMMARY:Planning\r
+DTSTART:20250303T090000\r
+DTEND:20250303T100000\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:wednesday\r
+SUMMARY:Review\r
+DTSTART:20250305T140000\r
+DTEND:20250305T150000\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:next-week\r
+SUMMARY:Retrospective\r
+DTSTART:20250310T160000\r
+DTEND:20250310T170000\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+def run(tmp_path, capsys, *command):
+    path = tmp_path / "work.ics"
+    path.write_bytes(CALENDAR.encode())
+    assert main(["-f", str(path), "--density", "verbose"] + list(command)) == 0
+    return capsys.readouterr().out
+
+def test_query_lists_every_day_of_a_range(tmp_path, capsys):
+    output = run(tmp_path, capsys, "query", "2025-03-03", "2025-03-07")
+    assert "Planning" in output
+    assert "Review" in output
+    assert "Retrospective" not in output
+
+def test_query_of_a_single_day(tmp_path, capsys):
+    output = run(tmp_path, capsys, "query", "2025-03-05")
+    assert "Review" in output
+    assert "Planning" not in output
+
+def test_search_by_name_within_a_range(tmp_path, capsys):
+    output = run(tmp_path, capsys, "search", "re", "2025-03-03", "2025-03-12")
+    assert "Review" in output
+    assert "Retrospective" in output
+    assert "Planning" not in output
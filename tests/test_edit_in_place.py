@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from calendar_core import CalendarManager, Event
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Newelle Calendar//Tests//EN\r
+X-WR-CALNAME:Work\r
+BEGIN:VEVENT\r
+UID:standup\r
+SUMMARY:Standup\r
+DTSTART:20250303T090000\r
+DTEND:20250303T091500\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:review\r
+SUMMARY:Review\r
+DTSTART:20250303T140000\r
+DTEND:20250303T150000\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+EDITS = 20
+
+def load(tmp_path):
+    path = tmp_path / "work.ics"
+    path.write_bytes(CALENDAR.encode())
+    return str(path), CalendarManager([str(path)])
+
+def sizes(calendar_manager, path):
+    """Get the stored events, the byte spans of the layout and the VEVENTs of the file."""
+    layout = calendar_manager._layouts[path]
+    with open(path, 'rb') as f:
+        vevents = f.read().count(b"BEGIN:VEVENT")
+    return calendar_manager.store.count(), sum(len(spans) for spans in layout.spans.values()), vevents
+
+def edited_version(event, i):
+    start = event.start_time + timedelta(minutes=5)
+    return Event(f"Standup {i}", start, start + timedelta(minutes=15), calendar_name=event.calendar_name, uid=event.uid)
+
+def check_only_new_version(calendar_manager, event, summary):
+    found = calendar_manager.find_event(event)
+    assert found.summary == summary
+    day = datetime(2025, 3, 3).date()
+    standups = [e for e in calendar_manager.get_events_for_date(day) if e.uid == "standup"]
+    assert [e.summary for e in standups] == [summary]
+
+def test_repeated_edit_event_does_not_grow_the_indexes(tmp_path):
+    path, calendar_manager = load(tmp_path)
+    initial = sizes(calendar_manager, path)
+    assert initial == (2, 2, 2)
+    event = calendar_manager.find_event(Event("", None, None, calendar_name="Work", uid="standup"))
+    for i in range(EDITS):
+        new_event = edited_version(event, i)
+        assert calendar_manager.edit_event(event, new_event)
+        assert sizes(calendar_manager, path) == initial
+        check_only_new_version(calendar_manager, event, f"Standup {i}")
+        event = new_event
+    reloaded = CalendarManager([path])
+    assert reloaded.store.count() == initial[0]
+    assert reloaded.find_event(event).summary == f"Standup {EDITS - 1}"
+
+def test_repeated_batch_edit_does_not_grow_the_indexes(tmp_path):
+    path, calendar_manager = load(tmp_path)
+    initial = sizes(calendar_manager, path)
+    event = calendar_manager.find_event(Event("", None, None, calendar_name="Work", uid="standup"))
+    for i in range(EDITS):
+        new_event = edited_version(event, i)
+        assert calendar_manager.apply_batch(edited=[(event, new_event)])
+        assert sizes(calendar_manager, path) == initial
+        check_only_new_version(calendar_manager, event, f"Standup {i}")
+        event = new_event
@@ -0,0 +1,31 @@
+from datetime import date, datetime, timedelta
+
+from calendar_core import Event, EventFormatter
+
+TODAY = date(2025, 3, 3)
+
+def event(summary, hour, location="", calendar_name="Work"):
+    start = datetime(2025, 3, 3, hour)
+    return Event(summary, start, start + timedelta(hours=1), location=location, calendar_name=calendar_name)
+
+def test_multiline_summary_stays_on_one_line():
+    events = [event("Standup\nwith the team", 9, "Room\n1"), event("Review", 14)]
+    for density in EventFormatter.DENSITIES:
+        text, shown = EventFormatter(density, today=TODAY).format(events, "Events:")
+        assert shown == 2
+        assert "Standup with the team" in text
+        assert "Standup\n" not in text and "Room\n" not in text
+
+def test_columnar_escapes_the_column_separator():
+    events = [event("Plan A|B", 9, "Room 1|2"), event("Review", 14)]
+    text, _ = EventFormatter("columnar", today=TODAY).format(events, "Events:")
+    rows = text.split("\n")[2:]
+    assert rows[0] == "03-03|09:00-10:00|Plan A\\|B|Room 1\\|2|"
+    assert [row.replace("\\|", "").count("|") for row in rows] == [4, 4]
+
+def test_denser_layouts_use_fewer_characters():
+    events = [event(f"Meeting {i}", 8 + i, f"Room {i}", ("Work", "Home")[i % 2]) for i in range(8)]
+    lengths = {density: len(EventFormatter(density, today=TODAY).format(events, "Events:")[0])
+               for density in EventFormatter.DENSITIES}
+    assert lengths["compact"] < lengths["verbose"]
+    assert lengths["columnar"] < lengths["verbose"]
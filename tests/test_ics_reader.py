@@ -0,0 +1,31 @@
+from calendar_core import CalendarManager, ICSReader
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Newelle Calendar//Tests//EN\r
+X-WR-CALNAME:My\\, Cal\\; Home\r
+BEGIN:VEVENT\r
+UID:event-1\r
+SUMMARY:Dentist\r
+DTSTART:20250301T090000\r
+DTEND:{end}\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+def write(tmp_path, end):
+    path = tmp_path / "home.ics"
+    path.write_bytes(CALENDAR.format(end=end).encode())
+    return str(path)
+
+def test_reader_unescapes_calendar_name(tmp_path):
+    reader = ICSReader(write(tmp_path, "20250301T100000"))
+    reader.read_events()
+    assert reader.calendar_name == "My, Cal; Home"
+
+def test_icalendar_fallback_gives_the_same_calendar_name(tmp_path):
+    fast = CalendarManager([write(tmp_path, "20250301T100000")])
+    # A DATE end with a DATE-TIME start is left to icalendar
+    fallback = CalendarManager([write(tmp_path, "20250302")])
+    assert fast.get_calendar_names() == ["My, Cal; Home"]
+    assert fallback.get_calendar_names() == fast.get_calendar_names()
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+from calendar_core import CalendarManager, CalendarOperationLog, Event
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Newelle Calendar//Tests//EN\r
+X-WR-CALNAME:{name}\r
+BEGIN:VEVENT\r
+UID:{name}-standup\r
+SUMMARY:Standup\r
+DTSTART:20250303T090000\r
+DTEND:20250303T091500\r
+X-CUSTOM-PROPERTY:kept\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+DAY = datetime(2025, 3, 3).date()
+
+def load(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / f"{name.lower()}.ics"
+        path.write_bytes(CALENDAR.format(name=name).encode())
+        paths.append(str(path))
+    return paths, CalendarManager(paths, operation_log=CalendarOperationLog(str(tmp_path / "operations.json")))
+
+def summaries(calendar_manager):
+    return sorted((e.calendar_name, e.summary) for e in calendar_manager.get_events_for_date(DAY))
+
+def lunch(calendar_name="Work"):
+    start = datetime(2025, 3, 3, 12)
+    return Event("Lunch", start, start + timedelta(hours=1), calendar_name=calendar_name)
+
+def find(calendar_manager, calendar_name, uid):
+    return calendar_manager.find_event(Event("", None, None, calendar_name=calendar_name, uid=uid))
+
+def test_undo_and_redo_an_added_event(tmp_path):
+    (work,), calendar_manager = load(tmp_path, "Work")
+    assert calendar_manager.add_event(lunch())
+    assert calendar_manager.undo() == ["Added 'Lunch' on 2025-03-03"]
+    assert summaries(calendar_manager) == [("Work", "Standup")]
+    assert summaries(CalendarManager([work])) == [("Work", "Standup")]
+    assert calendar_manager.operation_log.can_redo()
+
+    assert calendar_manager.redo() == ["Added 'Lunch' on 2025-03-03"]
+    assert summaries(CalendarManager([work])) == [("Work", "Lunch"), ("Work", "Standup")]
+    assert not calendar_manager.operation_log.can_redo()
+
+def test_undo_of_an_edit_restores_the_vevent_as_it_was(tmp_path):
+    (work,), calendar_manager = load(tmp_path, "Work")
+    with open(work, 'rb') as f:
+        original = f.read()
+    standup = find(calendar_manager, "Work", "Work-standup")
+    moved = Event("Standup moved", standup.start_time + timedelta(hours=1), standup.end_time + timedelta(hours=1),
+                  calendar_name="Work", uid=standup.uid)
+    assert calendar_manager.edit_event(standup, moved)
+    assert calendar_manager.undo() == ["Edited 'Standup moved' on 2025-03-03"]
+    with open(work, 'rb') as f:
+        assert f.read() == original
+
+def test_history_is_kept_across_sessions(tmp_path):
+    (work,), calendar_manager = load(tmp_path, "Work")
+    assert calendar_manager.remove_event(find(calendar_manager, "Work", "Work-standup"))
+    reloaded = CalendarManager([work], operation_log=CalendarOperationLog(str(tmp_path / "operations.json")))
+    assert reloaded.operation_log.get_undo_label() == "Removed 'Standup' on 2025-03-03"
+    assert reloaded.undo() == ["Removed 'Standup' on 2025-03-03"]
+    assert summaries(reloaded) == [("Work", "Standup")]
+
+def test_undo_stops_at_an_event_changed_since(tmp_path):
+    (work,), calendar_manager = load(tmp_path, "Work")
+    event = lunch()
+    assert calendar_manager.add_event(event)
+    # Changed by another program: the undo would lose that change
+    with open(work, 'rb') as f:
+        data = f.read()
+    with open(work, 'wb') as f:
+        f.write(data.replace(b"SUMMARY:Lunch", b"SUMMARY:Lunch with Anna"))
+    calendar_manager.reload_calendar_file(work)
+    assert calendar_manager.undo() == []
+    assert calendar_manager.operation_log.can_undo()
+    assert ("Work", "Lunch with Anna") in summaries(calendar_manager)
+
+def test_failed_undo_keeps_the_operation_to_undo(tmp_path, monkeypatch):
+    (work,), calendar_manager = load(tmp_path, "Work")
+    assert calendar_manager.add_event(lunch())
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(calendar_manager, "_write_calendar_changes", fail)
+    assert calendar_manager.undo() == []
+    assert calendar_manager.operation_log.can_undo()
+    assert not calendar_manager.operation_log.can_redo()
+    assert summaries(calendar_manager) == [("Work", "Lunch"), ("Work", "Standup")]
+
+def test_failed_undo_changes_back_the_calendars_already_written(tmp_path, monkeypatch):
+    (work, home), calendar_manager = load(tmp_path, "Work", "Home")
+    assert calendar_manager.apply_batch(added=[lunch("Work"), lunch("Home")])
+    before = summaries(calendar_manager)
+    write_calendar_changes = calendar_manager._write_calendar_changes
+    calls = []
+
+    def fail_second(*args, **kwargs):
+        calls.append(args[0])
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return write_calendar_changes(*args, **kwargs)
+    monkeypatch.setattr(calendar_manager, "_write_calendar_changes", fail_second)
+    assert calendar_manager.undo() == []
+    assert calendar_manager.operation_log.can_undo()
+    assert summaries(calendar_manager) == before
+    assert summaries(CalendarManager([work, home])) == before
@@ -0,0 +1,123 @@
+import os
+import threading
+import http.server
+from datetime import datetime, timedelta
+
+import pytest
+
+from calendar_core import CalendarManager, CalendarSubscriptions, Event
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Newelle Calendar//Tests//EN\r
+X-WR-CALNAME:Holidays\r
+BEGIN:VEVENT\r
+UID:easter\r
+SUMMARY:{summary}\r
+DTSTART;VALUE=DATE:20250420\r
+DTEND;VALUE=DATE:20250421\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        served = self.server.served
+        served["requests"].append(dict(self.headers))
+        if served["etag"] and self.headers.get("If-None-Match") == served["etag"]:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = served["body"].encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar")
+        if served["etag"]:
+            self.send_header("ETag", served["etag"])
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.served = {"body": CALENDAR.format(summary="Easter"), "etag": '"v1"', "requests": []}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def calendar_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/holidays.ics"
+
+@pytest.mark.parametrize("url, expected", [
+    ("webcal://example.com/cal/holidays.ics?lang=it", "https://example.com/cal/holidays.ics?lang=it"),
+    ("WEBCALS://example.com:8443/holidays.ics", "https://example.com:8443/holidays.ics"),
+    ("http://example.com/holidays.ics", "http://example.com/holidays.ics"),
+])
+def test_webcal_is_fetched_over_https(url, expected):
+    assert CalendarSubscriptions.is_remote(url)
+    assert CalendarSubscriptions.fetch_url(url) == expected
+
+def test_unchanged_calendar_is_not_written_again(server, tmp_path):
+    subscriptions = CalendarSubscriptions(str(tmp_path), 3600)
+    url = calendar_url(server)
+    path = subscriptions.cache_path(url)
+    assert subscriptions.refresh(url)
+    with open(path, 'rb') as f:
+        assert b"SUMMARY:Easter" in f.read()
+    assert "If-None-Match" not in server.served["requests"][0]
+
+    modified = os.stat(path).st_mtime_ns
+    assert not subscriptions.refresh(url)
+    assert server.served["requests"][1]["If-None-Match"] == '"v1"'
+    assert os.stat(path).st_mtime_ns == modified
+    assert subscriptions._load_meta(url)["etag"] == '"v1"'
+
+    server.served.update(body=CALENDAR.format(summary="Easter Sunday"), etag='"v2"')
+    assert subscriptions.refresh(url)
+    with open(path, 'rb') as f:
+        assert b"SUMMARY:Easter Sunday" in f.read()
+    assert subscriptions._load_meta(url)["etag"] == '"v2"'
+
+def test_missing_copy_is_downloaded_without_validators(server, tmp_path):
+    subscriptions = CalendarSubscriptions(str(tmp_path), 3600)
+    url = calendar_url(server)
+    subscriptions.refresh(url)
+    os.remove(subscriptions.cache_path(url))
+    # A 304 would leave the calendar without a local copy
+    assert subscriptions.refresh(url)
+    assert "If-None-Match" not in server.served["requests"][-1]
+
+def test_subscribed_calendar_is_read_only(server, tmp_path):
+    subscriptions = CalendarSubscriptions(str(tmp_path / "remote"), 3600)
+    url = calendar_url(server)
+    subscriptions.refresh(url)
+    remote_path = subscriptions.cache_path(url)
+    local_path = tmp_path / "home.ics"
+    local_path.write_bytes(CALENDAR.replace("Holidays", "Home").replace("easter", "home").format(summary="Party")
+                           .encode())
+    calendar_manager = CalendarManager([remote_path, str(local_path)], remote_sources={remote_path: url})
+    with open(remote_path, 'rb') as f:
+        original = f.read()
+
+    assert calendar_manager.is_read_only("Holidays")
+    assert calendar_manager.get_writable_calendar_names() == ["Home"]
+    easter = calendar_manager.find_event(Event("", None, None, calendar_name="Holidays", uid="easter"))
+    start = datetime(2025, 4, 21, 10)
+    lunch = Event("Lunch", start, start + timedelta(hours=1), calendar_name="Holidays")
+    assert not calendar_manager.add_event(lunch)
+    assert not calendar_manager.edit_event(easter, Event("Moved", start, start + timedelta(hours=1),
+                                                         calendar_name="Holidays", uid="easter"))
+    assert not calendar_manager.remove_event(easter)
+    assert not calendar_manager.apply_batch(removed=[easter])
+    with open(remote_path, 'rb') as f:
+        assert f.read() == original
+    day = calendar_manager.get_events_for_date(easter.start_time.date())
+    assert [e.summary for e in day if e.calendar_name == "Holidays"] == ["Easter"]